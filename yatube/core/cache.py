@@ -0,0 +1,284 @@
+"""Кеш с инвалидацией по тегам.
+
+Каждый тег - это ключ с версией в кеше. Запись сохраняется вместе с
+версиями своих тегов на момент, когда данные для нее начали читаться, и
+считается устаревшей, как только версия любого из тегов изменилась.
+Поэтому записи можно хранить долго: bump_tags() при изменении данных
+делает их недействительными сразу.
+"""
+import hashlib
+import math
+import random
+import threading
+import time
+from functools import partial, wraps
+from io import BytesIO
+from urllib.parse import unquote_to_bytes
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.encoding import force_bytes
+
+from .holes import fill_holes
+
+TAG_VERSION_KEY = 'tag_version:{}'
+PAGE_KEY = 'tagged_page:{}:{}'
+LOCK_KEY = '{}:lock'
+
+# Сколько устаревшая копия хранится после срока записи
+STALE_TIMEOUT = 60 * 10
+# Блокировка снимается сама, если пересчет упал вместе с процессом
+LOCK_TIMEOUT = 30
+# Сколько ждать пересчета, если копии страницы нет совсем: запрос все это
+# время занимает воркер, поэтому ожидание короткое, а дальше он считает
+# страницу сам
+LOCK_WAIT = 0.2
+LOCK_POLL_INTERVAL = 0.05
+# Коэффициент раннего обновления XFetch; больше - обновлять раньше
+XFETCH_BETA = 1
+# Заголовки посетителя, которые не переносятся в запрос без него
+PRIVATE_HEADERS = ('HTTP_COOKIE', 'HTTP_AUTHORIZATION')
+
+FRESH, EXPIRED, INVALID, MISSING = 'fresh', 'expired', 'invalid', 'missing'
+
+
+def tag_versions(tags):
+    """Возвращает словарь {тег: версия}, заводя версии новым тегам.
+
+    Начальная версия берется из часов, чтобы после вытеснения ключа
+    версии из кеша старые записи не стали снова действительными.
+    """
+    keys = {TAG_VERSION_KEY.format(tag): tag for tag in tags}
+    versions = {
+        keys[key]: version
+        for key, version in cache.get_many(list(keys)).items()
+    }
+    for key, tag in keys.items():
+        if tag not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[tag] = cache.get(key)
+    return versions
+
+
+def bump_tags(*tags):
+    """Делает недействительными все записи с любым из тегов."""
+    for tag in set(tags):
+        key = TAG_VERSION_KEY.format(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def _entry_state(entry):
+    """Возвращает FRESH, EXPIRED (истек срок), INVALID (изменились
+    теги) или MISSING для записи (versions, value, expires, delta).
+
+    Свежая запись с вероятностью, растущей к концу срока, считается
+    истекшей раньше (XFetch): чем дольше она вычисляется (delta), тем
+    раньше начинается ее обновление.
+    """
+    if entry is None:
+        return MISSING
+    versions, _, expires, delta = entry
+    if tag_versions(versions) != versions:
+        return INVALID
+    early = delta * XFETCH_BETA * -math.log(1 - random.random())
+    if time.time() + early >= expires:
+        return EXPIRED
+    return FRESH
+
+
+def get_tagged(key):
+    """Возвращает значение записи или None, если ее нет или она устарела."""
+    entry = cache.get(key)
+    if _entry_state(entry) == FRESH:
+        return entry[1]
+    return None
+
+
+def set_tagged(key, value, versions, timeout, delta=0):
+    """Сохраняет значение с версиями тегов, полученными до его вычисления.
+
+    Запись хранится еще STALE_TIMEOUT после срока, чтобы ее можно было
+    отдавать, пока вычисляется новая.
+    """
+    cache.set(
+        key, (versions, value, time.time() + timeout, delta),
+        timeout + STALE_TIMEOUT
+    )
+
+
+def run_in_background(function):
+    """Запускает функцию в отдельном потоке и закрывает его соединения
+    с базой по завершении.
+    """
+    def target():
+        try:
+            function()
+        finally:
+            connections.close_all()
+    threading.Thread(target=target, daemon=True).start()
+
+
+def add_cache_tags(request, *tags):
+    """Добавляет теги к странице, которая кешируется cache_tagged_page.
+
+    Вызывать нужно до чтения данных, от которых зависят теги. Возвращает
+    версии тегов, чтобы ими можно было пометить и части страницы.
+    """
+    versions = tag_versions(tags)
+    if hasattr(request, 'cache_tag_versions'):
+        request.cache_tag_versions.update(versions)
+    return versions
+
+
+def anonymous_request(path, meta=None):
+    """GET-запрос анонимного посетителя к path без HTTP-соединения.
+
+    Хост, схема и заголовки берутся из META исходного запроса, кроме
+    cookie и авторизации; без него запрос адресован localhost. Берутся
+    только строковые значения: поток тела и сокет сервера остаются у
+    исходного запроса.
+    """
+    path, _, query = path.partition('?')
+    environ = {
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'wsgi.url_scheme': 'http',
+    }
+    environ.update(
+        (key, value) for key, value in (meta or {}).items()
+        if isinstance(value, str) and key not in PRIVATE_HEADERS
+    )
+    environ.update({
+        'REQUEST_METHOD': 'GET',
+        # Как у WSGI-сервера: байты пути в latin-1
+        'PATH_INFO': unquote_to_bytes(path).decode('iso-8859-1'),
+        'QUERY_STRING': query,
+        'CONTENT_LENGTH': '0',
+        'wsgi.input': BytesIO(),
+    })
+    environ.pop('CONTENT_TYPE', None)
+    request = WSGIRequest(environ)
+    request.user = AnonymousUser()
+    return request
+
+
+def detached_request(request):
+    """Запрос для пересчета страницы в фоновом потоке.
+
+    Исходный запрос после ответа продолжает жить в своем потоке (сессия,
+    пользователь, состояние middleware), поэтому фон получает новый: тот
+    же путь с параметрами, хост и схема и анонимный пользователь.
+    Страница в кеше общая для всех, а зависящее от пользователя выводится
+    в дырках.
+    """
+    return anonymous_request(request.get_full_path_info(), request.META)
+
+
+def page_cache_key(key_prefix, request):
+    """Ключ страницы: путь с параметрами, без хоста и пользователя."""
+    return PAGE_KEY.format(
+        key_prefix,
+        hashlib.md5(force_bytes(request.get_full_path())).hexdigest()
+    )
+
+
+class TaggedPage:
+    """Кеширование ответов одного представления (см. cache_tagged_page)."""
+
+    def __init__(self, view, timeout, key_prefix, tags):
+        self.view = view
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self.tags = tags
+
+    def rebuild(self, request, key, args, kwargs):
+        started = time.monotonic()
+        request.cache_tag_versions = tag_versions(
+            self.tags(request, **kwargs) if self.tags else []
+        )
+        request.punch_holes = True
+        try:
+            response = self.view(request, *args, **kwargs)
+        finally:
+            # Страницы ошибок рисуются обработчиками без дырок
+            request.punch_holes = False
+        # Версии, с которыми страница собрана, едут вместе с ней
+        response.cache_tag_versions = request.cache_tag_versions
+        if response.status_code == 200:
+            set_tagged(
+                key, response, request.cache_tag_versions, self.timeout,
+                time.monotonic() - started
+            )
+        return response
+
+    def rebuild_and_unlock(self, request, key, args, kwargs):
+        try:
+            return self.rebuild(request, key, args, kwargs)
+        finally:
+            cache.delete(LOCK_KEY.format(key))
+
+    def wait_for_rebuild(self, key):
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            response = get_tagged(key)
+            if response is not None:
+                return response
+        return None
+
+    def get_response(self, request, args, kwargs):
+        key = page_cache_key(self.key_prefix, request)
+        entry = cache.get(key)
+        state = _entry_state(entry)
+        if state == FRESH:
+            return entry[1]
+        if cache.add(LOCK_KEY.format(key), 1, LOCK_TIMEOUT):
+            if state != EXPIRED:
+                return self.rebuild_and_unlock(request, key, args, kwargs)
+            run_in_background(partial(
+                self.rebuild_and_unlock, detached_request(request), key,
+                args, kwargs
+            ))
+            return entry[1]
+        if entry is not None:
+            return entry[1]
+        response = self.wait_for_rebuild(key)
+        if response is None:
+            response = self.rebuild(request, key, args, kwargs)
+        return response
+
+
+def cache_tagged_page(timeout, key_prefix, tags=None):
+    """Кеширует GET-ответы представления до изменения их тегов.
+
+    tags(request, **kwargs) возвращает теги, известные до вызова
+    представления; остальные представление добавляет add_cache_tags.
+    Ответы различаются только по пути с параметрами: части страницы,
+    зависящие от пользователя, выводятся тегом {% hole %} и заполняются
+    для каждого запроса (см. core.holes).
+
+    Страницу пересчитывает только запрос, взявший блокировку; остальные
+    тем временем получают прежнюю копию или, если ее нет, ждут до
+    LOCK_WAIT секунд и считают страницу сами. Страница с истекшим сроком
+    отдается сразу, а пересчитывается в фоновом потоке по копии запроса
+    (detached_request); страница с измененными тегами пересчитывается в
+    самом запросе.
+    """
+    def decorator(view):
+        page = TaggedPage(view, timeout, key_prefix, tags)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            response = page.get_response(request, args, kwargs)
+            patch_vary_headers(response, ('Cookie',))
+            return fill_holes(request, response)
+        return wrapper
+    return decorator
@@ -0,0 +1,854 @@
+"""Кеш в файле SQLite, общий для всех процессов на одном сервере.
+
+В отличие от LocMemCache, записи видят все воркеры gunicorn, поэтому
+инвалидация в одном процессе сразу действует в остальных, а доля
+попаданий не падает с ростом числа воркеров. Файл открывается в режиме
+WAL: читатели не блокируют писателя и друг друга.
+
+Пример настройки:
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache_backends.SQLiteCache',
+            'LOCATION': '/var/tmp/yatube_cache.sqlite3',
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        }
+    }
+"""
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# Ограничение на число параметров в одном запросе
+BATCH_SIZE = 500
+# Как часто (в записях на соединение) проверять переполнение кеша
+CULL_CHECK_INTERVAL = 64
+# Время последнего чтения обновляется не чаще, чем раз в столько секунд
+ACCESS_GRANULARITY = 1
+
+# Статистика InstrumentedCache ведется по группам ключей: по началу ключа
+# до разделителя, а для перечисленных групп - по нескольким частям
+KEY_SEPARATOR_RE = re.compile(r'[:.]|\|\|')
+KEY_PREFIX_DEPTH = {
+    'tagged_page': 2,
+    'tag_version': 2,
+    'entity': 2,
+    'sorl-thumbnail': 2,
+    'views': 5,
+}
+STATS_PROCESSES_KEY = 'cache_stats:processes'
+STATS_KEY = 'cache_stats:process:{}'
+STATS_TIMEOUT = 60 * 60 * 24 * 7
+STATS_FIELDS = (
+    'operations', 'hits', 'misses', 'sets', 'deletes', 'evictions', 'bytes',
+)
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires REAL,
+        accessed REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS cache_expires_idx ON cache (expires);
+    CREATE INDEX IF NOT EXISTS cache_accessed_idx ON cache (accessed);
+'''
+
+
+class SQLiteCache(BaseCache):
+    """Кеш с вытеснением по TTL и по давности последнего чтения (LRU)."""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        if not location:
+            raise ImproperlyConfigured(
+                'Для SQLiteCache нужно указать путь к файлу в LOCATION'
+            )
+        self._location = location
+        self._local = threading.local()
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self._location, timeout=30, isolation_level=None
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.writes = 0
+        return connection
+
+    @contextmanager
+    def _write(self):
+        """Транзакция с блокировкой на запись.
+
+        Чтение и запись внутри нее атомарны для всех процессов.
+        """
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _is_alive(self, expires, now):
+        return expires is None or expires > now
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._get_many([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_key(key, version=version): key for key in keys}
+        for key in keys:
+            self.validate_key(key)
+        return {
+            keys[key]: value
+            for key, value in self._get_many(list(keys)).items()
+        }
+
+    def _get_many(self, keys):
+        now = time.time()
+        found = {}
+        expired = []
+        for start in range(0, len(keys), BATCH_SIZE):
+            batch = keys[start:start + BATCH_SIZE]
+            rows = self._connection.execute(
+                'SELECT key, value, expires FROM cache WHERE key IN (%s)'
+                % ', '.join(['?'] * len(batch)),
+                batch
+            )
+            for key, value, expires in rows:
+                if self._is_alive(expires, now):
+                    found[key] = pickle.loads(value)
+                else:
+                    expired.append(key)
+        if found:
+            self._touch_accessed(list(found), now)
+        if expired:
+            self._delete_many(expired)
+        return found
+
+    def _touch_accessed(self, keys, now):
+        for start in range(0, len(keys), BATCH_SIZE):
+            batch = keys[start:start + BATCH_SIZE]
+            self._connection.execute(
+                'UPDATE cache SET accessed = ? '
+                'WHERE accessed < ? AND key IN (%s)'
+                % ', '.join(['?'] * len(batch)),
+                [now, now - ACCESS_GRANULARITY, *batch]
+            )
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        rows = []
+        for key, value in data.items():
+            key = self.make_key(key, version=version)
+            self.validate_key(key)
+            rows.append((
+                key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                expires, now,
+            ))
+        with self._write() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires, accessed) '
+                'VALUES (?, ?, ?, ?)',
+                rows
+            )
+        self._maybe_cull(len(rows))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        with self._write() as connection:
+            connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now)
+            )
+            added = connection.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires, accessed) '
+                'VALUES (?, ?, ?, ?)',
+                (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                 self.get_backend_timeout(timeout), now)
+            ).rowcount
+        if added:
+            self._maybe_cull(1)
+        return bool(added)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._write() as connection:
+            row = connection.execute(
+                'SELECT value, expires FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or not self._is_alive(row[1], time.time()):
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            connection.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key)
+            )
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._write() as connection:
+            touched = connection.execute(
+                'UPDATE cache SET expires = ? '
+                'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), key, time.time())
+            ).rowcount
+        return bool(touched)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._connection.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time())
+        ).fetchone() is not None
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._delete_many([key])
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        for key in keys:
+            self.validate_key(key)
+        self._delete_many(keys)
+
+    def _delete_many(self, keys):
+        for start in range(0, len(keys), BATCH_SIZE):
+            batch = keys[start:start + BATCH_SIZE]
+            self._connection.execute(
+                'DELETE FROM cache WHERE key IN (%s)'
+                % ', '.join(['?'] * len(batch)),
+                batch
+            )
+
+    def clear(self):
+        self._connection.execute('DELETE FROM cache')
+
+    def _maybe_cull(self, written):
+        self._local.writes += written
+        if self._local.writes < CULL_CHECK_INTERVAL:
+            return
+        self._local.writes = 0
+        self._cull()
+
+    def _cull(self):
+        """Удаляет просроченные записи, а при переполнении - долю
+        1 / CULL_FREQUENCY давно не читавшихся.
+        """
+        with self._write() as connection:
+            connection.execute(
+                'DELETE FROM cache WHERE expires <= ?', (time.time(),)
+            )
+            count = connection.execute(
+                'SELECT COUNT(*) FROM cache'
+            ).fetchone()[0]
+            if count > self._max_entries:
+                excess = count - self._max_entries
+                if self._cull_frequency:
+                    excess = max(excess, count // self._cull_frequency)
+                else:
+                    excess = count
+                connection.execute(
+                    'DELETE FROM cache WHERE key IN ('
+                    'SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                    (excess,)
+                )
+
+    def close(self, **kwargs):
+        """Соединения живут в потоках до их завершения и между запросами
+        не закрываются: открытие файла дороже самих запросов.
+        """
+
+
+class LocalStore:
+    """LRU-словарь процесса для TieredCache.
+
+    Значения хранятся сериализованными, как в LocMemCache, чтобы
+    изменение полученного объекта не меняло запись.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Последнее известное поколение инвалидаций и время его проверки
+        self.generation = None
+        self.checked = 0
+        self.hits = self.l2_hits = self.misses = 0
+        self.reset_process()
+
+    def reset_process(self):
+        """Заводит метку процесса для журнала; после fork записи
+        и неопубликованные ключи родителя к процессу не относятся.
+        """
+        self.pid = os.getpid()
+        self.token = f'{self.pid}:{time.time_ns()}'
+        # Измененные ключи, о которых еще не сообщили остальным процессам
+        self.unpublished = []
+        self.published = time.monotonic()
+        with self.lock:
+            self.entries.clear()
+
+    def take_unpublished(self):
+        with self.lock:
+            keys, self.unpublished = self.unpublished, []
+            self.published = time.monotonic()
+        return keys
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return pickle.loads(value)
+
+    def set(self, key, value, expires):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_local_stores = {}
+_local_stores_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    """Двухуровневый кеш: LRU в памяти процесса (L1) перед общим
+    хранилищем (L2, по умолчанию SQLiteCache).
+
+    Измененные ключи процесс копит и публикует пачкой не чаще, чем раз
+    в L1_CHECK_INTERVAL секунд и в конце запроса (close): одно увеличение
+    счетчика поколений в L2 и одна запись ячеек журнала из L1_LOG_SIZE
+    на всю пачку. Процессы сверяют поколение не чаще, чем раз в
+    L1_CHECK_INTERVAL секунд, и удаляют из L1 ключи из журнала, кроме
+    опубликованных ими самими, а если журнал переполнился - весь L1.
+    Поэтому чтение из L1 отстает от записей других процессов не больше
+    чем на удвоенный L1_CHECK_INTERVAL (или до конца записавшего
+    запроса); записи своего процесса видны сразу.
+
+    Параметры OPTIONS: L2_BACKEND, L1_MAX_ENTRIES, L1_TIMEOUT,
+    L1_CHECK_INTERVAL, L1_LOG_SIZE; остальные передаются L2.
+    """
+    GENERATION_KEY = 'tiered:generation'
+    LOG_KEY = 'tiered:log:{}'
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = dict(params.get('OPTIONS', {}))
+        l2_backend = options.pop(
+            'L2_BACKEND', 'core.cache_backends.SQLiteCache'
+        )
+        self.l1_timeout = options.pop('L1_TIMEOUT', 60)
+        self.check_interval = options.pop('L1_CHECK_INTERVAL', 0.1)
+        self.log_size = options.pop('L1_LOG_SIZE', 1000)
+        l1_max_entries = options.pop('L1_MAX_ENTRIES', 1000)
+        self.l2 = import_string(l2_backend)(
+            location, {**params, 'OPTIONS': options}
+        )
+        with _local_stores_lock:
+            self.l1 = _local_stores.setdefault(
+                (l2_backend, location), LocalStore(l1_max_entries)
+            )
+
+    def _sync(self):
+        """Сбрасывает из L1 ключи, измененные другими процессами."""
+        now = time.monotonic()
+        l1 = self.l1
+        if l1.pid != os.getpid():
+            l1.reset_process()
+        if now - l1.published >= self.check_interval:
+            self.publish()
+        if now - l1.checked < self.check_interval:
+            return
+        l1.checked = now
+        generation = self.l2.get(self.GENERATION_KEY, 0)
+        known, l1.generation = l1.generation, generation
+        if known is None or generation == known:
+            return
+        if not known < generation <= known + self.log_size:
+            l1.clear()
+            return
+        expected = {
+            self.LOG_KEY.format(number % self.log_size): number
+            for number in range(known + 1, generation + 1)
+        }
+        log = self.l2.get_many(list(expected))
+        keys = []
+        for slot, number in expected.items():
+            if slot not in log or log[slot][0] != number:
+                # Ячейку уже перезаписали или еще не записали
+                l1.clear()
+                return
+            _, key, token = log[slot]
+            # Свои записи процесс уже внес в L1
+            if token != l1.token:
+                keys.append(key)
+        l1.discard(keys)
+
+    def _publish(self, keys):
+        """Запоминает измененные ключи для публикации пачкой."""
+        l1 = self.l1
+        with l1.lock:
+            l1.unpublished.extend(keys)
+        if time.monotonic() - l1.published >= self.check_interval:
+            self.publish()
+
+    def publish(self):
+        """Сообщает остальным процессам об изменении накопленных ключей."""
+        keys = list(dict.fromkeys(self.l1.take_unpublished()))
+        if not keys:
+            return
+        try:
+            last = self.l2.incr(self.GENERATION_KEY, len(keys))
+        except ValueError:
+            self.l2.add(self.GENERATION_KEY, 0, None)
+            last = self.l2.incr(self.GENERATION_KEY, len(keys))
+        first = last - len(keys) + 1
+        self.l2.set_many(
+            {
+                self.LOG_KEY.format(number % self.log_size): (
+                    number, key, self.l1.token
+                )
+                for number, key in enumerate(keys, first)
+            },
+            None
+        )
+
+    def _l1_expires(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        expires = time.time() + self.l1_timeout
+        return expires if timeout is None else min(timeout, expires)
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        now = time.time()
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.l1.get(self.l2.make_key(key, version), now)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        self.l1.hits += len(found)
+        if missing:
+            fetched = self.l2.get_many(missing, version=version)
+            expires = now + self.l1_timeout
+            for key, value in fetched.items():
+                self.l1.set(self.l2.make_key(key, version), value, expires)
+            self.l1.l2_hits += len(fetched)
+            self.l1.misses += len(missing) - len(fetched)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set_many(data, timeout, version=version)
+        expires = self._l1_expires(timeout)
+        keys = [self.l2.make_key(key, version) for key in data]
+        for key, value in zip(keys, data.values()):
+            self.l1.set(key, value, expires)
+        self._publish(keys)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.l2.add(key, value, timeout, version=version)
+        if added:
+            made_key = self.l2.make_key(key, version)
+            self.l1.set(made_key, value, self._l1_expires(timeout))
+            self._publish([made_key])
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version=version)
+        made_key = self.l2.make_key(key, version)
+        # Срок записи в L2 неизвестен, поэтому в L1 ее не кладем
+        self.l1.discard([made_key])
+        self._publish([made_key])
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, version=version) is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        self.l2.delete_many(keys, version=version)
+        keys = [self.l2.make_key(key, version) for key in keys]
+        self.l1.discard(keys)
+        self._publish(keys)
+
+    def clear(self):
+        self.l2.clear()
+        self.l1.clear()
+
+    def stats(self):
+        """Возвращает число и доли попаданий в L1 и L2 в этом процессе."""
+        l1 = self.l1
+        total = l1.hits + l1.l2_hits + l1.misses
+        return {
+            'l1_hits': l1.hits,
+            'l2_hits': l1.l2_hits,
+            'misses': l1.misses,
+            'l1_ratio': l1.hits / total if total else 0,
+            'l2_ratio': l1.l2_hits / total if total else 0,
+        }
+
+    def close(self, **kwargs):
+        self.publish()
+        self.l2.close(**kwargs)
+
+
+def key_prefix(key):
+    """Группа ключа для статистики, например 'tagged_page:index_page'."""
+    separators = [match.start() for match in KEY_SEPARATOR_RE.finditer(key)]
+    if not separators:
+        return key
+    depth = KEY_PREFIX_DEPTH.get(key[:separators[0]], 1)
+    return key[:separators[min(depth, len(separators)) - 1]]
+
+
+class CacheStats:
+    """Счетчики операций InstrumentedCache по группам ключей в процессе.
+
+    Чтобы отличать вытеснения от обычных промахов, запоминаются сроки
+    последних записанных ключей: промах по ключу, который процесс
+    записал и не удалял, до истечения его срока считается вытеснением.
+    При общем для процессов кеше сюда попадают и удаления в других
+    процессах.
+    """
+
+    def __init__(self, tracked_keys):
+        self.tracked_keys = tracked_keys
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        # Номер ячейки снимка в общем кеше, выдается при первом сохранении
+        self.slot = None
+        self.prefixes = {}
+        self.written = OrderedDict()
+        self.flushed = time.monotonic()
+
+    def check_fork(self):
+        """После fork счетчики родителя не должны учитываться дважды."""
+        if self.pid != os.getpid():
+            self.reset()
+
+    def record(self, elapsed, counts):
+        """Добавляет счетчики {ключ: {показатель: значение}}; время
+        операции делится поровну между ключами.
+        """
+        share = elapsed / len(counts) if counts else 0
+        with self.lock:
+            self.check_fork()
+            for key, values in counts.items():
+                counter = self.prefixes.setdefault(key_prefix(key), Counter())
+                counter.update(values)
+                counter['operations'] += 1
+                counter['seconds'] += share
+
+    def remember(self, key, expires):
+        with self.lock:
+            self.written[key] = expires
+            self.written.move_to_end(key)
+            while len(self.written) > self.tracked_keys:
+                self.written.popitem(last=False)
+
+    def forget(self, key):
+        """Забывает ключ; возвращает 1, если пропавшая запись еще не
+        должна была истечь.
+        """
+        with self.lock:
+            expires = self.written.pop(key, 0)
+        return int(expires is None or expires > time.time())
+
+    def snapshot(self):
+        with self.lock:
+            self.check_fork()
+            self.flushed = time.monotonic()
+            return {
+                prefix: Counter(counter)
+                for prefix, counter in self.prefixes.items()
+            }
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+_MISSING = object()
+
+
+class InstrumentedCache(BaseCache):
+    """Обертка над кешем, которая считает попадания, промахи, записи,
+    удаления, вытеснения, объем записанных значений и время операций
+    по группам ключей (см. key_prefix).
+
+    Каждый процесс в конце запроса (close), но не чаще, чем раз
+    в STATS_FLUSH_INTERVAL секунд, сохраняет свои счетчики в обернутый
+    кеш; collected_stats() складывает их по всем процессам. Для
+    LocMemCache, у которого хранилище в каждом процессе свое, это
+    счетчики только текущего процесса.
+
+    Параметры OPTIONS: BACKEND (обернутый кеш), STATS_FLUSH_INTERVAL,
+    STATS_TRACKED_KEYS; остальные передаются обернутому кешу.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = dict(params.get('OPTIONS', {}))
+        backend = options.pop(
+            'BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        )
+        self.flush_interval = options.pop('STATS_FLUSH_INTERVAL', 10)
+        tracked_keys = options.pop('STATS_TRACKED_KEYS', 100000)
+        self.cache = import_string(backend)(
+            location, {**params, 'OPTIONS': options}
+        )
+        with _stats_lock:
+            self.stats = _stats.setdefault(
+                (backend, location), CacheStats(tracked_keys)
+            )
+
+    def _record(self, elapsed, counts):
+        self.stats.record(elapsed, counts)
+
+    def _read(self, key, hit):
+        if hit:
+            return {'hits': 1}
+        return {'misses': 1, 'evictions': self.stats.forget(key)}
+
+    def _written(self, key, value, timeout):
+        self.stats.remember(key, self.cache.get_backend_timeout(timeout))
+        return {
+            'sets': 1,
+            'bytes': len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+        }
+
+    def _deleted(self, key):
+        self.stats.forget(key)
+        return {'deletes': 1}
+
+    def get(self, key, default=None, version=None):
+        started = time.perf_counter()
+        value = self.cache.get(key, _MISSING, version=version)
+        hit = value is not _MISSING
+        self._record(
+            time.perf_counter() - started, {key: self._read(key, hit)}
+        )
+        return value if hit else default
+
+    def get_many(self, keys, version=None):
+        started = time.perf_counter()
+        found = self.cache.get_many(keys, version=version)
+        elapsed = time.perf_counter() - started
+        self._record(
+            elapsed, {key: self._read(key, key in found) for key in keys}
+        )
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        started = time.perf_counter()
+        self.cache.set(key, value, timeout, version=version)
+        elapsed = time.perf_counter() - started
+        self._record(elapsed, {key: self._written(key, value, timeout)})
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        started = time.perf_counter()
+        failed = self.cache.set_many(data, timeout, version=version)
+        elapsed = time.perf_counter() - started
+        self._record(elapsed, {
+            key: self._written(key, value, timeout)
+            for key, value in data.items() if key not in (failed or ())
+        })
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        started = time.perf_counter()
+        added = self.cache.add(key, value, timeout, version=version)
+        elapsed = time.perf_counter() - started
+        self._record(elapsed, {
+            key: self._written(key, value, timeout) if added else {}
+        })
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        started = time.perf_counter()
+        try:
+            value = self.cache.incr(key, delta, version=version)
+        except ValueError:
+            self._record(
+                time.perf_counter() - started, {key: self._read(key, False)}
+            )
+            raise
+        self._record(
+            time.perf_counter() - started, {key: self._read(key, True)}
+        )
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        started = time.perf_counter()
+        touched = self.cache.touch(key, timeout, version=version)
+        self._record(
+            time.perf_counter() - started, {key: self._read(key, touched)}
+        )
+        return touched
+
+    def has_key(self, key, version=None):
+        started = time.perf_counter()
+        found = self.cache.has_key(key, version=version)
+        self._record(
+            time.perf_counter() - started, {key: self._read(key, found)}
+        )
+        return found
+
+    def delete(self, key, version=None):
+        started = time.perf_counter()
+        self.cache.delete(key, version=version)
+        self._record(time.perf_counter() - started, {key: self._deleted(key)})
+
+    def delete_many(self, keys, version=None):
+        started = time.perf_counter()
+        self.cache.delete_many(keys, version=version)
+        elapsed = time.perf_counter() - started
+        self._record(elapsed, {key: self._deleted(key) for key in keys})
+
+    def clear(self):
+        self.cache.clear()
+        with self.stats.lock:
+            self.stats.written.clear()
+
+    def close(self, **kwargs):
+        # Вызывается по окончании запроса, уже после отправки ответа
+        if time.monotonic() - self.stats.flushed >= self.flush_interval:
+            self.flush_stats()
+        self.cache.close(**kwargs)
+
+    def register_process(self, snapshot):
+        """Выдает процессу ячейку и сохраняет в нее первый снимок
+        счетчиков.
+
+        Номер выдает атомарный incr, а ячейка занимается через add: если
+        счетчик номеров вытеснили и он начался заново, ячейки работающих
+        процессов пропускаются, а не затираются.
+        """
+        while True:
+            self.cache.add(STATS_PROCESSES_KEY, 0, STATS_TIMEOUT)
+            try:
+                slot = self.cache.incr(STATS_PROCESSES_KEY)
+            except ValueError:
+                # Счетчик вытеснили между add и incr
+                continue
+            if self.cache.add(STATS_KEY.format(slot), snapshot,
+                              STATS_TIMEOUT):
+                return slot
+
+    def process_keys(self):
+        count = self.cache.get(STATS_PROCESSES_KEY, 0)
+        return [STATS_KEY.format(slot) for slot in range(1, count + 1)]
+
+    def flush_stats(self):
+        """Сохраняет счетчики процесса в обернутый кеш."""
+        snapshot = self.stats.snapshot()
+        with self.stats.lock:
+            slot = self.stats.slot
+            # После вытеснения счетчика номеров ячейка за его значением
+            # не видна collected_stats, поэтому процесс берет новую
+            if slot is None or self.cache.get(STATS_PROCESSES_KEY, 0) < slot:
+                if slot is not None:
+                    self.cache.delete(STATS_KEY.format(slot))
+                self.stats.slot = self.register_process(snapshot)
+                return
+        self.cache.set(STATS_KEY.format(slot), snapshot, STATS_TIMEOUT)
+
+    def collected_stats(self):
+        """Возвращает счетчики всех процессов: {группа: Counter}."""
+        self.flush_stats()
+        total = {}
+        for snapshot in self.cache.get_many(self.process_keys()).values():
+            for prefix, counter in snapshot.items():
+                total.setdefault(prefix, Counter()).update(counter)
+        return total
+
+    def reset_stats(self):
+        self.cache.delete_many(self.process_keys() + [STATS_PROCESSES_KEY])
+        with self.stats.lock:
+            self.stats.reset()
+
+
+def stats_table(stats):
+    """Строки отчета по статистике InstrumentedCache.collected_stats(),
+    по убыванию числа операций.
+    """
+    rows = []
+    for prefix, counter in sorted(
+        stats.items(), key=lambda item: -item[1]['operations']
+    ):
+        reads = counter['hits'] + counter['misses']
+        rows.append({
+            'prefix': prefix,
+            **{field: counter[field] for field in STATS_FIELDS},
+            'hit_ratio': counter['hits'] / reads if reads else None,
+            'latency': 1e6 * counter['seconds'] / counter['operations'],
+            'value_size': (
+                counter['bytes'] // counter['sets'] if counter['sets']
+                else None
+            ),
+        })
+    return rows
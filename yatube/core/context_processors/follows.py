@@ -0,0 +1,8 @@
+from posts.relations import get_follow_resolver
+
+
+def follows(request):
+    """Добавляет резолвер подписок зрителя; запрос к базе - при обращении."""
+    return {
+        'follows': get_follow_resolver(request)
+    }
@@ -0,0 +1,55 @@
+"""Дырки в кешируемых страницах.
+
+Части страницы, зависящие от пользователя (шапка, кнопки подписки,
+CSRF-токен), выводятся тегом {% hole %}. Пока страница собирается для
+общего кеша, вместо них в HTML остаются метки с именем шаблона и его
+параметрами, а fill_holes() перед отправкой ответа заменяет метки
+шаблонами, отрисованными для текущего запроса. Так одна копия страницы
+в кеше подходит всем пользователям.
+"""
+import json
+import re
+
+from django.template.loader import render_to_string
+from django.utils.encoding import force_bytes, force_text
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.utils.safestring import SafeData, mark_safe
+
+HOLE_RE = re.compile(r'<!--hole:([A-Za-z0-9_-]+)-->')
+
+
+def punching_holes(request):
+    """Собирается ли страница этого запроса для общего кеша."""
+    return getattr(request, 'punch_holes', False)
+
+
+def make_placeholder(template_name, values):
+    """Возвращает метку дырки; безопасные строки остаются безопасными."""
+    values = {
+        name: [value, isinstance(value, SafeData)]
+        for name, value in values.items()
+    }
+    payload = json.dumps([template_name, values], ensure_ascii=False)
+    return f'<!--hole:{urlsafe_base64_encode(force_bytes(payload))}-->'
+
+
+def render_hole(request, payload):
+    template_name, values = json.loads(
+        force_text(urlsafe_base64_decode(payload))
+    )
+    context = {
+        name: mark_safe(value) if safe else value
+        for name, (value, safe) in values.items()
+    }
+    return render_to_string(template_name, context, request=request)
+
+
+def fill_holes(request, response):
+    """Заполняет дырки в ответе для пользователя текущего запроса."""
+    content = response.content.decode(response.charset)
+    if '<!--hole:' not in content:
+        return response
+    response.content = HOLE_RE.sub(
+        lambda match: render_hole(request, match.group(1)), content
+    )
+    return response
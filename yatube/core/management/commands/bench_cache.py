@@ -0,0 +1,133 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+from multiprocessing import Pool
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.cache_backends import SQLiteCache, TieredCache
+
+VALUE = {'html': 'x' * 2000, 'ids': list(range(20))}
+# Сколько ключей читается повторно, как главная страница и шапки групп
+HOT_KEYS = 100
+
+
+def make_caches(directory):
+    params = {'OPTIONS': {'MAX_ENTRIES': 100000}}
+    return {
+        'locmem': LocMemCache('bench', params),
+        'file': FileBasedCache(os.path.join(directory, 'file'), params),
+        'sqlite': SQLiteCache(
+            os.path.join(directory, 'cache.sqlite3'), params
+        ),
+        'tiered': TieredCache(
+            os.path.join(directory, 'tiered.sqlite3'), params
+        ),
+    }
+
+
+def hit_rate_worker(args):
+    """Читает ключи из общего набора, заполняя кеш при промахах.
+
+    LocMem-кеш в каждом процессе свой, поэтому его приходится прогревать
+    заново в каждом воркере.
+    """
+    directory, name, keys, reads, seed = args
+    cache = make_caches(directory)[name]
+    stats = cache.stats() if name == 'tiered' else {'l1_hits': 0}
+    generator = random.Random(seed)
+    hits = 0
+    for _ in range(reads):
+        key = f'page:{generator.randrange(keys)}'
+        if cache.get(key) is None:
+            cache.set(key, VALUE)
+        else:
+            hits += 1
+    # Счетчики L1 общие для процесса, а воркеры пула переиспользуются
+    l1_hits = (
+        cache.stats()['l1_hits'] - stats['l1_hits'] if name == 'tiered' else 0
+    )
+    return hits, l1_hits
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает LocMemCache, FileBasedCache, SQLiteCache и TieredCache: '
+        'задержку '
+        'операций в одном процессе и долю попаданий для нескольких воркеров'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=5000)
+        parser.add_argument('--batch', type=int, default=20,
+                            help='Ключей в одном get_many')
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--keys', type=int, default=500,
+                            help='Число разных страниц для доли попаданий')
+
+    def timed(self, operation, count):
+        start = time.perf_counter()
+        for i in range(count):
+            operation(i)
+        return 1e6 * (time.perf_counter() - start) / count
+
+    def measure_latency(self, cache, options):
+        count, batch = options['operations'], options['batch']
+        cache.set('counter', 0)
+        timings = {
+            'set': self.timed(
+                lambda i: cache.set(f'key:{i}', VALUE), count
+            ),
+            'get': self.timed(lambda i: cache.get(f'key:{i}'), count),
+            'get горячих': self.timed(
+                lambda i: cache.get(f'key:{i % HOT_KEYS}'), count
+            ),
+            'get_many': self.timed(
+                lambda i: cache.get_many(
+                    [f'key:{(i + j) % count}' for j in range(batch)]
+                ),
+                count // batch or 1
+            ),
+            'incr': self.timed(lambda i: cache.incr('counter'), count),
+        }
+        return ', '.join(
+            f'{operation} {timing:.1f} мкс'
+            for operation, timing in timings.items()
+        )
+
+    def measure_hit_rate(self, directory, name, options):
+        processes = options['processes']
+        reads = options['operations']
+        with Pool(processes) as pool:
+            results = pool.map(hit_rate_worker, [
+                (directory, name, options['keys'], reads, seed)
+                for seed in range(processes)
+            ])
+        total = reads * processes
+        hits = sum(hits for hits, _ in results)
+        l1_hits = sum(l1_hits for _, l1_hits in results)
+        return 100 * hits / total, 100 * l1_hits / total
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench_cache_')
+        try:
+            for name, cache in make_caches(directory).items():
+                self.stdout.write(
+                    f'{name:>7}: {self.measure_latency(cache, options)}'
+                )
+                cache.clear()
+            for name in make_caches(directory):
+                rate, l1_rate = self.measure_hit_rate(
+                    directory, name, options
+                )
+                self.stdout.write(
+                    f'{name:>7}: доля попаданий для {options["processes"]} '
+                    f'процессов {rate:.1f}%'
+                    + (f', из них в L1 {l1_rate:.1f}%' if l1_rate else '')
+                )
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,40 @@
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+
+from core.cache_backends import InstrumentedCache, stats_table
+
+
+def percent(value):
+    return '-' if value is None else f'{100 * value:.1f}%'
+
+
+class Command(BaseCommand):
+    help = (
+        'Выводит попадания, промахи, записи, вытеснения, объем значений '
+        'и задержку кеша по группам ключей (нужен CACHE_STATS=True)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Обнулить статистику после вывода')
+
+    def handle(self, *args, **options):
+        cache = caches['default']
+        if not isinstance(cache, InstrumentedCache):
+            raise CommandError(
+                'Кеш не инструментирован: задайте CACHE_STATS=True'
+            )
+        self.stdout.write(
+            f'{"группа ключей":<40} {"операций":>9} {"попаданий":>9} '
+            f'{"промахов":>9} {"записей":>8} {"вытеснено":>9} '
+            f'{"размер":>8} {"мкс":>7}'
+        )
+        for row in stats_table(cache.collected_stats()):
+            self.stdout.write(
+                f'{row["prefix"][:40]:<40} {row["operations"]:>9} '
+                f'{percent(row["hit_ratio"]):>9} {row["misses"]:>9} '
+                f'{row["sets"]:>8} {row["evictions"]:>9} '
+                f'{row["value_size"] or "-":>8} {row["latency"]:>7.1f}'
+            )
+        if options['reset']:
+            cache.reset_stats()
@@ -0,0 +1,43 @@
+from django.db.migrations import AddIndex
+
+
+class AddIndexConcurrently(AddIndex):
+    """Создает индекс, не блокируя запись в таблицу.
+
+    На PostgreSQL индекс строится через CREATE INDEX CONCURRENTLY, поэтому
+    миграция с этой операцией должна быть объявлена с atomic = False.
+    На остальных базах работает как обычный AddIndex.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            sql = str(self.index.create_sql(model, schema_editor))
+            schema_editor.execute(
+                sql.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.execute(
+                'DROP INDEX CONCURRENTLY IF EXISTS %s'
+                % schema_editor.quote_name(self.index.name)
+            )
+
+    def describe(self):
+        return 'Concurrently create index %s on field(s) %s of model %s' % (
+            self.index.name,
+            ', '.join(self.index.fields),
+            self.model_name,
+        )
@@ -0,0 +1,198 @@
+"""Публикация страниц для анонимных посетителей в виде файлов.
+
+Страница, отданная анонимному посетителю по GET без параметров,
+записывается в settings.STATIC_PAGES_ROOT/<путь>/index.html, и дальше
+nginx отдает ее сам (try_files в infra/nginx.conf), не обращаясь к
+Django. При изменении данных файлы удаляются (unpublish) и создаются
+снова при следующем анонимном запросе или командой publish_pages.
+Если STATIC_PAGES_ROOT не задан, публикация выключена.
+
+Для каждого тега страницы в каталоге TAGS_DIR хранится файл с ее путем,
+чтобы unpublish_tagged удалял только страницы с этим тегом. nginx
+отдает лишь файлы index.html, поэтому эти записи наружу не попадают.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from functools import wraps
+from urllib.parse import quote, unquote
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import resolve, reverse
+
+from .cache import anonymous_request, bump_tags, tag_versions
+
+TAGS_DIR = '.tags'
+
+
+def static_pages_enabled():
+    return bool(settings.STATIC_PAGES_ROOT)
+
+
+def static_page_path(path):
+    """Возвращает путь к файлу страницы или None для чужих путей.
+
+    Пути с сегментами '.' и '..' не принимаются: '/profile/../' ведет
+    на профиль пользователя '..', а файл попал бы на место главной.
+    """
+    segments = path.strip('/').split('/')
+    if path != '/' and any(
+        segment in ('', '.', '..') for segment in segments
+    ):
+        return None
+    root = os.path.realpath(settings.STATIC_PAGES_ROOT)
+    filename = os.path.realpath(
+        os.path.join(root, *segments, 'index.html')
+    )
+    if os.path.commonpath([root, filename]) != root:
+        return None
+    return filename
+
+
+def tag_index_path(tag):
+    """Каталог с записями о страницах, помеченных тегом tag."""
+    return os.path.join(
+        os.path.realpath(settings.STATIC_PAGES_ROOT),
+        TAGS_DIR,
+        quote(tag, safe=''),
+    )
+
+
+def index_page_tags(path, tags):
+    """Записывает путь страницы в каталоги ее тегов."""
+    name = hashlib.md5(path.encode()).hexdigest()
+    for tag in tags:
+        directory = tag_index_path(tag)
+        entry = os.path.join(directory, name)
+        if os.path.exists(entry):
+            continue
+        os.makedirs(directory, exist_ok=True)
+        with open(entry, 'w', encoding='utf-8') as file:
+            file.write(path)
+
+
+def is_canonical(request):
+    """Совпадает ли путь запроса с адресом, который строит reverse()."""
+    match = request.resolver_match or resolve(request.path_info)
+    return request.path_info == unquote(reverse(
+        match.view_name, args=match.args, kwargs=match.kwargs
+    ))
+
+
+def is_publishable(request, response):
+    return (
+        static_pages_enabled()
+        and request.method == 'GET'
+        and not request.GET
+        and not request.user.is_authenticated
+        and request.path.endswith('/')
+        and response.status_code == 200
+        and is_canonical(request)
+    )
+
+
+def publish(request, response):
+    """Записывает страницу в файл, если ее данные не изменились за время
+    отрисовки (версии тегов страницы все еще актуальны).
+    """
+    filename = static_page_path(request.path)
+    if filename is None:
+        return
+    versions = getattr(response, 'cache_tag_versions', {})
+    # Запись о тегах появляется до файла страницы: иначе unpublish_tagged
+    # между ними не нашел бы страницу, которую вот-вот опубликуют
+    index_page_tags(request.path, versions)
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(descriptor, 'wb') as file:
+        file.write(response.content)
+    os.chmod(temporary, 0o644)
+    if tag_versions(versions) != versions:
+        os.remove(temporary)
+        return
+    os.replace(temporary, filename)
+
+
+def unpublish(*paths):
+    """Удаляет файлы страниц после фиксации текущей транзакции."""
+    if not static_pages_enabled():
+        return
+
+    def remove():
+        for path in paths:
+            filename = static_page_path(path)
+            if filename and os.path.exists(filename):
+                os.remove(filename)
+    transaction.on_commit(remove)
+
+
+def unpublish_tagged(*tags):
+    """Удаляет опубликованные страницы с тегами tags после фиксации
+    транзакции и, как unpublish_all, заново сбрасывает эти теги.
+    """
+    def remove():
+        bump_tags(*tags)
+        if not static_pages_enabled():
+            return
+        for tag in tags:
+            directory = tag_index_path(tag)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                entry = os.path.join(directory, name)
+                # Ту же запись может одновременно удалять другой процесс
+                try:
+                    with open(entry, encoding='utf-8') as file:
+                        filename = static_page_path(file.read())
+                    os.remove(entry)
+                    if filename:
+                        os.remove(filename)
+                except FileNotFoundError:
+                    continue
+    transaction.on_commit(remove)
+
+
+def unpublish_all(*tags):
+    """Удаляет все опубликованные страницы после фиксации транзакции.
+
+    Вместе с ними сбрасываются теги tags: страница, собранная до
+    фиксации, могла прочитать старые данные уже с новыми версиями тегов,
+    и без этого она снова попала бы в файл из кеша.
+    """
+    def remove():
+        bump_tags(*tags)
+        if not static_pages_enabled():
+            return
+        root = settings.STATIC_PAGES_ROOT
+        for name in os.listdir(root) if os.path.isdir(root) else []:
+            path = os.path.join(root, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+    transaction.on_commit(remove)
+
+
+def publish_for_anonymous(view):
+    """Публикует ответы представления анонимным посетителям в файлы."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if is_publishable(request, response):
+            publish(request, response)
+        return response
+    return wrapper
+
+
+def render_anonymous(path):
+    """Отрисовывает страницу для анонимного посетителя без HTTP-запроса.
+
+    Ответ проходит через декораторы представления, поэтому страница
+    попадает в кеш и публикуется так же, как при обычном посещении.
+    """
+    request = anonymous_request(path)
+    match = resolve(request.path_info)
+    return match.func(request, *match.args, **match.kwargs)
@@ -0,0 +1,47 @@
+from django import template
+from django.template.base import token_kwargs
+
+from core.holes import make_placeholder, punching_holes
+
+register = template.Library()
+
+
+class HoleNode(template.Node):
+    def __init__(self, template_name, extra_context):
+        self.template_name = template_name
+        self.extra_context = extra_context
+
+    def render(self, context):
+        template_name = self.template_name.resolve(context)
+        values = {
+            name: value.resolve(context)
+            for name, value in self.extra_context.items()
+        }
+        if punching_holes(context.get('request')):
+            return make_placeholder(template_name, values)
+        hole = context.template.engine.get_template(template_name)
+        with context.push(**values):
+            return hole.render(context)
+
+
+@register.tag
+def hole(parser, token):
+    """Выводит шаблон, зависящий от пользователя.
+
+    {% hole "includes/header.html" %}
+    {% hole "posts/includes/follow_button.html" author_id=post.author_id %}
+
+    Параметры должны быть строками или числами: при сборке страницы для
+    общего кеша они сохраняются в метке дырки (см. core.holes).
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} ожидает имя шаблона'
+        )
+    extra_context = token_kwargs(bits[2:], parser)
+    if len(extra_context) != len(bits) - 2:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} принимает параметры только в виде имя=значение'
+        )
+    return HoleNode(parser.compile_filter(bits[1]), extra_context)
@@ -0,0 +1,382 @@
+import os
+import shutil
+import tempfile
+import uuid
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.urls import reverse
+
+from core import cache as tagged_cache
+from core.cache_backends import (STATS_PROCESSES_KEY, CacheStats,
+                                 InstrumentedCache, LocalStore, SQLiteCache,
+                                 TieredCache, key_prefix)
+
+User = get_user_model()
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_entries_are_shared_between_instances(self):
+        """Записи и счетчики одного экземпляра видны другому,
+        как воркерам в разных процессах
+        """
+        other = self.make_cache()
+        self.cache.set('page', {'html': '<p>'})
+        self.cache.set('counter', 1)
+        self.assertEqual(other.get('page'), {'html': '<p>'})
+        self.assertEqual(other.incr('counter'), 2)
+        self.assertEqual(self.cache.incr('counter', 3), 5)
+        self.assertEqual(
+            other.get_many(['page', 'counter', 'missing']),
+            {'page': {'html': '<p>'}, 'counter': 5}
+        )
+        other.delete('page')
+        self.assertIsNone(self.cache.get('page'))
+
+    def test_expired_entries_are_missing(self):
+        """Просроченные записи не возвращаются и не мешают add"""
+        self.cache.set('key', 'old', 0)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertFalse(self.cache.has_key('key'))
+        with self.assertRaises(ValueError):
+            self.cache.incr('key')
+        self.assertTrue(self.cache.add('key', 'new'))
+        self.assertFalse(self.cache.add('key', 'newer'))
+        self.assertEqual(self.cache.get('key'), 'new')
+
+    @mock.patch('core.cache_backends.CULL_CHECK_INTERVAL', 1)
+    @mock.patch('core.cache_backends.ACCESS_GRANULARITY', 0)
+    def test_least_recently_read_entries_are_culled(self):
+        """При переполнении вытесняются давно не читавшиеся записи"""
+        cache = self.make_cache(MAX_ENTRIES=3, CULL_FREQUENCY=3)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+        cache.get('a')
+        cache.set('d', 'd')
+        self.assertEqual(sorted(cache.get_many(['a', 'b', 'c', 'd'])),
+                         ['a', 'c', 'd'])
+
+
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_worker(self, **options):
+        """Экземпляр кеша со своим L1, как в отдельном процессе."""
+        cache = TieredCache(self.location, {
+            'OPTIONS': {'L1_CHECK_INTERVAL': 0, **options}
+        })
+        cache.l1 = LocalStore(100)
+        return cache
+
+    def test_writes_invalidate_other_workers_l1(self):
+        """Запись в одном процессе сбрасывает ключ в L1 остальных"""
+        first, second = self.make_worker(), self.make_worker()
+        first.set('page', 'old')
+        self.assertEqual(second.get('page'), 'old')
+        self.assertEqual(second.get('page'), 'old')
+        first.set('page', 'new')
+        self.assertEqual(second.get('page'), 'new')
+        first.set('version', 1)
+        second.get('version')
+        first.incr('version')
+        self.assertEqual(second.get('version'), 2)
+        first.delete('page')
+        self.assertIsNone(second.get('page'))
+        self.assertEqual(second.stats()['l1_hits'], 1)
+
+    def test_log_overflow_clears_l1(self):
+        """Если изменений больше, чем ячеек журнала, L1 очищается целиком"""
+        first = self.make_worker(L1_LOG_SIZE=2)
+        second = self.make_worker(L1_LOG_SIZE=2)
+        first.set_many({'a': 1, 'b': 2})
+        self.assertEqual(second.get_many(['a', 'b']), {'a': 1, 'b': 2})
+        first.set_many({'a': 10, 'c': 3, 'd': 4})
+        self.assertEqual(second.get_many(['a', 'b']), {'a': 10, 'b': 2})
+        self.assertEqual(second.stats()['l1_hits'], 0)
+
+    def test_stale_reads_are_bounded_by_check_interval(self):
+        """Между проверками поколения L1 может отдавать старое значение"""
+        first = self.make_worker()
+        second = self.make_worker(L1_CHECK_INTERVAL=60)
+        first.set('page', 'old')
+        self.assertEqual(second.get('page'), 'old')
+        first.set('page', 'new')
+        self.assertEqual(second.get('page'), 'old')
+        second.l1.checked = 0
+        self.assertEqual(second.get('page'), 'new')
+
+    def test_own_writes_stay_in_l1(self):
+        """Процесс не сбрасывает из L1 ключи, которые записал сам"""
+        first, second = self.make_worker(), self.make_worker()
+        self.assertIsNone(first.get('page'))
+        first.set('page', 'first')
+        second.set('other', 'second')
+        self.assertEqual(first.get('page'), 'first')
+        self.assertEqual(first.stats()['l1_hits'], 1)
+
+    def test_writes_are_published_in_batches(self):
+        """Изменения публикуются пачкой: не чаще, чем раз в интервал,
+        и в конце запроса
+        """
+        first = self.make_worker(L1_CHECK_INTERVAL=60)
+        second = self.make_worker()
+        first.set('page', 'old')
+        first.close()
+        self.assertEqual(second.get('page'), 'old')
+        generation = first.l2.get(TieredCache.GENERATION_KEY)
+        first.set('page', 'new')
+        first.set('other', 'value')
+        first.delete('missing')
+        self.assertEqual(second.get('page'), 'old')
+        first.close()
+        self.assertEqual(
+            first.l2.get(TieredCache.GENERATION_KEY), generation + 3
+        )
+        self.assertEqual(second.get('page'), 'new')
+
+
+@mock.patch('core.cache.run_in_background', lambda function: function())
+class CacheTaggedPageTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.renders = 0
+
+        @tagged_cache.cache_tagged_page(60, 'test', lambda request: ['tag'])
+        def view(request):
+            self.rendered_for = request
+            self.renders += 1
+            return HttpResponse(f'render {self.renders}')
+
+        self.view = view
+        self.request = RequestFactory().get('/page/', {'page': 2})
+        self.request.user = User(username='reader')
+        self.view(self.request)
+        self.key = tagged_cache.page_cache_key('test', self.request)
+
+    def get(self):
+        return self.view(self.request).content.decode()
+
+    def expire(self):
+        versions, value, _, delta = cache.get(self.key)
+        cache.set(self.key, (versions, value, 0, delta))
+
+    def test_expired_page_is_served_stale_and_rebuilt_once(self):
+        """Страница с истекшим сроком отдается сразу, а пересчитывается
+        только одним запросом
+        """
+        self.expire()
+        with mock.patch('core.cache.run_in_background') as background:
+            self.assertEqual(self.get(), 'render 1')
+            self.assertEqual(self.get(), 'render 1')
+        self.assertEqual(background.call_count, 1)
+        background.call_args[0][0]()
+        # Фон не трогает запрос, который продолжает жить в своем потоке
+        self.assertIsNot(self.rendered_for, self.request)
+        self.assertEqual(self.rendered_for.get_full_path(), '/page/?page=2')
+        self.assertTrue(self.rendered_for.user.is_anonymous)
+        self.assertEqual(self.get(), 'render 2')
+        self.assertFalse(cache.get(tagged_cache.LOCK_KEY.format(self.key)))
+
+    def test_detached_request_keeps_host_without_visitor(self):
+        """Фоновый запрос адресован тому же хосту и схеме, но не несет
+        cookie и авторизацию посетителя
+        """
+        request = RequestFactory().get(
+            '/page/', {'page': 2}, secure=True, HTTP_HOST='localhost:8443',
+            HTTP_ACCEPT_LANGUAGE='ru', HTTP_COOKIE='sessionid=secret',
+            HTTP_AUTHORIZATION='Basic x',
+        )
+        detached = tagged_cache.detached_request(request)
+        self.assertEqual(
+            detached.build_absolute_uri(),
+            'https://localhost:8443/page/?page=2'
+        )
+        self.assertEqual(detached.META['HTTP_ACCEPT_LANGUAGE'], 'ru')
+        self.assertEqual(detached.COOKIES, {})
+        self.assertNotIn('HTTP_AUTHORIZATION', detached.META)
+        self.assertTrue(detached.user.is_anonymous)
+
+    def test_anonymous_request_without_original_uses_localhost(self):
+        request = tagged_cache.anonymous_request('/%D0%B0/?page=2')
+        self.assertEqual(
+            request.build_absolute_uri(), 'http://localhost/%D0%B0/?page=2'
+        )
+        self.assertEqual(request.path, '/а/')
+
+    def test_invalidated_page_is_rebuilt_in_request(self):
+        """После изменения тегов страница пересчитывается сразу,
+        а пока пересчет идет в другом запросе, отдается прежняя копия
+        """
+        tagged_cache.bump_tags('tag')
+        cache.add(tagged_cache.LOCK_KEY.format(self.key), 1)
+        self.assertEqual(self.get(), 'render 1')
+        cache.delete(tagged_cache.LOCK_KEY.format(self.key))
+        self.assertEqual(self.get(), 'render 2')
+        self.assertEqual(self.renders, 2)
+
+    def test_missing_page_waits_for_rebuild(self):
+        """Без копии страницы запрос ждет чужой пересчет и, не
+        дождавшись, считает страницу сам
+        """
+        cache.delete(self.key)
+        cache.add(tagged_cache.LOCK_KEY.format(self.key), 1)
+        self.assertEqual(self.get(), 'render 2')
+
+    def test_early_expiry_depends_on_render_time(self):
+        """Долго вычисляемая запись обновляется заранее"""
+        versions = tagged_cache.tag_versions(['tag'])
+        far = tagged_cache.time.time() + 60
+        self.assertEqual(
+            tagged_cache._entry_state((versions, '', far, 0)),
+            tagged_cache.FRESH
+        )
+        self.assertEqual(
+            tagged_cache._entry_state((versions, '', far, 10 ** 6)),
+            tagged_cache.EXPIRED
+        )
+
+
+class InstrumentedCacheTests(SimpleTestCase):
+    def make_cache(self, **options):
+        # У каждого кеша свое хранилище LocMemCache и свои счетчики
+        return InstrumentedCache(str(uuid.uuid4()), {'OPTIONS': options})
+
+    def test_key_prefixes(self):
+        """Ключи группируются по началу до разделителя"""
+        prefixes = {
+            'tagged_page:index_page:abc:lock': 'tagged_page:index_page',
+            'tag_version:post:1': 'tag_version:post',
+            'entity:user:john.doe': 'entity:user',
+            'card:1:2:3': 'card',
+            'sorl-thumbnail||image||abc': 'sorl-thumbnail||image',
+            'counter': 'counter',
+        }
+        for key, prefix in prefixes.items():
+            with self.subTest(key=key):
+                self.assertEqual(key_prefix(key), prefix)
+
+    def test_operations_are_counted_by_prefix(self):
+        """Попадания, промахи, записи и объем считаются по группам"""
+        cache = self.make_cache()
+        cache.set('card:1', 'x' * 100)
+        cache.get('card:1')
+        cache.get_many(['card:1', 'card:2'])
+        cache.get('entity:group:missing')
+        cache.delete('card:1')
+        stats = cache.collected_stats()
+        card = stats['card']
+        self.assertEqual(card['operations'], 5)
+        self.assertEqual(card['hits'], 2)
+        self.assertEqual(card['misses'], 1)
+        self.assertEqual(card['sets'], 1)
+        self.assertEqual(card['deletes'], 1)
+        self.assertGreater(card['bytes'], 100)
+        self.assertEqual(stats['entity:group']['misses'], 1)
+        self.assertNotIn('cache_stats', stats)
+
+    def test_evictions_are_counted(self):
+        """Промах по записанному и не удаленному ключу - вытеснение"""
+        cache = self.make_cache(MAX_ENTRIES=2, CULL_FREQUENCY=2)
+        for number in range(3):
+            cache.set(f'card:{number}', number)
+        cache.delete('card:2')
+        for number in range(3):
+            cache.get(f'card:{number}')
+        stats = cache.collected_stats()['card']
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_stats_are_saved_after_request(self):
+        """Счетчики сохраняются в кеш в close, а не во время операций"""
+        cache = self.make_cache(STATS_FLUSH_INTERVAL=0)
+        with mock.patch.object(cache, 'flush_stats') as flush_stats:
+            cache.get('card:1')
+            flush_stats.assert_not_called()
+            cache.close()
+            flush_stats.assert_called_once()
+
+    def test_stats_of_processes_are_summed(self):
+        """Счетчики разных процессов складываются в общем кеше"""
+        cache = self.make_cache()
+        cache.get('card:1')
+        cache.flush_stats()
+        cache.stats.reset()
+        cache.get('card:1')
+        self.assertEqual(cache.collected_stats()['card']['misses'], 2)
+        cache.reset_stats()
+        self.assertEqual(cache.collected_stats(), {})
+
+    def test_evicted_process_counter_keeps_running_slots(self):
+        """После вытеснения счетчика номеров новый процесс не занимает
+        ячейку работающего
+        """
+        cache = self.make_cache()
+        cache.get('card:1')
+        cache.flush_stats()
+        running = cache.stats
+        cache.cache.delete(STATS_PROCESSES_KEY)
+        cache.stats = CacheStats(100)
+        cache.get('card:1')
+        cache.flush_stats()
+        self.assertNotEqual(cache.stats.slot, running.slot)
+        cache.stats = running
+        self.assertEqual(cache.collected_stats()['card']['misses'], 2)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'core.cache_backends.InstrumentedCache',
+        'LOCATION': 'cache-stats-view',
+    }
+})
+class CacheStatsViewTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        cls.user = User.objects.create_user(username='user')
+
+    def test_stats_are_shown_to_staff_only(self):
+        """Статистику видят только сотрудники"""
+        url = reverse('cache_stats')
+        client = Client()
+        client.force_login(CacheStatsViewTests.user)
+        self.assertRedirects(
+            client.get(url), f'{reverse("admin:login")}?next={url}'
+        )
+        client.force_login(CacheStatsViewTests.staff)
+        cache.get('entity:group:slug')
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('entity:group', [
+            row['prefix'] for row in response.context['rows']
+        ])
+
+    def test_management_command(self):
+        """cache_stats выводит строку для каждой группы ключей"""
+        cache.get('entity:group:slug')
+        out = StringIO()
+        call_command('cache_stats', '--reset', stdout=out)
+        self.assertIn('entity:group', out.getvalue())
@@ -1,7 +1,11 @@
 from http import HTTPStatus
 
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
 from django.shortcuts import render
 
+from .cache_backends import InstrumentedCache, stats_table
+
 
 def page_not_found(request, exception):
     return render(
@@ -22,3 +26,15 @@ def server_error(request):
         'core/500.html',
         status=HTTPStatus.INTERNAL_SERVER_ERROR
     )
+
+
+@staff_member_required
+def cache_stats(request):
+    """Статистика кеша по группам ключей (см. InstrumentedCache)."""
+    cache = caches['default']
+    instrumented = isinstance(cache, InstrumentedCache)
+    context = {
+        'instrumented': instrumented,
+        'rows': stats_table(cache.collected_stats()) if instrumented else [],
+    }
+    return render(request, 'core/cache_stats.html', context)
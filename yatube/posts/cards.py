@@ -0,0 +1,54 @@
+"""Кеш отрисованных карточек постов.
+
+Карточка (posts/includes/post_list.html) одинакова для всех зрителей и
+всех лент, поэтому ее HTML кешируется под ключом с версиями тегов поста
+и автора: изменение поста или автора дает новый ключ, а старые карточки
+вытесняются по сроку. Страница получает все карточки двумя
+мульти-запросами к кешу: версий тегов и самих карточек. Миниатюры
+для недостающих карточек тоже ищутся сразу для всех (см. posts.thumbnails).
+"""
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from core.cache import add_cache_tags
+
+from .signals import refresh_post_pages
+from .tags import author_tag, post_tag
+from .thumbnails import post_thumbnails
+
+CARD_KEY = 'card:{}:{}:{}'
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+CARD_TEMPLATE = 'posts/includes/post_list.html'
+
+
+def render_cards(posts, request=None):
+    """Возвращает список пар (пост, HTML карточки).
+
+    Теги карточек добавляются к странице запроса: лента с карточкой
+    устаревает вместе с ней, например при смене имени автора.
+    """
+    posts = list(posts)
+    versions = add_cache_tags(
+        request,
+        *{post_tag(post.pk) for post in posts},
+        *{author_tag(post.author_id) for post in posts},
+    )
+    keys = [
+        CARD_KEY.format(
+            post.pk,
+            versions[post_tag(post.pk)],
+            versions[author_tag(post.author_id)],
+        )
+        for post in posts
+    ]
+    cards = cache.get_many(keys)
+    missing = {key: post for key, post in zip(keys, posts) if key not in cards}
+    thumbnails = post_thumbnails(missing.values(), refresh_post_pages)
+    for key, post in missing.items():
+        missing[key] = render_to_string(
+            CARD_TEMPLATE, {'post': post, 'thumbnail': thumbnails.get(post.pk)}
+        )
+    if missing:
+        cache.set_many(missing, CARD_CACHE_TIMEOUT)
+        cards.update(missing)
+    return [(post, cards[key]) for key, post in zip(keys, posts)]
@@ -0,0 +1,178 @@
+"""Денормализованные счетчики постов, комментариев и подписок.
+
+Счетчики меняются атомарными UPDATE ... SET x = x + 1 из сигналов моделей,
+а recount() пересчитывает их по данным и исправляет расхождения.
+
+Горячие счетчики (SHARDED_COUNTERS) не пишутся в строку записи напрямую:
+приращение попадает в случайный из settings.COUNTER_SHARDS шардов
+CounterShard, значение равно полю записи плюс сумма шардов, а
+compact_counters() периодически сворачивает шарды в поле.
+"""
+import random
+from functools import reduce
+from operator import and_
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (Count, F, IntegerField, OuterRef, Q, Subquery,
+                              Sum)
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, CounterShard, Follow, Post, Profile, User
+
+# Поле счетчика: (модель, по записям которой он считается, поле связи)
+PROFILE_COUNTERS = {
+    'posts_count': (Post, 'author'),
+    'followers_count': (Follow, 'author'),
+    'following_count': (Follow, 'user'),
+}
+POST_COUNTERS = {
+    'comments_count': (Comment, 'post'),
+}
+
+# Счетчики, которые меняются у одной записи многими пользователями сразу
+SHARDED_COUNTERS = {
+    (Post, 'comments_count'),
+    (Profile, 'followers_count'),
+}
+
+
+def counter_name(model, field):
+    return f'{model._meta.label_lower}.{field}'
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет счетчик на delta, не опуская его ниже нуля."""
+    if (model, field) in SHARDED_COUNTERS:
+        change_sharded_counter(model, pk, field, delta)
+        return
+    rows = model.objects.filter(pk=pk)
+    if delta < 0:
+        rows = rows.filter(**{f'{field}__gte': -delta})
+    rows.update(**{field: F(field) + delta})
+
+
+def change_sharded_counter(model, pk, field, delta):
+    """Добавляет delta к случайному шарду счетчика.
+
+    Отсутствующий шард создается пустым, и UPDATE повторяется:
+    compact_counters может удалить шард между вставкой и UPDATE, и тогда
+    приращение иначе бы потерялось.
+    """
+    shard = {
+        'counter': counter_name(model, field),
+        'object_id': pk,
+        'shard': random.randrange(settings.COUNTER_SHARDS),
+    }
+    rows = CounterShard.objects.filter(**shard)
+    while not rows.update(value=F('value') + delta):
+        CounterShard.objects.bulk_create(
+            [CounterShard(**shard)], ignore_conflicts=True
+        )
+
+
+def pending_value(model, field):
+    """Подзапрос с суммой несвернутых шардов счетчика для OuterRef('pk'):
+    позволяет прочитать ее одним запросом с самой записью.
+    """
+    return Coalesce(
+        Subquery(
+            CounterShard.objects.filter(
+                counter=counter_name(model, field), object_id=OuterRef('pk')
+            ).order_by().values('object_id').annotate(
+                total=Sum('value')
+            ).values('total')
+        ),
+        0,
+        output_field=IntegerField()
+    )
+
+
+def counter_value(obj, field, pending=None):
+    """Возвращает значение счетчика с учетом несвернутых шардов.
+
+    pending - уже прочитанная сумма шардов (см. pending_value); без нее
+    сумма читается отдельным запросом.
+    """
+    if pending is None:
+        pending = CounterShard.objects.filter(
+            counter=counter_name(type(obj), field), object_id=obj.pk
+        ).aggregate(total=Sum('value'))['total']
+    return max(getattr(obj, field) + (pending or 0), 0)
+
+
+def compact_counters():
+    """Сворачивает шарды в поля записей; возвращает число счетчиков.
+
+    Шарды каждого счетчика блокируются и удаляются в одной транзакции
+    с обновлением поля, поэтому параллельные приращения не теряются:
+    они дождутся блокировки и создадут шард заново.
+    """
+    counters = CounterShard.objects.order_by().values_list(
+        'counter', 'object_id'
+    ).distinct()
+    compacted = 0
+    for name, object_id in list(counters):
+        label, field = name.rsplit('.', 1)
+        model = apps.get_model(label)
+        with transaction.atomic():
+            shards = list(CounterShard.objects.select_for_update().filter(
+                counter=name, object_id=object_id
+            ).values_list('pk', 'value'))
+            total = sum(value for _, value in shards)
+            if total:
+                model.objects.filter(pk=object_id).update(
+                    **{field: Greatest(F(field) + total, 0)}
+                )
+            CounterShard.objects.filter(
+                pk__in=[pk for pk, _ in shards]
+            ).delete()
+        compacted += 1
+    return compacted
+
+
+def actual_count(related_model, related_field):
+    """Подзапрос, считающий связанные записи для OuterRef('pk')."""
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                count=Count('pk')
+            ).values('count')
+        ),
+        0
+    )
+
+
+def create_missing_profiles(start, stop):
+    user_ids = User.objects.filter(
+        pk__gte=start, pk__lt=stop, profile__isnull=True
+    ).values_list('pk', flat=True)
+    Profile.objects.bulk_create(
+        [Profile(user_id=user_id) for user_id in user_ids],
+        ignore_conflicts=True
+    )
+
+
+def recount(model, counters, start, stop):
+    """Пересчитывает счетчики записей model с pk из [start, stop).
+
+    Возвращает число записей, счетчики которых расходились с данными.
+    """
+    actual = {
+        field: actual_count(related_model, related_field)
+        for field, (related_model, related_field) in counters.items()
+    }
+    drifted = model.objects.filter(pk__gte=start, pk__lt=stop).annotate(
+        **{f'actual_{field}': expression
+           for field, expression in actual.items()}
+    ).exclude(
+        reduce(and_, (Q(**{field: F(f'actual_{field}')})
+                      for field in counters))
+    ).values_list('pk', flat=True)
+    drifted = list(drifted)
+    if drifted:
+        model.objects.filter(pk__in=drifted).update(**actual)
+    return len(drifted)
@@ -0,0 +1,73 @@
+"""Кеш сообществ и пользователей, которые ищутся по адресу страницы.
+
+Записи проверяются по тегам (см. core.cache) и сбрасываются сигналами
+posts.signals при сохранении и удалении. Отсутствие объекта тоже
+запоминается, чтобы запросы к несуществующим адресам не доходили до
+базы; такие записи живут меньше.
+"""
+from django.http import Http404
+
+from core.cache import get_tagged, set_tagged, tag_versions
+
+from .counters import pending_value
+from .models import Group, Profile, User
+from .tags import author_tag, group_tag, username_tag
+
+ENTITY_KEY = 'entity:{}:{}'
+ENTITY_TIMEOUT = 60 * 60
+MISSING_TIMEOUT = 60
+# Пометка отсутствующего объекта; сравнивается по значению после pickle
+MISSING = 'missing'
+# Кеш общий и может лежать на диске (SQLiteCache), поэтому в нем нет
+# хеша пароля, почты и других личных полей пользователя
+AUTHOR_FIELDS = (
+    'username', 'first_name', 'last_name',
+    'profile__posts_count', 'profile__followers_count',
+)
+
+
+def _get_or_404(key, tags, load, instance_tags):
+    """Возвращает объект из кеша или загружает его функцией load.
+
+    Версии тегов tags читаются до загрузки; instance_tags(instance)
+    добавляет теги, которые становятся известны только после нее.
+    """
+    instance = get_tagged(key)
+    if instance is None:
+        versions = tag_versions(tags)
+        instance = load()
+        if instance is None:
+            instance = MISSING
+            set_tagged(key, instance, versions, MISSING_TIMEOUT)
+        else:
+            versions.update(tag_versions(instance_tags(instance)))
+            set_tagged(key, instance, versions, ENTITY_TIMEOUT)
+    if instance == MISSING:
+        raise Http404
+    return instance
+
+
+def get_group_or_404(slug):
+    return _get_or_404(
+        ENTITY_KEY.format('group', slug),
+        [group_tag(slug)],
+        lambda: Group.objects.filter(slug=slug).first(),
+        lambda group: [],
+    )
+
+
+def get_author_or_404(username):
+    """Пользователь загружается вместе с профилем и только с теми полями,
+    которые выводятся на страницах (AUTHOR_FIELDS), а несвернутые шарды
+    числа подписчиков - в followers_pending.
+    """
+    return _get_or_404(
+        ENTITY_KEY.format('user', username),
+        [username_tag(username)],
+        lambda: User.objects.select_related('profile').only(
+            *AUTHOR_FIELDS
+        ).annotate(
+            followers_pending=pending_value(Profile, 'followers_count')
+        ).filter(username=username).first(),
+        lambda user: [author_tag(user.pk)],
+    )
@@ -0,0 +1,27 @@
+"""Движки ленты подписок, выбираются настройкой FOLLOW_FEED_ENGINE."""
+from django.conf import settings
+
+from .models import Post
+from .pull_feed import FeedPaginator, merged_feed
+from .timeline import TimelinePaginator, timeline_posts
+from .utils import CursorPaginator, pagination
+
+
+def join_posts(user):
+    """Выбирает посты ленты через JOIN по подпискам."""
+    return Post.objects.for_cards().filter(author__following__user=user)
+
+
+FEED_ENGINES = {
+    'join': (join_posts, CursorPaginator),
+    'timeline': (timeline_posts, TimelinePaginator),
+    'pull': (merged_feed, FeedPaginator),
+}
+
+
+def follow_page(request, engine=None):
+    """Возвращает страницу ленты подписок текущего пользователя."""
+    get_posts, paginator_class = FEED_ENGINES[
+        engine or settings.FOLLOW_FEED_ENGINE
+    ]
+    return pagination(request, get_posts(request.user), paginator_class)
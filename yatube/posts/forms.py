@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from .images import normalize_image
 from .models import Comment, Post
 
 
@@ -8,6 +10,25 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def clean_image(self):
+        """Обрабатывает новую картинку и запоминает ее размер и
+        заглушку.
+        """
+        image = self.cleaned_data.get('image')
+        post = self.instance
+        # Прежнюю картинку для счетчика ссылок ищут только при изменении
+        post._image_changed = 'image' in self.changed_data
+        if isinstance(image, UploadedFile):
+            normalized = normalize_image(image)
+            image = normalized.file
+            post.image_width = normalized.width
+            post.image_height = normalized.height
+            post.image_placeholder = normalized.placeholder
+        elif not image:
+            post.image_width = post.image_height = None
+            post.image_placeholder = ''
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,103 @@
+"""Обработка картинок постов при загрузке.
+
+Исходники уменьшаются до MAX_IMAGE_SIZE, поворачиваются по тегу
+ориентации EXIF и сохраняются без EXIF и других метаданных (в них бывают
+координаты съемки). Картинка, которой ничего из этого не нужно,
+сохраняется как есть, чтобы не терять качество на повторном сжатии.
+
+Для каждой картинки запоминается крошечная заглушка (make_placeholder),
+которую страница показывает, пока грузится миниатюра.
+"""
+import os
+from base64 import b64encode
+from collections import namedtuple
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps
+
+# Больше не нужно ни для страницы поста, ни для миниатюр
+MAX_IMAGE_SIZE = (2560, 2560)
+JPEG_QUALITY = 85
+# Эти форматы сохраняются в своем формате, остальные - в JPEG или PNG
+KEPT_FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+SAVE_OPTIONS = {
+    'JPEG': {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'GIF': {'optimize': True},
+    'WEBP': {'quality': JPEG_QUALITY, 'method': 6},
+}
+# ICC-профиль не удаляется: без него искажаются цвета
+METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment', 'photoshop')
+# В пропорциях миниатюры (posts.thumbnails.THUMBNAIL_SIZE)
+PLACEHOLDER_SIZE = (34, 12)
+PLACEHOLDER_QUALITY = 40
+
+NormalizedImage = namedtuple(
+    'NormalizedImage', 'file width height placeholder'
+)
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+
+
+def needs_normalizing(image):
+    return (
+        image.width > MAX_IMAGE_SIZE[0]
+        or image.height > MAX_IMAGE_SIZE[1]
+        or image.format not in KEPT_FORMATS
+        or any(key in image.info for key in METADATA_KEYS)
+    )
+
+
+def make_placeholder(image):
+    """Возвращает заглушку картинки: data: URI на пару сотен байт.
+
+    WebP втрое меньше JPEG такого размера: у JPEG больше заголовок.
+    """
+    image = ImageOps.fit(image.convert('RGB'), PLACEHOLDER_SIZE)
+    output = BytesIO()
+    image.save(output, 'WEBP', quality=PLACEHOLDER_QUALITY)
+    return 'data:image/webp;base64,' + b64encode(output.getvalue()).decode()
+
+
+def reencode(image, name):
+    """Возвращает уменьшенную картинку без метаданных и ее файл."""
+    image_format = image.format
+    if image_format not in KEPT_FORMATS:
+        image_format = 'PNG' if has_alpha(image) else 'JPEG'
+    options = dict(SAVE_OPTIONS[image_format])
+    if 'icc_profile' in image.info:
+        options['icc_profile'] = image.info['icc_profile']
+    image = ImageOps.exif_transpose(image)
+    for key in METADATA_KEYS:
+        image.info.pop(key, None)
+    image.thumbnail(MAX_IMAGE_SIZE, Image.LANCZOS)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = BytesIO()
+    image.save(output, image_format, **options)
+    name = os.path.splitext(name)[0] + KEPT_FORMATS[image_format]
+    return image, SimpleUploadedFile(
+        name, output.getvalue(), Image.MIME[image_format]
+    )
+
+
+def normalize_image(uploaded):
+    """Возвращает NormalizedImage: обработанный файл картинки, ее размер
+    и заглушку.
+
+    Анимированные картинки не обрабатываются: Pillow сохранил бы только
+    первый кадр.
+    """
+    uploaded.seek(0)
+    with Image.open(uploaded) as image:
+        if getattr(image, 'is_animated', False) or not needs_normalizing(
+            image
+        ):
+            uploaded.seek(0)
+            result = uploaded
+        else:
+            image, result = reencode(image, uploaded.name)
+        return NormalizedImage(result, *image.size, make_placeholder(image))
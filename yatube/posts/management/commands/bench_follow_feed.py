@@ -0,0 +1,119 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from posts import pull_feed
+from posts.feeds import FEED_ENGINES, follow_page
+from posts.models import Follow, Post
+from posts.timeline import rebuild_timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает движки ленты подписок на сгенерированных данных. '
+        'Данные создаются в транзакции, которая затем откатывается'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=2000)
+        parser.add_argument('--posts', type=int, default=5,
+                            help='Постов у каждого автора')
+        parser.add_argument('--followers', type=int, default=3,
+                            help='Читателей, подписанных на всех авторов')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--depth', type=int, default=10,
+                            help='Сколько страниц листать по курсору')
+
+    def seed(self, options):
+        prefix = f'bench_{int(time.time())}'
+        User.objects.bulk_create(
+            User(username=f'{prefix}_author_{i}')
+            for i in range(options['authors'])
+        )
+        User.objects.bulk_create(
+            User(username=f'{prefix}_reader_{i}')
+            for i in range(options['followers'])
+        )
+        authors = list(User.objects.filter(
+            username__startswith=f'{prefix}_author_'
+        ).values_list('pk', flat=True))
+        readers = list(User.objects.filter(
+            username__startswith=f'{prefix}_reader_'
+        ))
+        Post.objects.bulk_create(
+            (Post(author_id=author_id, text=f'Пост {i}')
+             for author_id in authors
+             for i in range(options['posts'])),
+            batch_size=500
+        )
+        Follow.objects.bulk_create(
+            (Follow(user=reader, author_id=author_id)
+             for reader in readers
+             for author_id in authors),
+            batch_size=500
+        )
+        for reader in readers:
+            rebuild_timeline(reader.pk)
+        return readers, authors
+
+    def get_page(self, engine, reader, cursor=None):
+        request = self.factory.get(
+            '/follow/', {'cursor': cursor} if cursor else {}
+        )
+        request.user = reader
+        return follow_page(request, engine)
+
+    def measure(self, engine, reader, depth):
+        """Время первой страницы и перехода на depth страниц вглубь."""
+        start = time.perf_counter()
+        page = self.get_page(engine, reader)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(depth):
+            if not page.next_cursor:
+                break
+            page = self.get_page(engine, reader, page.next_cursor)
+        return first, time.perf_counter() - start
+
+    def forget_cache(self, readers, authors):
+        for reader in readers:
+            pull_feed.forget_following(reader.pk)
+        cache.delete_many([
+            pull_feed.RECENT_POSTS_KEY.format(author_id)
+            for author_id in authors
+        ])
+
+    def handle(self, *args, **options):
+        self.factory = RequestFactory()
+        with transaction.atomic():
+            readers, authors = self.seed(options)
+            self.stdout.write(
+                f'Авторов: {len(authors)}, читателей: {len(readers)}, '
+                f'постов: {len(authors) * options["posts"]}'
+            )
+            for engine in FEED_ENGINES:
+                cold = []
+                warm = []
+                for reader in readers:
+                    self.forget_cache(readers, authors)
+                    cold.append(self.measure(engine, reader, 0)[0])
+                    for _ in range(options['repeat']):
+                        warm.append(
+                            self.measure(engine, reader, options['depth'])
+                        )
+                first = sum(first for first, _ in warm) / len(warm)
+                deep = sum(deep for _, deep in warm) / len(warm)
+                self.stdout.write(
+                    f'{engine:>10}: холодная первая страница '
+                    f'{1000 * sum(cold) / len(cold):.1f} мс, '
+                    f'первая страница {1000 * first:.1f} мс, '
+                    f'{options["depth"]} страниц вглубь {1000 * deep:.1f} мс'
+                )
+            transaction.set_rollback(True)
+        self.forget_cache(readers, authors)
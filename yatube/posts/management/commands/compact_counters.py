@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from posts.counters import compact_counters
+
+
+class Command(BaseCommand):
+    help = 'Сворачивает шарды горячих счетчиков в поля записей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Повторять раз в столько секунд; '
+                                 '0 - выполнить один раз')
+
+    def compact(self):
+        compacted = compact_counters()
+        self.stdout.write(
+            self.style.SUCCESS(f'Свернуто счетчиков: {compacted}')
+        )
+
+    def handle(self, *args, **options):
+        self.compact()
+        while options['interval']:
+            # Между проходами соединение не держится открытым
+            connection.close()
+            time.sleep(options['interval'])
+            self.compact()
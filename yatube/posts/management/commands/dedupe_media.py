@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import delete
+
+from posts.media import recount_media_files
+from posts.models import Post
+from posts.signals import refresh_post_pages
+from posts.storage import content_name, is_content_name
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки постов в хранилище по хешу содержимого: '
+        'одинаковые файлы становятся одним, старые файлы и их миниатюры '
+        'удаляются, ссылки на файлы пересчитываются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Сколько имен файлов читать за один запрос')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать, ничего не меняя')
+
+    def legacy_names(self, chunk_size):
+        """Имена картинок со старыми именами; читаются курсором."""
+        names = Post.objects.exclude(image='').order_by('image').values_list(
+            'image', flat=True
+        ).distinct().iterator(chunk_size=chunk_size)
+        return (name for name in names if not is_content_name(name))
+
+    def measure(self, storage, name):
+        """Возвращает то же, что move, ничего не меняя."""
+        with storage.open(name) as file:
+            new_name = content_name(file, name)
+            duplicate = new_name in self.seen or storage.exists(new_name)
+            self.seen.add(new_name)
+            return new_name, duplicate, file.size
+
+    def move(self, storage, name):
+        """Переносит файл; возвращает (новое имя, был ли уже такой файл,
+        размер).
+        """
+        with storage.open(name) as file:
+            new_name, created = storage.store(name, file)
+            size = file.size
+        post_ids = list(
+            Post.objects.filter(image=name).values_list('pk', flat=True)
+        )
+        Post.objects.filter(pk__in=post_ids).update(image=new_name)
+        for post_id in post_ids:
+            refresh_post_pages(post_id)
+        # Старый файл вместе с его миниатюрами
+        delete(name)
+        return new_name, not created, size
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        # Новые имена в пробном прогоне: файлы еще не перенесены
+        self.seen = set()
+        process = self.measure if options['dry_run'] else self.move
+        moved = duplicates = freed = 0
+        for name in self.legacy_names(options['chunk_size']):
+            try:
+                new_name, duplicate, size = process(storage, name)
+            except FileNotFoundError:
+                self.stderr.write(f'{name}: файла нет, пропущен')
+                continue
+            moved += 1
+            if duplicate:
+                duplicates += 1
+                freed += size
+            self.stdout.write(f'{name} -> {new_name}')
+        summary = (
+            f'Перенесено файлов: {moved}, из них дубликатов: {duplicates} '
+            f'({freed} байт)'
+        )
+        if not options['dry_run']:
+            summary += f', файлов в хранилище: {recount_media_files()}'
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from posts.timeline import fan_out_pending
+
+
+class Command(BaseCommand):
+    help = 'Раскладывает новые посты по материализованным лентам подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Повторять раз в столько секунд; '
+                                 '0 - выполнить один раз')
+
+    def fan_out(self):
+        done = fan_out_pending()
+        self.stdout.write(self.style.SUCCESS(f'Разложено постов: {done}'))
+
+    def handle(self, *args, **options):
+        self.fan_out()
+        while options['interval']:
+            # Между проходами соединение не держится открытым
+            connection.close()
+            time.sleep(options['interval'])
+            self.fan_out()
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from core.static_pages import render_anonymous, static_pages_enabled
+from posts.models import Group, Post, User
+
+
+def page_paths():
+    """Пути всех страниц, которые публикуются для анонимных посетителей."""
+    yield reverse('posts:index')
+    for slug in Group.objects.values_list('slug', flat=True).iterator():
+        yield reverse('posts:group_posts', args=[slug])
+    for username in User.objects.filter(
+        posts__isnull=False
+    ).distinct().values_list('username', flat=True).iterator():
+        yield reverse('posts:profile', args=[username])
+    for pk in Post.objects.values_list('pk', flat=True).iterator():
+        yield reverse('posts:post_detail', args=[pk])
+
+
+class Command(BaseCommand):
+    help = (
+        'Публикует страницы для анонимных посетителей в STATIC_PAGES_ROOT, '
+        'чтобы nginx отдавал их без обращения к Django'
+    )
+
+    def handle(self, *args, **options):
+        if not static_pages_enabled():
+            raise CommandError('Не задан STATIC_PAGES_ROOT')
+        published = sum(
+            render_anonymous(path).status_code == 200
+            for path in page_paths()
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'Опубликовано страниц: {published}')
+        )
@@ -0,0 +1,145 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urljoin
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.urls import reverse
+
+from core.static_pages import render_anonymous
+from posts.models import Group, Post, Profile
+from posts.thumbnails import make_thumbnail
+from posts.utils import POST_LIMIT, CursorPaginator
+
+URL_TIMEOUT = 30
+
+
+def page_urls(path, fragment_path, posts, pages):
+    """Возвращает адреса первых страниц ленты в том виде, в каком по ним
+    переходят посетители: первая страница, а дальше страницы и фрагменты
+    по курсорам следующих страниц.
+    """
+    urls = [path]
+    paginator = CursorPaginator(posts, POST_LIMIT)
+    cursor = paginator.page(1).next_cursor
+    for _ in range(pages - 1):
+        if not cursor:
+            break
+        urls += [f'{path}?cursor={cursor}', f'{fragment_path}?cursor={cursor}']
+        cursor = paginator.cursor_page(cursor).next_cursor
+    return urls
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогревает кеши после выкладки: отрисовывает первые страницы '
+        'главной, самых больших групп и самых активных авторов и создает '
+        'миниатюры их постов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=3,
+                            help='Сколько первых страниц каждой ленты')
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--profiles', type=int, default=10)
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Число одновременно прогреваемых лент')
+        parser.add_argument(
+            '--base-url',
+            help=(
+                'Запрашивать страницы у запущенного сайта по HTTP; нужно, '
+                'если кеш страниц у каждого процесса свой (LocMemCache)'
+            ),
+        )
+
+    def targets(self, options):
+        """Возвращает ленты для прогрева:
+        (название, путь, путь фрагментов, посты).
+        """
+        targets = [(
+            'index',
+            reverse('posts:index'),
+            reverse('posts:index_fragment'),
+            Post.objects.all(),
+        )]
+        groups = Group.objects.annotate(
+            posts_total=Count('posts')
+        ).order_by('-posts_total')[:options['groups']]
+        for group in groups:
+            targets.append((
+                f'group:{group.slug}',
+                reverse('posts:group_posts', args=[group.slug]),
+                reverse('posts:group_posts_fragment', args=[group.slug]),
+                group.posts.all(),
+            ))
+        profiles = Profile.objects.select_related('user').filter(
+            posts_count__gt=0
+        ).order_by('-posts_count')[:options['profiles']]
+        for profile in profiles:
+            username = profile.user.username
+            targets.append((
+                f'profile:{username}',
+                reverse('posts:profile', args=[username]),
+                reverse('posts:profile_fragment', args=[username]),
+                Post.objects.filter(author_id=profile.user_id),
+            ))
+        return targets
+
+    def fetch(self, url, base_url):
+        if base_url is None:
+            return render_anonymous(url).status_code
+        try:
+            with urlopen(urljoin(base_url, url), timeout=URL_TIMEOUT) as page:
+                return page.status
+        except HTTPError as error:
+            return error.code
+
+    def make_thumbnails(self, posts, pages):
+        images = posts.exclude(image='').order_by(
+            '-pub_date', '-pk'
+        ).values_list('image', 'image_width')[:pages * POST_LIMIT]
+        for image, image_width in images:
+            make_thumbnail(image, image_width)
+        return len(images)
+
+    def warm(self, target, options):
+        name, path, fragment_path, posts = target
+        started = time.perf_counter()
+        urls = page_urls(path, fragment_path, posts, options['pages'])
+        rendered = sum(
+            self.fetch(url, options['base_url']) == 200 for url in urls
+        )
+        thumbnails = self.make_thumbnails(posts, options['pages'])
+        return (
+            f'{name}: страниц {rendered}/{len(urls)}, миниатюр {thumbnails}, '
+            f'{time.perf_counter() - started:.2f} с'
+        )
+
+    def warm_in_thread(self, target, options):
+        """Прогревает ленту в потоке пула и закрывает его соединение."""
+        try:
+            return self.warm(target, options)
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        targets = self.targets(options)
+        if options['workers'] == 1:
+            reports = (self.warm(target, options) for target in targets)
+            for report in reports:
+                self.stdout.write(report)
+        else:
+            with ThreadPoolExecutor(options['workers']) as executor:
+                for report in executor.map(
+                    lambda target: self.warm_in_thread(target, options),
+                    targets
+                ):
+                    self.stdout.write(report)
+        self.stdout.write(self.style.SUCCESS(
+            f'Прогрето лент: {len(targets)} '
+            f'за {time.perf_counter() - started:.2f} с'
+        ))
@@ -0,0 +1,88 @@
+"""Счетчики ссылок на файлы картинок в хранилище по хешу.
+
+Пост с новой картинкой увеличивает счетчик ее файла, а удаленный пост
+или замененная картинка уменьшают. Файл без ссылок удаляется вместе с
+миниатюрами и записями sorl-thumbnail после фиксации транзакции, если
+за это время на него не сослался новый пост.
+
+Загрузка картинки, которая уже есть в хранилище, файл не пишет. Если
+файл удалили между этой проверкой и увеличением счетчика, пост после
+увеличения счетчика записывает его заново (restore): удаление берет
+блокировку строки MediaFile и ждет фиксации, поэтому к этому моменту
+файла уже нет, а новое удаление невозможно, пока на файл есть ссылка.
+
+Файлы со старыми именами (до хранилища по хешу) не учитываются и не
+удаляются, пока их не перенесет dedupe_media.
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, F
+from sorl.thumbnail import delete
+
+from .models import MediaFile, Post
+from .storage import is_content_name
+
+BATCH_SIZE = 1000
+
+
+def acquire(name):
+    """Добавляет ссылку на файл."""
+    if not is_content_name(name):
+        return
+    rows = MediaFile.objects.filter(name=name)
+    if not rows.update(refs=F('refs') + 1):
+        MediaFile.objects.bulk_create(
+            [MediaFile(name=name)], ignore_conflicts=True
+        )
+        rows.update(refs=F('refs') + 1)
+
+
+def restore(image, content):
+    """Записывает файл картинки заново из загруженного content, если
+    его удалили, пока на него не было ссылок.
+    """
+    if content is None or not is_content_name(image.name):
+        return
+    if not image.storage.exists(image.name):
+        image.storage.restore(image.name, content)
+
+
+def release(name):
+    """Убирает ссылку на файл и удаляет его, если ссылок не осталось."""
+    if not is_content_name(name):
+        return
+    MediaFile.objects.filter(name=name, refs__gt=0).update(
+        refs=F('refs') - 1
+    )
+    transaction.on_commit(partial(delete_unreferenced, name))
+
+
+def delete_unreferenced(name):
+    """Удаляет файл, миниатюры и запись MediaFile, если ссылок нет."""
+    with transaction.atomic():
+        deleted, _ = MediaFile.objects.filter(name=name, refs=0).delete()
+        if deleted:
+            delete(name)
+
+
+def recount_media_files():
+    """Пересчитывает ссылки на все файлы по постам; возвращает число
+    файлов.
+    """
+    counts = Post.objects.exclude(image='').order_by().values(
+        'image'
+    ).annotate(refs=Count('pk')).values_list('image', 'refs')
+    files = []
+    total = 0
+    with transaction.atomic():
+        MediaFile.objects.all().delete()
+        for name, refs in counts.iterator():
+            if not is_content_name(name):
+                continue
+            files.append(MediaFile(name=name, refs=refs))
+            if len(files) >= BATCH_SIZE:
+                total += len(MediaFile.objects.bulk_create(files))
+                files = []
+        total += len(MediaFile.objects.bulk_create(files))
+    return total
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.16 on 2026-10-17 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_add_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counter', models.CharField(help_text='Имя в виде app_label.model.field', max_length=100, verbose_name='Счетчик')),
+                ('object_id', models.PositiveIntegerField(verbose_name='ID записи')),
+                ('shard', models.PositiveSmallIntegerField(verbose_name='Номер шарда')),
+                ('value', models.IntegerField(default=0, verbose_name='Приращение')),
+            ],
+            options={
+                'verbose_name': 'Шард счетчика',
+                'verbose_name_plural': 'Шарды счетчиков',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='countershard',
+            constraint=models.UniqueConstraint(fields=('counter', 'object_id', 'shard'), name='posts_countershard_unique_shard'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.16 on 2026-10-17 07:40
+
+from django.core.files.images import get_image_dimensions
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def fill_image_dimensions(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    posts = Post.objects.exclude(image='').only('image').iterator()
+    batch = []
+    for post in posts:
+        try:
+            width, height = get_image_dimensions(post.image)
+        except (OSError, ValueError):
+            # Файла нет или он битый: размер останется пустым
+            continue
+        post.image_width, post.image_height = width, height
+        batch.append(post)
+        if len(batch) >= BATCH_SIZE:
+            Post.objects.bulk_update(batch, ['image_width', 'image_height'])
+            batch = []
+    Post.objects.bulk_update(batch, ['image_width', 'image_height'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_add_counter_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Высота картинки'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Ширина картинки'),
+        ),
+        migrations.RunPython(fill_image_dimensions, migrations.RunPython.noop),
+    ]
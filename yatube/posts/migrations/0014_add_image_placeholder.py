@@ -0,0 +1,56 @@
+# Generated by Django 2.2.16 on 2026-10-17 07:43
+
+from base64 import b64encode
+from io import BytesIO
+
+from django.db import migrations, models
+from PIL import Image, ImageOps
+
+BATCH_SIZE = 500
+# Копия posts.images.make_placeholder на момент миграции: миграция
+# не должна меняться вместе с кодом приложения
+PLACEHOLDER_SIZE = (34, 12)
+PLACEHOLDER_QUALITY = 40
+
+
+def make_placeholder(image):
+    image = ImageOps.fit(image.convert('RGB'), PLACEHOLDER_SIZE)
+    output = BytesIO()
+    image.save(output, 'WEBP', quality=PLACEHOLDER_QUALITY)
+    return 'data:image/webp;base64,' + b64encode(output.getvalue()).decode()
+
+
+def fill_image_placeholders(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    posts = Post.objects.exclude(image='').only('image').iterator()
+    batch = []
+    for post in posts:
+        try:
+            with post.image.open() as file, Image.open(file) as image:
+                post.image_placeholder = make_placeholder(image)
+        except (OSError, ValueError):
+            # Файла нет или он битый: заглушки не будет
+            continue
+        batch.append(post)
+        if len(batch) >= BATCH_SIZE:
+            Post.objects.bulk_update(batch, ['image_placeholder'])
+            batch = []
+    Post.objects.bulk_update(batch, ['image_placeholder'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_add_image_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, verbose_name='Заглушка картинки'),
+        ),
+        migrations.RunPython(
+            fill_image_placeholders, migrations.RunPython.noop
+        ),
+    ]
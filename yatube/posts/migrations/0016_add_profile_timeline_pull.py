@@ -0,0 +1,32 @@
+# Generated by Django 2.2.16 on 2026-10-17 08:04
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def mark_celebrities(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    Profile = apps.get_model('posts', 'Profile')
+    celebrities = Follow.objects.values('author').annotate(
+        followers=Count('user')
+    ).filter(
+        followers__gt=settings.TIMELINE_FANOUT_LIMIT
+    ).values('author')
+    Profile.objects.filter(user__in=celebrities).update(timeline_pull=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_add_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='timeline_pull',
+            field=models.BooleanField(default=False, help_text='Посты автора с большим числом подписчиков не раскладываются по лентам', verbose_name='Посты подмешиваются в ленты при чтении'),
+        ),
+        migrations.RunPython(mark_celebrities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.16 on 2026-10-17 08:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_add_profile_timeline_pull'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingFanOut',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='posts.Post', verbose_name='Пост')),
+            ],
+            options={
+                'verbose_name': 'Пост в очереди раскладки',
+                'verbose_name_plural': 'Очередь раскладки по лентам',
+            },
+        ),
+    ]
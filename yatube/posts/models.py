@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -22,6 +24,59 @@ class Group(models.Model):
         return self.title
 
 
+class Profile(models.Model):
+    """Модель профиля пользователя со счетчиками."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='profile',
+        verbose_name='Пользователь'
+    )
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков',
+        default=0
+    )
+    following_count = models.PositiveIntegerField('Число подписок', default=0)
+    timeline_pull = models.BooleanField(
+        'Посты подмешиваются в ленты при чтении',
+        default=False,
+        help_text='Посты автора с большим числом подписчиков '
+                  'не раскладываются по лентам'
+    )
+
+    class Meta:
+        verbose_name = 'Профиль'
+        verbose_name_plural = 'Профили'
+
+    def __str__(self):
+        return str(self.user)
+
+
+CARD_FIELDS = (
+    'text', 'pub_date', 'image', 'image_width', 'image_height',
+    'image_placeholder',
+    'author', 'author__username', 'author__first_name', 'author__last_name',
+    'group', 'group__slug', 'group__title',
+)
+
+
+class PostQuerySet(models.QuerySet):
+    def for_cards(self):
+        """Подгружает автора и группу одним запросом и только те поля,
+        которые выводятся в карточках постов.
+        """
+        return self.select_related('author', 'group').only(*CARD_FIELDS)
+
+    def for_detail(self):
+        """То же, что for_cards, плюс счетчики для страницы поста."""
+        return self.select_related('author__profile', 'group').only(
+            *CARD_FIELDS, 'comments_count',
+            'author__profile', 'author__profile__posts_count',
+        )
+
+
 class Post(models.Model):
     """Модель постов (записей)."""
     text = models.TextField(
@@ -50,13 +105,56 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    # Заполняются формой при загрузке (см. posts.images). width_field
+    # у ImageField не подходит: он открывает файл при создании объекта
+    # поста, если размер еще не известен
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки',
+        null=True,
+        blank=True,
+        editable=False
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки',
+        null=True,
+        blank=True,
+        editable=False
+    )
+    # data: URI, который виден, пока грузится миниатюра
+    image_placeholder = models.TextField(
+        'Заглушка картинки',
+        blank=True,
+        editable=False
+    )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Индексы повторяют порядок ключа пагинации (-pub_date, -id)
+        indexes = [
+            models.Index(
+                name='posts_post_author_date_idx',
+                fields=['author', '-pub_date', '-id'],
+            ),
+            models.Index(
+                name='posts_post_group_date_idx',
+                fields=['group', '-pub_date', '-id'],
+            ),
+            models.Index(
+                name='posts_post_date_id_idx',
+                fields=['-pub_date', '-id'],
+            ),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -92,6 +190,12 @@ class Comment(models.Model):
     class Meta:
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = [
+            models.Index(
+                name='posts_comment_post_date_idx',
+                fields=['post', 'created'],
+            ),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -125,3 +229,111 @@ class Follow(models.Model):
                 check=~models.Q(user=models.F("author")),
             )
         ]
+        indexes = [
+            models.Index(
+                name='posts_follow_author_user_idx',
+                fields=['author', 'user'],
+            ),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Модель записей материализованной ленты подписок."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик',
+        help_text='Пользователь, в ленту которого попал пост'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор поста'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        ordering = ['-pub_date']
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                name='posts_timelineentry_unique_post',
+                fields=['user', 'post'],
+            ),
+        ]
+        indexes = [
+            models.Index(
+                name='posts_timeline_user_date_idx',
+                fields=['user', '-pub_date', '-post'],
+            ),
+        ]
+
+
+class PendingFanOut(models.Model):
+    """Модель очереди постов, которые еще не разложены по лентам.
+
+    Очередь разбирает команда fan_out_timelines (см. posts.timeline).
+    """
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='+',
+        verbose_name='Пост'
+    )
+
+    class Meta:
+        verbose_name = 'Пост в очереди раскладки'
+        verbose_name_plural = 'Очередь раскладки по лентам'
+
+
+class CounterShard(models.Model):
+    """Модель шардов счетчика.
+
+    Приращения горячих счетчиков пишутся в одну из нескольких строк,
+    выбранную случайно, и периодически сворачиваются в поле модели.
+    """
+    counter = models.CharField(
+        'Счетчик',
+        max_length=100,
+        help_text='Имя в виде app_label.model.field'
+    )
+    object_id = models.PositiveIntegerField('ID записи')
+    shard = models.PositiveSmallIntegerField('Номер шарда')
+    value = models.IntegerField('Приращение', default=0)
+
+    class Meta:
+        verbose_name = 'Шард счетчика'
+        verbose_name_plural = 'Шарды счетчиков'
+        constraints = [
+            models.UniqueConstraint(
+                name='posts_countershard_unique_shard',
+                fields=['counter', 'object_id', 'shard'],
+            ),
+        ]
+
+
+class MediaFile(models.Model):
+    """Модель файла картинки в хранилище по хешу.
+
+    Один файл может быть картинкой многих постов; когда ссылок не
+    остается, файл удаляется вместе с миниатюрами.
+    """
+    name = models.CharField('Имя файла', max_length=100, primary_key=True)
+    refs = models.PositiveIntegerField('Число постов', default=0)
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
+
+    def __str__(self):
+        return self.name
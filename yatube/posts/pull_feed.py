@@ -0,0 +1,225 @@
+"""Лента подписок, собираемая при чтении (pull).
+
+Для каждого автора в кеше хранится ограниченный список (pub_date, id) его
+последних постов, для каждого пользователя - множество id авторов, на которых
+он подписан. Страница ленты строится k-way слиянием этих списков через heapq,
+а сами посты выбираются одним запросом id__in.
+
+Список автора действителен, пока его версия совпадает со счетчиком версий
+автора: новый пост атомарно увеличивает счетчик, поэтому список, который
+одновременно меняют несколько писателей, не теряет постов, а пересобирается
+из базы.
+"""
+import heapq
+import time
+from collections import deque
+from itertools import dropwhile, islice, takewhile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.utils.functional import cached_property
+
+from .models import Follow, Post
+from .utils import CURSOR_NEXT, CursorPaginator
+
+RECENT_POSTS_KEY = 'pull_feed:recent:{}'
+RECENT_VERSION_KEY = 'pull_feed:recent_version:{}'
+FOLLOWING_KEY = 'pull_feed:following:{}'
+CACHE_TIMEOUT = 60 * 60 * 24
+# Ограничение на число параметров в одном запросе
+BATCH_SIZE = 500
+
+RECENT_POSTS_SQL = '''
+    SELECT id, author_id, pub_date FROM (
+        SELECT id, author_id, pub_date, ROW_NUMBER() OVER (
+            PARTITION BY author_id ORDER BY pub_date DESC, id DESC
+        ) AS position
+        FROM {table} WHERE author_id IN ({placeholders})
+    ) ranked WHERE position <= %s
+    ORDER BY author_id, pub_date DESC, id DESC
+'''
+
+
+def get_following_ids(user_id):
+    """Возвращает множество id авторов, на которых подписан пользователь."""
+    key = FOLLOWING_KEY.format(user_id)
+    following = cache.get(key)
+    if following is None:
+        following = set(
+            Follow.objects.filter(user_id=user_id).values_list(
+                'author', flat=True
+            )
+        )
+        cache.set(key, following, CACHE_TIMEOUT)
+    return following
+
+
+def forget_following(user_id):
+    cache.delete(FOLLOWING_KEY.format(user_id))
+
+
+def get_recent_versions(author_ids):
+    """Возвращает словарь {id автора: версия списка его постов}.
+
+    Начальная версия берется из часов, как в core.cache.tag_versions.
+    """
+    keys = {RECENT_VERSION_KEY.format(author_id): author_id
+            for author_id in author_ids}
+    versions = {
+        keys[key]: version
+        for key, version in cache.get_many(list(keys)).items()
+    }
+    for key, author_id in keys.items():
+        if author_id not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[author_id] = cache.get(key)
+    return versions
+
+
+def bump_recent_version(author_id):
+    """Атомарно увеличивает версию списка постов автора и возвращает ее;
+    None, если счетчика не было и список в любом случае недействителен.
+    """
+    key = RECENT_VERSION_KEY.format(author_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+        return None
+
+
+def get_recent_posts(author_ids):
+    """Возвращает словарь {id автора: [(pub_date, id поста), ...]}.
+
+    Списки отсортированы по убыванию и берутся из кеша, недостающие
+    и устаревшие выбираются из базы пачками и сразу кешируются
+    с версией, прочитанной до запроса к базе.
+    """
+    versions = get_recent_versions(author_ids)
+    keys = {RECENT_POSTS_KEY.format(author_id): author_id
+            for author_id in author_ids}
+    recent = {}
+    for key, (version, entries) in cache.get_many(list(keys)).items():
+        if version == versions[keys[key]]:
+            recent[keys[key]] = entries
+    missing = [author_id for author_id in author_ids
+               if author_id not in recent]
+    if not missing:
+        return recent
+    fetched = {author_id: [] for author_id in missing}
+    for start in range(0, len(missing), BATCH_SIZE):
+        batch = missing[start:start + BATCH_SIZE]
+        posts = Post.objects.raw(
+            RECENT_POSTS_SQL.format(
+                table=Post._meta.db_table,
+                placeholders=', '.join(['%s'] * len(batch)),
+            ),
+            batch + [settings.RECENT_POSTS_LENGTH],
+        )
+        for post in posts:
+            fetched[post.author_id].append((post.pub_date, post.pk))
+    cache.set_many(
+        {RECENT_POSTS_KEY.format(author_id): (versions[author_id], entries)
+         for author_id, entries in fetched.items()},
+        CACHE_TIMEOUT
+    )
+    recent.update(fetched)
+    return recent
+
+
+def add_recent_post(author_id, entry):
+    """Добавляет запись в начало списка автора, если никто не менял
+    список с тех пор, как версия была на единицу меньше.
+    """
+    version = bump_recent_version(author_id)
+    if version is None:
+        return
+    key = RECENT_POSTS_KEY.format(author_id)
+    cached = cache.get(key)
+    if cached is None or cached[0] != version - 1:
+        # Список устарел или его меняет другой писатель: читатели
+        # увидят несовпадение версий и пересоберут его из базы
+        return
+    entries = cached[1]
+    if entry not in entries:
+        entries.insert(0, entry)
+    cache.set(
+        key,
+        (version, entries[:settings.RECENT_POSTS_LENGTH]),
+        CACHE_TIMEOUT
+    )
+
+
+def push_post(post):
+    """Добавляет новый пост в закешированный список автора после
+    фиксации транзакции, чтобы пересобранный из базы список его видел.
+    """
+    transaction.on_commit(
+        lambda: add_recent_post(post.author_id, (post.pub_date, post.pk))
+    )
+
+
+def forget_author(author_id):
+    transaction.on_commit(lambda: bump_recent_version(author_id))
+
+
+class MergedFeed:
+    """Лента, собранная слиянием списков последних постов авторов."""
+
+    def __init__(self, recent_lists, queryset):
+        self.recent_lists = recent_lists
+        self.queryset = queryset
+
+    def count(self):
+        return sum(map(len, self.recent_lists))
+
+    def entries(self):
+        """Возвращает итератор по (pub_date, id) всех постов по убыванию."""
+        return heapq.merge(*self.recent_lists, reverse=True)
+
+    def fetch(self, entries):
+        """Выбирает посты одним запросом, сохраняя порядок entries."""
+        posts = self.queryset.in_bulk([pk for _, pk in entries])
+        return [posts[pk] for _, pk in entries if pk in posts]
+
+    def __getitem__(self, item):
+        return self.fetch(
+            list(islice(self.entries(), item.start, item.stop))
+        )
+
+
+class FeedPaginator(CursorPaginator):
+    """Пагинатор для MergedFeed: окна по курсору берутся из слияния
+    списков, а число записей известно без запросов к базе.
+    """
+
+    def __init__(self, object_list, per_page, **kwargs):
+        Paginator.__init__(self, object_list, per_page, **kwargs)
+        self.count_is_exact = True
+
+    @cached_property
+    def count(self):
+        return self.object_list.count()
+
+    def _cursor_window(self, direction, pub_date, pk, limit):
+        position = (pub_date, pk)
+        entries = self.object_list.entries()
+        if direction == CURSOR_NEXT:
+            window = list(islice(
+                dropwhile(lambda entry: entry >= position, entries), limit
+            ))
+        else:
+            window = deque(
+                takewhile(lambda entry: entry > position, entries),
+                maxlen=limit
+            )
+            window.reverse()
+        return self.object_list.fetch(list(window))
+
+
+def merged_feed(user):
+    """Возвращает ленту подписок пользователя, собранную слиянием."""
+    recent = get_recent_posts(list(get_following_ids(user.pk)))
+    return MergedFeed(list(recent.values()), Post.objects.for_cards())
@@ -0,0 +1,36 @@
+"""Отношения зрителя страницы к авторам постов."""
+from django.utils.functional import cached_property
+
+from .pull_feed import get_following_ids
+
+
+class FollowResolver:
+    """Отвечает, подписан ли зритель на авторов, одним запросом на запрос.
+
+    Множество id авторов, на которых подписан пользователь, берется из кеша
+    ленты подписок (см. pull_feed.get_following_ids) и сбрасывается при
+    подписке и отписке. Поддерживает оператор in, поэтому в шаблонах
+    можно писать {% if post.author_id in follows %}.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def following_ids(self):
+        if not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(get_following_ids(self.user.pk))
+
+    def follows(self, author_id):
+        return author_id in self.following_ids
+
+    def __contains__(self, author_id):
+        return self.follows(author_id)
+
+
+def get_follow_resolver(request):
+    """Возвращает резолвер, общий для всего запроса."""
+    if not hasattr(request, '_follow_resolver'):
+        request._follow_resolver = FollowResolver(request.user)
+    return request._follow_resolver
@@ -0,0 +1,278 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from core.cache import bump_tags
+from core.static_pages import (static_pages_enabled, unpublish, unpublish_all,
+                               unpublish_tagged)
+
+from . import media, pull_feed, thumbnails, timeline
+from .counters import change_counter
+from .models import Comment, Follow, Group, Post, Profile, User
+from .tags import INDEX_TAG, author_tag, group_tag, post_tag, username_tag
+
+
+def timeline_enabled():
+    return settings.FOLLOW_FEED_ENGINE == 'timeline'
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, raw=False, **kwargs):
+    """Добавляет новый пост в ленты подписчиков и список постов автора."""
+    if created and not raw:
+        pull_feed.push_post(instance)
+        if timeline_enabled():
+            timeline.schedule_fan_out(instance)
+
+
+@receiver(post_delete, sender=Post)
+def forget_deleted_post(sender, instance, **kwargs):
+    pull_feed.forget_author(instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_new_follow(sender, instance, created, raw=False, **kwargs):
+    """Добавляет посты автора в ленту нового подписчика."""
+    if created and not raw:
+        pull_feed.forget_following(instance.user_id)
+        if timeline_enabled():
+            timeline.backfill_timeline(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def clean_up_unfollow(sender, instance, **kwargs):
+    """Убирает посты автора из ленты бывшего подписчика."""
+    pull_feed.forget_following(instance.user_id)
+    if timeline_enabled():
+        timeline.remove_from_timeline(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=User)
+def create_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Profile.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(Profile, instance.author_id, 'posts_count', 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    change_counter(Profile, instance.author_id, 'posts_count', -1)
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous_image(sender, instance, raw=False, update_fields=None,
+                            **kwargs):
+    """Запоминает прежнюю картинку поста для счетчика ссылок.
+
+    Прежнее имя читается из базы, только если картинку могли поменять:
+    в посте новый загруженный файл, картинку сохраняют явно
+    (update_fields) или ее убрали в форме (PostForm). Обычные сохранения
+    без новой картинки обходятся без запроса.
+    """
+    image = instance.image
+    instance._previous_image = image.name or ''
+    # Загруженный файл нужен, чтобы записать его заново (media.restore)
+    instance._image_upload = None if image._committed else image.file
+    if raw or instance.pk is None:
+        instance._previous_image = ''
+        return
+    if update_fields is not None:
+        changed = 'image' in update_fields
+    else:
+        changed = not image._committed or getattr(
+            instance, '_image_changed', False
+        )
+    if changed:
+        instance._previous_image = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('image', flat=True).first() or ''
+
+
+@receiver(post_save, sender=Post)
+def count_image_refs(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_image', '')
+    instance._image_changed = False
+    if raw or instance.image.name == previous:
+        return
+    if instance.image:
+        media.acquire(instance.image.name)
+        media.restore(instance.image, instance._image_upload)
+    if previous:
+        media.release(previous)
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    if instance.image:
+        media.release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(Post, instance.post_id, 'comments_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    change_counter(Post, instance.post_id, 'comments_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(Profile, instance.author_id, 'followers_count', 1)
+        change_counter(Profile, instance.user_id, 'following_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    change_counter(Profile, instance.author_id, 'followers_count', -1)
+    change_counter(Profile, instance.user_id, 'following_count', -1)
+
+
+def post_tags(post):
+    tags = [INDEX_TAG, post_tag(post.pk), author_tag(post.author_id)]
+    if post.group_id:
+        tags.append(group_tag(post.group.slug))
+    return tags
+
+
+def post_pages(post):
+    """Пути опубликованных страниц, на которых выводится пост."""
+    pages = [
+        reverse('posts:index'),
+        reverse('posts:post_detail', args=[post.pk]),
+        reverse('posts:profile', args=[post.author.username]),
+    ]
+    if post.group_id:
+        pages.append(reverse('posts:group_posts', args=[post.group.slug]))
+    return pages
+
+
+@receiver(pre_save, sender=Post)
+def invalidate_previous_group(sender, instance, raw=False, **kwargs):
+    """Сбрасывает страницу группы, из которой пост переносят."""
+    if raw or instance.pk is None:
+        return
+    previous = Post.objects.filter(pk=instance.pk).exclude(
+        group_id=instance.group_id
+    ).exclude(group=None).values_list('group__slug', flat=True).first()
+    if previous:
+        bump_tags(group_tag(previous))
+        unpublish(reverse('posts:group_posts', args=[previous]))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_tags(*post_tags(instance))
+        if static_pages_enabled():
+            unpublish(*post_pages(instance))
+
+
+def refresh_post_pages(post_id):
+    """Пересобирает страницы с постом, когда готова его миниатюра."""
+    post = Post.objects.select_related('author', 'group').filter(
+        pk=post_id
+    ).first()
+    if post is not None:
+        invalidate_post(Post, post)
+
+
+@receiver(post_save, sender=Post)
+def make_post_thumbnail(sender, instance, raw=False, **kwargs):
+    if not raw and instance.image:
+        thumbnails.schedule_thumbnail(
+            instance.pk,
+            instance.image.name,
+            instance.image_width,
+            refresh_post_pages
+        )
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_tags(post_tag(instance.post_id))
+        if static_pages_enabled():
+            unpublish(reverse('posts:post_detail', args=[instance.post_id]))
+
+
+@receiver(pre_save, sender=Group)
+def invalidate_previous_slug(sender, instance, raw=False, **kwargs):
+    """Сбрасывает кеш группы по прежнему адресу при смене slug."""
+    if raw or instance.pk is None:
+        return
+    previous = Group.objects.filter(pk=instance.pk).exclude(
+        slug=instance.slug
+    ).values_list('slug', flat=True).first()
+    if previous:
+        bump_tags(group_tag(previous))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group(sender, instance, raw=False, **kwargs):
+    """Ссылки на группу выводятся в карточках постов на всех лентах."""
+    if not raw:
+        tags = (INDEX_TAG, group_tag(instance.slug))
+        bump_tags(*tags)
+        unpublish_all(*tags)
+
+
+@receiver(pre_save, sender=User)
+def invalidate_previous_username(sender, instance, raw=False,
+                                 update_fields=None, **kwargs):
+    """Сбрасывает кеш пользователя по прежнему имени при его смене."""
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    previous = User.objects.filter(pk=instance.pk).exclude(
+        username=instance.username
+    ).values_list('username', flat=True).first()
+    if previous:
+        bump_tags(username_tag(previous))
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(sender, instance, created, raw=False,
+                      update_fields=None, **kwargs):
+    """Имя автора выводится в карточках его постов на всех страницах,
+    поэтому снимаются с публикации страницы с тегом автора.
+
+    Вход на сайт сохраняет только last_login, страниц он не меняет.
+    Новый пользователь сбрасывает запомненное отсутствие своего имени.
+    """
+    if raw or update_fields == frozenset(['last_login']):
+        return
+    if created:
+        bump_tags(username_tag(instance.username))
+        return
+    bump_tags(author_tag(instance.pk))
+    unpublish_tagged(author_tag(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    bump_tags(author_tag(instance.pk), username_tag(instance.username))
+    unpublish(reverse('posts:profile', args=[instance.username]))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow(sender, instance, raw=False, **kwargs):
+    """Число подписчиков выводится на странице автора."""
+    if not raw:
+        bump_tags(author_tag(instance.author_id))
+        if static_pages_enabled():
+            unpublish_tagged(author_tag(instance.author_id))
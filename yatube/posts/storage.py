@@ -0,0 +1,70 @@
+"""Хранилище картинок постов по хешу содержимого.
+
+Имя файла - это sha256 его содержимого (posts/ab/abcd....jpg), поэтому
+одна и та же картинка, загруженная в разные посты, хранится одним файлом,
+а sorl-thumbnail, который различает картинки по имени, создает для нее
+одни миниатюры. Сколько постов ссылается на файл, считает MediaFile
+(см. posts.media).
+"""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CONTENT_NAME_RE = re.compile(r'^(?:.*/)?([0-9a-f]{2})/\1[0-9a-f]{62}\.\w+$')
+
+
+def content_hash(content):
+    """sha256 содержимого файла; файл читается по частям."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_name(content, name):
+    """Имя файла по хешу в том же каталоге и с тем же расширением."""
+    directory, filename = os.path.split(name)
+    digest = content_hash(content)
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(directory, digest[:2], digest + extension)
+
+
+def is_content_name(name):
+    return CONTENT_NAME_RE.match(name) is not None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Сохраняет файл под именем по хешу, а если такой уже есть, только
+    возвращает его имя.
+
+    Два одновременных сохранения новой картинки дадут второй файл с
+    суффиксом; dedupe_media сведет его с первым.
+    """
+
+    def save(self, name, content, max_length=None):
+        return self.store(name, content, max_length)[0]
+
+    def store(self, name, content, max_length=None):
+        """То же, что save, но возвращает пару (имя, новый ли файл)."""
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = content_name(content, name)
+        if self.exists(name):
+            return name, False
+        return super().save(name, content, max_length), True
+
+    def restore(self, name, content):
+        """Записывает удаленный файл заново под его именем по хешу."""
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = os.path.splitext(os.path.basename(name))[0]
+        if content_hash(content) != digest:
+            raise ValueError(f'Содержимое не соответствует имени {name}')
+        return super().save(name, content)
@@ -0,0 +1,34 @@
+"""Теги кеша страниц с постами (см. core.cache)."""
+INDEX_TAG = 'feed:index'
+
+
+def post_tag(post_id):
+    return f'post:{post_id}'
+
+
+def author_tag(author_id):
+    return f'author:{author_id}'
+
+
+def username_tag(username):
+    return f'username:{username}'
+
+
+def group_tag(slug):
+    return f'group:{slug}'
+
+
+def index_tags(request):
+    return [INDEX_TAG]
+
+
+def group_tags(request, slug):
+    return [group_tag(slug)]
+
+
+def profile_tags(request, username):
+    return []
+
+
+def post_detail_tags(request, post_id):
+    return [post_tag(post_id)]
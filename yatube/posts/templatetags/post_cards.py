@@ -0,0 +1,15 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts.cards import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def cached_cards(context, posts):
+    """Возвращает пары (пост, карточка) для {% for post, card in ... %}."""
+    return [
+        (post, mark_safe(card))
+        for post, card in render_cards(posts, context.get('request'))
+    ]
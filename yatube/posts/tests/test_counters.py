@@ -0,0 +1,177 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.counters import compact_counters, counter_value
+from posts.models import Comment, CounterShard, Follow, Post, Profile
+
+User = get_user_model()
+
+
+class CounterTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def get_profile(self, user):
+        return Profile.objects.get(user=user)
+
+    def test_counters_follow_writes_and_deletes(self):
+        """Счетчики меняются при создании и удалении постов,
+        комментариев и подписок
+        """
+        post = Post.objects.create(author=CounterTests.author, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=CounterTests.reader, text='Комментарий'
+        )
+        follow = Follow.objects.create(
+            user=CounterTests.reader, author=CounterTests.author
+        )
+        post.refresh_from_db()
+        author = self.get_profile(CounterTests.author)
+        reader = self.get_profile(CounterTests.reader)
+        self.assertEqual(author.posts_count, 1)
+        self.assertEqual(counter_value(author, 'followers_count'), 1)
+        self.assertEqual(reader.following_count, 1)
+        self.assertEqual(counter_value(post, 'comments_count'), 1)
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(counter_value(post, 'comments_count'), 0)
+        post.delete()
+        author = self.get_profile(CounterTests.author)
+        reader = self.get_profile(CounterTests.reader)
+        self.assertEqual(author.posts_count, 0)
+        self.assertEqual(counter_value(author, 'followers_count'), 0)
+        self.assertEqual(reader.following_count, 0)
+
+    def test_cascade_delete_updates_counters(self):
+        """Удаление пользователя уменьшает счетчики тех, с кем он связан"""
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=fan, author=CounterTests.author)
+        Follow.objects.create(user=CounterTests.reader, author=fan)
+        fan.delete()
+        self.assertEqual(
+            counter_value(
+                self.get_profile(CounterTests.author), 'followers_count'
+            ),
+            0
+        )
+        self.assertEqual(
+            self.get_profile(CounterTests.reader).following_count, 0
+        )
+
+    @override_settings(COUNTER_SHARDS=4)
+    def test_sharded_counter_is_compacted(self):
+        """Приращения горячих счетчиков расходятся по шардам,
+        а compact_counters сворачивает их в поле записи
+        """
+        post = Post.objects.create(author=CounterTests.author, text='Пост')
+        for comment_id in range(20):
+            Comment.objects.create(
+                post=post, author=CounterTests.reader, text=f'{comment_id}'
+            )
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertLessEqual(CounterShard.objects.count(), 4)
+        self.assertEqual(counter_value(post, 'comments_count'), 20)
+        self.assertEqual(compact_counters(), 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 20)
+        self.assertFalse(CounterShard.objects.exists())
+
+    @override_settings(COUNTER_SHARDS=4)
+    def test_pages_show_sharded_counters(self):
+        """Страницы выводят горячие счетчики вместе с несвернутыми
+        шардами
+        """
+        cache.clear()
+        post = Post.objects.create(author=CounterTests.author, text='Пост')
+        for comment_id in range(3):
+            Comment.objects.create(
+                post=post, author=CounterTests.reader, text=f'{comment_id}'
+            )
+        Follow.objects.create(
+            user=CounterTests.reader, author=CounterTests.author
+        )
+        self.assertContains(
+            Client().get(reverse('posts:post_detail', args=[post.pk])),
+            'Комментариев: 3'
+        )
+        self.assertContains(
+            Client().get(
+                reverse('posts:profile', args=[CounterTests.author.username])
+            ),
+            'Подписчиков: 1'
+        )
+
+    def test_shard_compacted_after_insert_keeps_increment(self):
+        """Приращение не теряется, если compact_counters удалил только что
+        созданный шард до UPDATE
+        """
+        post = Post.objects.create(author=CounterTests.author, text='Пост')
+        bulk_create = CounterShard.objects.bulk_create
+
+        def create_and_compact(*args, **kwargs):
+            bulk_create(*args, **kwargs)
+            if create_and_compact.calls == 0:
+                compact_counters()
+            create_and_compact.calls += 1
+
+        create_and_compact.calls = 0
+        with mock.patch.object(
+            CounterShard.objects, 'bulk_create',
+            side_effect=create_and_compact
+        ):
+            Comment.objects.create(
+                post=post, author=CounterTests.reader, text='Комментарий'
+            )
+        post.refresh_from_db()
+        self.assertEqual(create_and_compact.calls, 2)
+        self.assertEqual(counter_value(post, 'comments_count'), 1)
+
+    def test_compact_counters_command(self):
+        """compact_counters сворачивает шарды"""
+        post = Post.objects.create(author=CounterTests.author, text='Пост')
+        Comment.objects.create(
+            post=post, author=CounterTests.reader, text='Комментарий'
+        )
+        out = StringIO()
+        call_command('compact_counters', stdout=out)
+        self.assertIn('Свернуто счетчиков: 1', out.getvalue())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+    def test_recount_fixes_drift(self):
+        """Команда recount_counters исправляет разошедшиеся счетчики
+        и создает недостающие профили
+        """
+        post = Post.objects.create(author=CounterTests.author, text='Пост')
+        Comment.objects.create(
+            post=post, author=CounterTests.reader, text='Комментарий'
+        )
+        Profile.objects.filter(user=CounterTests.author).update(
+            posts_count=7, followers_count=3
+        )
+        Profile.objects.filter(user=CounterTests.reader).delete()
+        Post.objects.filter(pk=post.pk).update(comments_count=5)
+        out = StringIO()
+        call_command(
+            'recount_counters', workers=1, chunk_size=1, stdout=out
+        )
+        author = self.get_profile(CounterTests.author)
+        post.refresh_from_db()
+        self.assertEqual(author.posts_count, 1)
+        self.assertEqual(author.followers_count, 0)
+        self.assertTrue(
+            Profile.objects.filter(user=CounterTests.reader).exists()
+        )
+        self.assertEqual(post.comments_count, 1)
+        self.assertIn('профилей: 1, постов: 1', out.getvalue())
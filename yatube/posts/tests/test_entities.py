@@ -0,0 +1,91 @@
+import pickle
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import Http404
+from django.test import TestCase
+
+from posts.entities import get_author_or_404, get_group_or_404
+from posts.models import Group, Post
+
+User = get_user_model()
+
+
+class EntityCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_group_is_cached_until_changed(self):
+        """Группа читается из базы один раз и сбрасывается при изменении"""
+        get_group_or_404('group')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_group_or_404('group'), EntityCacheTests.group)
+        group = Group.objects.get(slug='group')
+        group.title = 'Новое название'
+        group.save()
+        self.assertEqual(get_group_or_404('group').title, 'Новое название')
+
+    def test_missing_objects_are_cached(self):
+        """Отсутствие объекта запоминается до его создания"""
+        with self.assertRaises(Http404):
+            get_group_or_404('new')
+        with self.assertNumQueries(0), self.assertRaises(Http404):
+            get_group_or_404('new')
+        with self.assertRaises(Http404):
+            get_author_or_404('newcomer')
+        Group.objects.create(title='Новая', slug='new', description='')
+        User.objects.create_user(username='newcomer')
+        self.assertEqual(get_group_or_404('new').slug, 'new')
+        self.assertEqual(get_author_or_404('newcomer').username, 'newcomer')
+
+    def test_renamed_objects_are_not_found_by_old_name(self):
+        """После смены slug и имени старые адреса перестают работать"""
+        get_group_or_404('group')
+        get_author_or_404('author')
+        group = Group.objects.get(slug='group')
+        group.slug = 'renamed'
+        group.save()
+        author = User.objects.get(username='author')
+        author.username = 'renamed'
+        author.save()
+        for lookup, name in (
+            (get_group_or_404, 'group'), (get_author_or_404, 'author')
+        ):
+            with self.subTest(lookup=lookup.__name__):
+                with self.assertRaises(Http404):
+                    lookup(name)
+
+    def test_author_counters_are_fresh(self):
+        """Профиль автора в кеше сбрасывается при публикации поста"""
+        with self.assertNumQueries(1):
+            author = get_author_or_404('author')
+        self.assertEqual(author.profile.posts_count, 0)
+        Post.objects.create(author=EntityCacheTests.author, text='Пост')
+        self.assertEqual(
+            get_author_or_404('author').profile.posts_count, 1
+        )
+
+    def test_cached_author_has_no_private_fields(self):
+        """В общий кеш не попадают пароль, почта и дата входа"""
+        User.objects.filter(username='author').update(
+            password='secret-hash', email='author@example.com'
+        )
+        author = get_author_or_404('author')
+        self.assertTrue(
+            {'password', 'email', 'last_login'}
+            <= author.get_deferred_fields()
+        )
+        with self.assertNumQueries(0):
+            cached = get_author_or_404('author')
+            self.assertEqual(cached.profile.posts_count, 0)
+            self.assertEqual(cached.get_full_name(), '')
+        self.assertNotIn(b'secret-hash', pickle.dumps(cached))
+        self.assertNotIn(b'author@example.com', pickle.dumps(cached))
@@ -1,14 +1,18 @@
+import hashlib
 import shutil
 import tempfile
 from http import HTTPStatus
+from io import BytesIO
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
 from posts.forms import PostForm
+from posts.images import MAX_IMAGE_SIZE
 from posts.models import Group, Post
 
 User = get_user_model()
@@ -16,6 +20,12 @@ User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
+def content_name(content, extension):
+    """Имя картинки в хранилище по хешу содержимого."""
+    digest = hashlib.sha256(content).hexdigest()
+    return f'posts/{digest[:2]}/{digest}{extension}'
+
+
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostFormTests(TestCase):
     @classmethod
@@ -88,7 +98,7 @@ class PostFormTests(TestCase):
             Post.objects.filter(
                 text=form_data['text'],
                 group=form_data['group'],
-                image=f"posts/{form_data['image']}",
+                image=content_name(small_gif_2, '.gif'),
             ).exists()
         )
 
@@ -110,3 +120,54 @@ class PostFormTests(TestCase):
         self.assertEqual(edited_post.text, form_data['text'])
         self.assertEqual(edited_post.group, form_data['group'])
         self.assertEqual(edited_post.image.name, form_data['image'])
+
+    def test_create_post_normalizes_image(self):
+        """Большая картинка уменьшается, поворачивается и теряет EXIF."""
+        image = Image.new('RGB', (MAX_IMAGE_SIZE[0] * 2, 100), 'red')
+        exif = Image.Exif()
+        # Ориентация 6: при показе картинку надо повернуть на 90 градусов
+        exif[0x0112] = 6
+        content = BytesIO()
+        image.save(content, 'JPEG', exif=exif)
+        uploaded = SimpleUploadedFile(
+            name='photo.jpeg',
+            content=content.getvalue(),
+            content_type='image/jpeg'
+        )
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с фото', 'image': uploaded},
+        )
+        post = Post.objects.get(text='Пост с фото')
+        self.assertEqual(
+            post.image.name, content_name(post.image.read(), '.jpg')
+        )
+        self.assertEqual(
+            (post.image_width, post.image_height),
+            (50, MAX_IMAGE_SIZE[1])
+        )
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.size, (50, MAX_IMAGE_SIZE[1]))
+            self.assertNotIn('exif', stored.info)
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/webp;base64,')
+        )
+
+    def test_create_post_keeps_small_image(self):
+        """Небольшая картинка без метаданных сохраняется как есть."""
+        post = Post.objects.get(pk=1)
+        content = post.image.read()
+        self.authorized_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': post.id}),
+            data={
+                'text': post.text,
+                'image': SimpleUploadedFile(
+                    name='small_3.gif',
+                    content=content,
+                    content_type='image/gif'
+                ),
+            },
+        )
+        post.refresh_from_db()
+        self.assertEqual(post.image.name, content_name(content, '.gif'))
+        self.assertEqual((post.image_width, post.image_height), (1, 1))
@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from posts.forms import PostForm
+from posts.models import MediaFile, Post
+from posts.storage import ContentAddressedStorage, is_content_name
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x01\x00'
+    b'\x01\x00\x00\x00\x00\x21\xf9\x04'
+    b'\x01\x0a\x00\x01\x00\x2c\x00\x00'
+    b'\x00\x00\x01\x00\x01\x00\x00\x02'
+    b'\x02\x4c\x01\x00\x3b'
+)
+
+
+def media_path(name):
+    return os.path.join(TEMP_MEDIA_ROOT, name)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@mock.patch(
+    'posts.media.transaction.on_commit',
+    side_effect=lambda callback: callback()
+)
+class ContentAddressedStorageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, name):
+        return Post.objects.create(
+            author=ContentAddressedStorageTests.author,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name=name, content=SMALL_GIF, content_type='image/gif'
+            ),
+        )
+
+    def test_same_images_share_file(self, on_commit):
+        """Одинаковые картинки хранятся одним файлом, который удаляется
+        вместе с последним постом
+        """
+        first = self.create_post('first.gif')
+        second = self.create_post('second.gif')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(is_content_name(first.image.name))
+        media_file = MediaFile.objects.get(name=first.image.name)
+        self.assertEqual(media_file.refs, 2)
+        first.delete()
+        media_file.refresh_from_db()
+        self.assertEqual(media_file.refs, 1)
+        self.assertTrue(os.path.exists(media_path(second.image.name)))
+        second.delete()
+        self.assertFalse(MediaFile.objects.exists())
+        self.assertFalse(os.path.exists(media_path(second.image.name)))
+
+    def test_file_deleted_during_upload_is_restored(self, on_commit):
+        """Если файл удалили после проверки его наличия при загрузке,
+        пост записывает его заново
+        """
+        post = self.create_post('first.gif')
+        name = post.image.name
+        post.delete()
+        self.assertFalse(os.path.exists(media_path(name)))
+        # Загрузка еще видит файл, удаленный сразу после проверки
+        checks = iter([True])
+
+        def exists(storage, name):
+            return next(checks, False) or os.path.exists(storage.path(name))
+
+        with mock.patch.object(
+            ContentAddressedStorage, 'exists', autospec=True,
+            side_effect=exists
+        ):
+            post = self.create_post('second.gif')
+        self.assertEqual(post.image.name, name)
+        self.assertTrue(os.path.exists(media_path(name)))
+        self.assertEqual(MediaFile.objects.get(name=name).refs, 1)
+
+    def test_previous_image_is_read_only_when_changed(self, on_commit):
+        """Прежняя картинка читается из базы, только когда картинку
+        меняют, и замена в форме освобождает старый файл
+        """
+        post = self.create_post('first.gif')
+        old_name = post.image.name
+        previous_image_sql = 'SELECT "posts_post"."image" FROM'
+        for update_fields in (None, ['text']):
+            with self.subTest(update_fields=update_fields):
+                with CaptureQueriesContext(connection) as queries:
+                    post.save(update_fields=update_fields)
+                self.assertFalse(any(
+                    query['sql'].startswith(previous_image_sql)
+                    for query in queries
+                ))
+        form = PostForm(
+            data={'text': 'Новая картинка'},
+            files={'image': SimpleUploadedFile(
+                name='new.gif',
+                content=SMALL_GIF + b'\x00',
+                content_type='image/gif'
+            )},
+            instance=post,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertNotEqual(post.image.name, old_name)
+        self.assertFalse(MediaFile.objects.filter(name=old_name).exists())
+        self.assertEqual(MediaFile.objects.get(name=post.image.name).refs, 1)
+
+    def test_image_replaced_without_form_is_released(self, on_commit):
+        """Замена картинки без PostForm (админка, код) освобождает
+        старый файл
+        """
+        post = self.create_post('first.gif')
+        old_name = post.image.name
+        post = Post.objects.get(pk=post.pk)
+        post.image = SimpleUploadedFile(
+            name='second.gif',
+            content=SMALL_GIF + b'\x00',
+            content_type='image/gif'
+        )
+        post.save()
+        self.assertFalse(MediaFile.objects.filter(name=old_name).exists())
+        self.assertFalse(os.path.exists(media_path(old_name)))
+        self.assertEqual(MediaFile.objects.get(name=post.image.name).refs, 1)
+
+    def test_dedupe_media_command(self, on_commit):
+        """dedupe_media переносит старые файлы в хранилище по хешу и
+        сводит одинаковые
+        """
+        os.makedirs(media_path('posts'), exist_ok=True)
+        legacy = ['posts/old_1.gif', 'posts/old_2.gif']
+        for name in legacy:
+            with open(media_path(name), 'wb') as file:
+                file.write(SMALL_GIF)
+        posts = [
+            Post.objects.create(
+                author=ContentAddressedStorageTests.author,
+                text=f'Старый пост {number}',
+                image=name,
+            )
+            for number, name in enumerate(legacy + ['posts/lost.gif'])
+        ]
+        output = StringIO()
+        call_command(
+            'dedupe_media', stdout=output, stderr=StringIO()
+        )
+        for post in posts:
+            post.refresh_from_db()
+        name = posts[0].image.name
+        self.assertTrue(is_content_name(name))
+        self.assertEqual(posts[1].image.name, name)
+        self.assertEqual(posts[2].image.name, 'posts/lost.gif')
+        self.assertTrue(os.path.exists(media_path(name)))
+        for old_name in legacy:
+            self.assertFalse(os.path.exists(media_path(old_name)))
+        self.assertEqual(MediaFile.objects.get(name=name).refs, 2)
+        self.assertIn('из них дубликатов: 1', output.getvalue())
@@ -1,5 +1,5 @@
 from django.contrib.auth import get_user_model
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
 from django.test import TestCase
 
 from posts.models import Comment, Follow, Group, Post
@@ -104,3 +104,51 @@ class ModelTest(TestCase):
         constraint_name = "posts_follow_prevent_self_follow"
         with self.assertRaisesMessage(IntegrityError, constraint_name):
             Follow.objects.create(user=user, author=user)
+
+
+class IndexUsageTest(TestCase):
+    """Запросы страниц используют составные индексы."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='user')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='Тестовый пост',
+            group=cls.group,
+        )
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # На маленьких таблицах планировщик предпочел бы seq scan
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def test_view_queries_use_indexes(self):
+        """Лента, группа, профиль, комментарии и подписчики автора
+        выбираются по индексам.
+        """
+        user = IndexUsageTest.user
+        post = IndexUsageTest.post
+        cards = Post.objects.for_cards().order_by('-pub_date', '-pk')
+        queries = {
+            'posts_post_date_id_idx': cards[:10],
+            'posts_post_group_date_idx': cards.filter(
+                group=IndexUsageTest.group
+            )[:10],
+            'posts_post_author_date_idx': cards.filter(author=user)[:10],
+            'posts_comment_post_date_idx': post.comments.select_related(
+                'author'
+            ).order_by('created'),
+            'posts_follow_author_user_idx': Follow.objects.filter(
+                author=user
+            ).values_list('user', flat=True),
+        }
+        for index_name, queryset in queries.items():
+            with self.subTest(index_name=index_name):
+                self.assertIn(index_name, queryset.explain())
@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from urllib.parse import unquote
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Follow, Group, Post
+
+User = get_user_model()
+
+TEMP_PAGES_ROOT = tempfile.mkdtemp(dir=os.getcwd())
+
+
+@override_settings(STATIC_PAGES_ROOT=TEMP_PAGES_ROOT)
+class StaticPagesTests(TransactionTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_PAGES_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        self.post = Post.objects.create(
+            author=self.author, group=self.group, text='Тестовый пост'
+        )
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.author)
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_PAGES_ROOT, ignore_errors=True)
+
+    def page_file(self, path):
+        return os.path.join(TEMP_PAGES_ROOT, path.lstrip('/'), 'index.html')
+
+    def test_anonymous_pages_are_published(self):
+        """Страница для анонимного посетителя записывается в файл"""
+        paths = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.pk]),
+        )
+        for path in paths:
+            with self.subTest(path=path):
+                response = self.guest_client.get(path)
+                with open(self.page_file(path), 'rb') as file:
+                    self.assertEqual(file.read(), response.content)
+
+    def test_personal_pages_are_not_published(self):
+        """Страницы с параметрами и для вошедших не публикуются"""
+        index = reverse('posts:index')
+        self.authorized_client.get(index)
+        self.guest_client.get(index, {'page': 2})
+        self.assertFalse(os.path.exists(self.page_file(index)))
+
+    def test_dot_segments_are_not_published(self):
+        """Профиль пользователя '..' не публикуется на место главной"""
+        User.objects.create_user(username='..')
+        index = reverse('posts:index')
+        response = self.guest_client.get('/profile/../')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(self.page_file(index)))
+        self.guest_client.get(index)
+        self.guest_client.get('/profile/../')
+        with open(self.page_file(index), 'rb') as file:
+            self.assertIn('Последние обновления'.encode(), file.read())
+
+    def test_non_ascii_paths_are_published(self):
+        """Страницы с кириллицей в адресе публикуются"""
+        author = User.objects.create_user(username='автор')
+        path = reverse('posts:profile', args=[author.username])
+        response = self.guest_client.get(path)
+        with open(self.page_file(unquote(path)), 'rb') as file:
+            self.assertEqual(file.read(), response.content)
+
+    def test_pages_are_unpublished_on_change(self):
+        """Изменение поста удаляет страницы, на которых он выводится"""
+        index = reverse('posts:index')
+        detail = reverse('posts:post_detail', args=[self.post.pk])
+        other = Post.objects.create(author=self.author, text='Другой пост')
+        other_detail = reverse('posts:post_detail', args=[other.pk])
+        for path in (index, detail, other_detail):
+            self.guest_client.get(path)
+        self.post.text = 'Новый текст'
+        self.post.save()
+        self.assertFalse(os.path.exists(self.page_file(index)))
+        self.assertFalse(os.path.exists(self.page_file(detail)))
+        self.assertTrue(os.path.exists(self.page_file(other_detail)))
+
+    def test_author_rename_republishes_fresh_pages(self):
+        """После смены имени автора страницы публикуются уже с ним"""
+        paths = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', args=[self.group.slug]),
+        )
+        for path in paths:
+            self.guest_client.get(path)
+        self.author.first_name = 'Переименованный'
+        self.author.save()
+        for path in paths:
+            with self.subTest(path=path):
+                self.assertFalse(os.path.exists(self.page_file(path)))
+                self.assertContains(
+                    self.guest_client.get(path), 'Переименованный'
+                )
+                with open(self.page_file(path), 'rb') as file:
+                    self.assertIn('Переименованный'.encode(), file.read())
+
+    def test_user_change_keeps_other_authors_pages(self):
+        """Изменение пользователя снимает только страницы с его постами"""
+        other = User.objects.create_user(username='other')
+        other_post = Post.objects.create(author=other, text='Чужой пост')
+        own = (
+            reverse('posts:index'),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.pk]),
+        )
+        foreign = (
+            reverse('posts:profile', args=[other.username]),
+            reverse('posts:post_detail', args=[other_post.pk]),
+        )
+        for path in own + foreign:
+            self.guest_client.get(path)
+        self.author.set_password('new-password')
+        self.author.save()
+        for path in own:
+            with self.subTest(path=path):
+                self.assertFalse(os.path.exists(self.page_file(path)))
+        for path in foreign:
+            with self.subTest(path=path):
+                self.assertTrue(os.path.exists(self.page_file(path)))
+
+    def test_follow_unpublishes_author_profile(self):
+        """Подписка снимает профиль автора с новым числом подписчиков"""
+        reader = User.objects.create_user(username='reader')
+        profile = reverse('posts:profile', args=[self.author.username])
+        self.guest_client.get(profile)
+        self.assertTrue(os.path.exists(self.page_file(profile)))
+        Follow.objects.create(user=reader, author=self.author)
+        self.assertFalse(os.path.exists(self.page_file(profile)))
+
+    def test_publish_pages_command(self):
+        """publish_pages публикует все страницы для анонимов"""
+        call_command('publish_pages', stdout=StringIO())
+        for path in (
+            reverse('posts:index'),
+            reverse('posts:group_posts', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.pk]),
+        ):
+            with self.subTest(path=path):
+                self.assertTrue(os.path.exists(self.page_file(path)))
@@ -0,0 +1,248 @@
+import shutil
+import tempfile
+from concurrent.futures import Future
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile, serialize_image_file
+from sorl.thumbnail.models import KVStore
+
+from posts import thumbnails
+from posts.models import Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x01\x00'
+    b'\x01\x00\x00\x00\x00\x21\xf9\x04'
+    b'\x01\x0a\x00\x01\x00\x2c\x00\x00'
+    b'\x00\x00\x01\x00\x01\x00\x00\x02'
+    b'\x02\x4c\x01\x00\x3b'
+)
+
+
+def make_image(number=0):
+    """Картинка; разные number дают разные файлы в хранилище по хешу."""
+    return SimpleUploadedFile(
+        name='small.gif',
+        content=SMALL_GIF + bytes(number),
+        content_type='image/gif'
+    )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=2)
+class ThumbnailPoolTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(
+            author=cls.author,
+            text='Пост с картинкой',
+            image=make_image(),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.future = Future()
+        self.executor = mock.Mock()
+        self.executor.submit.return_value = self.future
+        patcher = mock.patch(
+            'posts.thumbnails._get_executor', return_value=self.executor
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(thumbnails._pending.clear)
+
+    @mock.patch('posts.thumbnails.get_thumbnail', side_effect=AssertionError)
+    def test_pages_do_not_make_thumbnails(self, get_thumbnail):
+        """Страница выводит исходную картинку и отдает создание
+        миниатюры пулу, а готовая миниатюра пересобирает страницу
+        """
+        post = ThumbnailPoolTests.post
+        url = reverse('posts:post_detail', args=[post.pk])
+        response = Client().get(url)
+        self.assertContains(response, post.image.url)
+        Client().get(reverse('posts:index'))
+        self.executor.submit.assert_called_once_with(
+            thumbnails.make_thumbnail, post.image.name, None
+        )
+        ready = thumbnails.Thumbnail(
+            '/media/cache/ready.jpg',
+            '/media/cache/ready.webp 960w',
+            '/media/cache/ready.jpg 960w',
+        )
+        with mock.patch(
+            'posts.thumbnails.find_thumbnails',
+            return_value={post.image.name: ready},
+        ):
+            self.future.set_result(ready)
+            response = Client().get(url)
+        self.assertContains(
+            response, f'<source type="image/webp" srcset="{ready.webp}"'
+        )
+        self.assertContains(response, f'srcset="{ready.jpeg}"')
+        self.assertNotIn(post.image.name, thumbnails._pending)
+
+    def test_saved_post_schedules_thumbnail(self):
+        """Сохраненный пост с картинкой отправляет ее в пул"""
+        post = ThumbnailPoolTests.post
+        with mock.patch(
+            'posts.thumbnails.transaction.on_commit',
+            side_effect=lambda callback: callback()
+        ):
+            post.text = 'Новый текст'
+            post.save()
+        self.executor.submit.assert_called_once_with(
+            thumbnails.make_thumbnail, post.image.name, None
+        )
+
+    def test_posts_sharing_image_are_all_refreshed(self):
+        """Миниатюра общей картинки создается один раз и обновляет
+        страницы всех постов с ней
+        """
+        post = ThumbnailPoolTests.post
+        other = Post.objects.create(
+            author=ThumbnailPoolTests.author,
+            text='Пост с той же картинкой',
+            image=make_image(),
+        )
+        self.assertEqual(other.image.name, post.image.name)
+        on_ready = mock.Mock()
+        thumbnails.post_thumbnails([post, other], on_ready)
+        self.executor.submit.assert_called_once()
+        self.future.set_result(None)
+        self.assertEqual(
+            {call.args[0] for call in on_ready.call_args_list},
+            {post.pk, other.pk}
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ThumbnailWithoutPoolTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(
+            author=author, text='Пост с картинкой', image=make_image()
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch('posts.thumbnails.make_thumbnail')
+    def test_pages_only_read_thumbnails(self, make_thumbnail):
+        """Без пула страница не создает миниатюр, а создает их
+        сохранение поста после фиксации транзакции
+        """
+        post = ThumbnailWithoutPoolTests.post
+        on_ready = mock.Mock()
+        Client().get(reverse('posts:post_detail', args=[post.pk]))
+        self.assertEqual(thumbnails.post_thumbnails([post], on_ready), {})
+        make_thumbnail.assert_not_called()
+        on_ready.assert_not_called()
+        with mock.patch(
+            'posts.thumbnails.transaction.on_commit',
+            side_effect=lambda callback: callback()
+        ):
+            thumbnails.schedule_thumbnail(
+                post.pk, post.image.name, None, on_ready
+            )
+        make_thumbnail.assert_called_once_with(post.image.name, None)
+        on_ready.assert_called_once_with(post.pk)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=2)
+class ThumbnailLookupTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='author')
+        cls.posts = [
+            Post.objects.create(
+                author=author,
+                text=f'Пост {number}',
+                image=make_image(number),
+            )
+            for number in range(3)
+        ]
+        # У первых двух постов миниатюры уже готовы
+        for number, post in enumerate(cls.posts[:2]):
+            for width, image_format in thumbnails.thumbnail_variants(None):
+                thumbnail = ImageFile(
+                    f'cache/{number}-{width}.{image_format.lower()}',
+                    default.storage
+                )
+                thumbnail.set_size((width, width))
+                KVStore.objects.create(
+                    key=thumbnails.thumbnail_key(
+                        post.image.name, width, image_format
+                    ),
+                    value=serialize_image_file(thumbnail),
+                )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        thumbnails._urls.clear()
+        self.addCleanup(thumbnails._urls.clear)
+        self.addCleanup(thumbnails._pending.clear)
+
+    @mock.patch('posts.thumbnails._get_executor')
+    def test_urls_are_resolved_in_one_query(self, get_executor):
+        """Адреса миниатюр страницы ищутся одним запросом, а
+        повторно - в памяти процесса
+        """
+        posts = ThumbnailLookupTests.posts
+        on_ready = mock.Mock()
+        with self.assertNumQueries(1):
+            found = thumbnails.post_thumbnails(posts, on_ready)
+        self.assertEqual(found[posts[0].pk], thumbnails.Thumbnail(
+            '/media/cache/0-960.jpeg',
+            '/media/cache/0-320.webp 320w, /media/cache/0-640.webp 640w, '
+            '/media/cache/0-960.webp 960w',
+            '/media/cache/0-320.jpeg 320w, /media/cache/0-640.jpeg 640w, '
+            '/media/cache/0-960.jpeg 960w',
+        ))
+        self.assertEqual(set(found), {posts[0].pk, posts[1].pk})
+        get_executor.return_value.submit.assert_called_once_with(
+            thumbnails.make_thumbnail, posts[2].image.name, None
+        )
+        with mock.patch(
+            'posts.thumbnails._get_raw_many', return_value={}
+        ) as get_raw_many:
+            found = thumbnails.post_thumbnails(posts, on_ready)
+        self.assertEqual(len(found), 2)
+        get_raw_many.assert_called_once_with([
+            thumbnails.thumbnail_key(posts[2].image.name, *variant)
+            for variant in thumbnails.thumbnail_variants(None)
+        ])
+
+    def test_variants_are_not_wider_than_image(self):
+        """Варианты не шире самой картинки, но хотя бы один есть"""
+        self.assertEqual(thumbnails.thumbnail_widths(None), (320, 640, 960))
+        self.assertEqual(thumbnails.thumbnail_widths(700), (320, 640))
+        self.assertEqual(thumbnails.thumbnail_widths(100), (320,))
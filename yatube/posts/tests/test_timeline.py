@@ -0,0 +1,238 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts import pull_feed
+from posts.models import (Follow, PendingFanOut, Post, Profile,
+                          TimelineEntry)
+from posts.timeline import fan_out_pending
+
+User = get_user_model()
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.follower = User.objects.create_user(username='follower')
+        cls.author = User.objects.create_user(username='author')
+        cls.other = User.objects.create_user(username='other')
+        Follow.objects.create(user=cls.follower, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.follower_client = Client()
+        self.follower_client.force_login(TimelineTests.follower)
+
+    def create_post(self, author, text):
+        """Создает пост и разбирает очередь раскладки, как
+        fan_out_timelines.
+        """
+        post = Post.objects.create(author=author, text=text)
+        fan_out_pending()
+        return post
+
+    def get_feed(self):
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def get_full_feed(self):
+        """Проходит ленту по курсорам до конца."""
+        url = reverse('posts:follow_index')
+        page_obj = self.follower_client.get(url).context['page_obj']
+        feed = list(page_obj)
+        while page_obj.next_cursor:
+            page_obj = self.follower_client.get(
+                url, {'cursor': page_obj.next_cursor}
+            ).context['page_obj']
+            feed.extend(page_obj)
+        return feed
+
+    def test_new_post_is_fanned_out_to_followers(self):
+        """Новый пост попадает в ленты подписчиков автора, и только в них"""
+        post = self.create_post(TimelineTests.author, 'Пост')
+        self.assertTrue(
+            TimelineEntry.objects.filter(
+                user=TimelineTests.follower, post=post
+            ).exists()
+        )
+        self.assertEqual(TimelineEntry.objects.count(), 1)
+        self.assertEqual(self.get_feed(), [post])
+
+    def test_follow_and_unfollow_update_timeline(self):
+        """Подписка добавляет в ленту посты автора, отписка - убирает"""
+        post = self.create_post(TimelineTests.other, 'Пост')
+        follow = Follow.objects.create(
+            user=TimelineTests.follower, author=TimelineTests.other
+        )
+        self.assertEqual(self.get_feed(), [post])
+        follow.delete()
+        self.assertEqual(self.get_feed(), [])
+
+    @override_settings(TIMELINE_LENGTH=3)
+    def test_timeline_is_trimmed(self):
+        """В ленте хранится не больше TIMELINE_LENGTH последних постов"""
+        posts = [
+            self.create_post(TimelineTests.author, f'Пост {i}')
+            for i in range(5)
+        ]
+        entries = TimelineEntry.objects.filter(user=TimelineTests.follower)
+        self.assertEqual(
+            sorted(entries.values_list('post', flat=True)),
+            [post.pk for post in posts[2:]]
+        )
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_celebrity_posts_are_merged_on_read(self):
+        """Посты авторов с большим числом подписчиков не раскладываются
+        по лентам, но видны в ленте подписчика
+        """
+        post = self.create_post(TimelineTests.author, 'Пост')
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.get_feed(), [post])
+
+    def test_fan_out_runs_outside_request(self):
+        """Новый пост только ставится в очередь и виден в ленте сразу,
+        а по лентам его раскладывает fan_out_timelines
+        """
+        post = Post.objects.create(author=TimelineTests.author, text='Пост')
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertTrue(PendingFanOut.objects.filter(post=post).exists())
+        # До раскладки пост подмешивается в ленту из очереди
+        self.assertEqual(self.get_feed(), [post])
+        output = StringIO()
+        call_command('fan_out_timelines', stdout=output)
+        self.assertIn('Разложено постов: 1', output.getvalue())
+        self.assertTrue(TimelineEntry.objects.filter(post=post).exists())
+        self.assertFalse(PendingFanOut.objects.exists())
+        self.assertEqual(self.get_feed(), [post])
+
+    def test_crossing_fanout_limit_keeps_posts(self):
+        """Посты не пропадают из ленты и не повторяются, когда автор
+        переходит порог подписчиков вверх и вниз
+        """
+        posts = [self.create_post(TimelineTests.author, '1')]
+        with self.settings(TIMELINE_FANOUT_LIMIT=0):
+            posts.append(
+                self.create_post(TimelineTests.author, '2')
+            )
+            self.assertTrue(
+                Profile.objects.get(user=TimelineTests.author).timeline_pull
+            )
+            self.assertEqual(self.get_feed(), posts[::-1])
+        posts.append(
+            self.create_post(TimelineTests.author, '3')
+        )
+        self.assertFalse(
+            Profile.objects.get(user=TimelineTests.author).timeline_pull
+        )
+        self.assertEqual(self.get_feed(), posts[::-1])
+
+    def test_feed_pages_merge_entries_and_pulled_posts(self):
+        """Переходы по курсору в ленте из записей и подмешанных постов
+        не теряют и не повторяют посты
+        """
+        Follow.objects.create(
+            user=TimelineTests.follower, author=TimelineTests.other
+        )
+        Profile.objects.filter(user=TimelineTests.other).update(
+            timeline_pull=True
+        )
+        for number in range(25):
+            self.create_post(
+                TimelineTests.author if number % 3 else TimelineTests.other,
+                f'Пост {number}'
+            )
+        expected = list(Post.objects.order_by('-pub_date', '-pk'))
+        self.assertEqual(self.get_full_feed(), expected)
+        response = self.follower_client.get(
+            reverse('posts:follow_index'), {'page': 3}
+        )
+        self.assertEqual(list(response.context['page_obj']), expected[20:])
+
+
+@override_settings(FOLLOW_FEED_ENGINE='pull')
+@mock.patch(
+    'posts.pull_feed.transaction.on_commit',
+    side_effect=lambda callback: callback()
+)
+class PullFeedTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.follower = User.objects.create_user(username='follower')
+        cls.author1 = User.objects.create_user(username='author1')
+        cls.author2 = User.objects.create_user(username='author2')
+        cls.other = User.objects.create_user(username='other')
+        for author in (cls.author1, cls.author2):
+            Follow.objects.create(user=cls.follower, author=author)
+        for post_id in range(1, 16):
+            Post.objects.create(
+                author=cls.author1 if post_id % 3 else cls.author2,
+                text=f'Тестовый пост {post_id}',
+            )
+        Post.objects.create(author=cls.other, text='Чужой пост')
+
+    def setUp(self):
+        cache.clear()
+        self.follower_client = Client()
+        self.follower_client.force_login(PullFeedTests.follower)
+
+    def test_feed_merges_followed_authors(self, on_commit):
+        """Лента собирается из постов всех авторов подписок по убыванию
+        даты, а переходы по курсору не теряют и не повторяют посты
+        """
+        url = reverse('posts:follow_index')
+        page_obj = self.follower_client.get(url).context['page_obj']
+        feed = list(page_obj)
+        while page_obj.next_cursor:
+            page_obj = self.follower_client.get(
+                url, {'cursor': page_obj.next_cursor}
+            ).context['page_obj']
+            feed.extend(page_obj)
+        expected = Post.objects.filter(
+            author__in=[PullFeedTests.author1, PullFeedTests.author2]
+        ).order_by('-pub_date', '-pk')
+        self.assertEqual(feed, list(expected))
+
+    def test_feed_follows_new_posts_and_unfollows(self, on_commit):
+        """Новый пост сразу попадает в ленту, а после отписки
+        посты автора из нее пропадают
+        """
+        url = reverse('posts:follow_index')
+        self.follower_client.get(url)
+        post = Post.objects.create(author=PullFeedTests.author2, text='Новый')
+        page_obj = self.follower_client.get(url).context['page_obj']
+        self.assertEqual(page_obj[0], post)
+        Follow.objects.filter(author=PullFeedTests.author2).delete()
+        page_obj = self.follower_client.get(url).context['page_obj']
+        self.assertNotIn(post, page_obj)
+        self.assertEqual(page_obj.paginator.count, 10)
+
+    def test_concurrent_push_rebuilds_list(self, on_commit):
+        """Если список автора одновременно обновили двое, он не теряет
+        постов, а пересобирается из базы
+        """
+        url = reverse('posts:follow_index')
+        self.follower_client.get(url)
+        on_commit.side_effect = None
+        first = Post.objects.create(author=PullFeedTests.author2, text='1')
+        second = Post.objects.create(author=PullFeedTests.author2, text='2')
+        push_first, push_second = [
+            call[0][0] for call in on_commit.call_args_list
+            if 'add_recent_post' in call[0][0].__code__.co_names
+        ]
+        # Первый писатель увеличил версию, но записать список не успел
+        version = pull_feed.bump_recent_version(PullFeedTests.author2.pk)
+        push_second()
+        with mock.patch.object(
+            pull_feed, 'bump_recent_version', return_value=version
+        ):
+            push_first()
+        page_obj = self.follower_client.get(url).context['page_obj']
+        self.assertEqual(list(page_obj)[:2], [second, first])
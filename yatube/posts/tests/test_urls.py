@@ -50,6 +50,7 @@ class PostURLTests(TestCase):
                                             f'{cls.post.id}/edit/'),
             f'/posts/{cls.post.id}/comment/': (f'/auth/login/?next=/posts/'
                                                f'{cls.post.id}/comment/'),
+            '/follow/fragment/': '/auth/login/?next=/follow/fragment/',
         }
         cls.follow_redirects = {
             '/profile/author/follow/': (f'/profile/{cls.author.username}/'
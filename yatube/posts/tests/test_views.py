@@ -1,15 +1,23 @@
 import shutil
 import tempfile
+from io import StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.template.loader import render_to_string
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from posts.models import Comment, Follow, Group, Post
+from posts.timeline import fan_out_pending
+from posts.utils import CursorPaginator
 
 User = get_user_model()
 
@@ -317,6 +325,7 @@ class PostPagesTests(TestCase):
             author=author,
             text='Тестовый пост 123',
         )
+        fan_out_pending()
         url = reverse('posts:follow_index')
         # Проверка того, что новый пост автора появился в ленте подписчика
         response_subscriber = self.authorized_client_1.get(url)
@@ -391,6 +400,237 @@ class PaginatorViewsTest(TestCase):
                     len(response.context['page_obj']), number_of_posts
                 )
 
+    def test_cursor_pages_cover_all_posts(self):
+        """Переходы по курсорам проходят по всем постам без повторов,
+        и курсор назад возвращает на предыдущую страницу
+        """
+        url = reverse('posts:index')
+        response = self.guest_client.get(url)
+        page_obj = response.context['page_obj']
+        seen = [post.pk for post in page_obj]
+        while page_obj.next_cursor:
+            response = self.guest_client.get(
+                url, {'cursor': page_obj.next_cursor}
+            )
+            page_obj = response.context['page_obj']
+            seen.extend(post.pk for post in page_obj)
+        self.assertEqual(len(seen), Post.objects.count())
+        self.assertEqual(len(set(seen)), len(seen))
+        response = self.guest_client.get(
+            url, {'cursor': page_obj.previous_cursor}
+        )
+        previous_page = [post.pk for post in response.context['page_obj']]
+        self.assertEqual(previous_page, seen[10:20])
+
+    def test_cursor_page_stable_when_new_posts_arrive(self):
+        """Новые посты не сдвигают страницу, открытую по курсору"""
+        url = reverse('posts:group_posts', kwargs={'slug': 'test-slug-1'})
+        response = self.guest_client.get(url)
+        next_cursor = response.context['page_obj'].next_cursor
+        expected = list(
+            self.guest_client.get(
+                url, {'cursor': next_cursor}
+            ).context['page_obj']
+        )
+        Post.objects.create(
+            author=PaginatorViewsTest.user1,
+            text='Новый пост',
+            group=PaginatorViewsTest.group1,
+        )
+        response = self.guest_client.get(url, {'cursor': next_cursor})
+        self.assertEqual(list(response.context['page_obj']), expected)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        """Испорченный курсор открывает первую страницу"""
+        response = self.guest_client.get(
+            reverse('posts:index'), {'cursor': 'испорчен'}
+        )
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj.number, 1)
+        self.assertEqual(len(page_obj), 10)
+
+    def test_page_range_is_elided(self):
+        """Ссылки на страницы выводятся окном вокруг текущей страницы"""
+        paginator = CursorPaginator(Post.objects.all(), 1)
+        self.assertEqual(
+            list(paginator.get_elided_page_range(10)),
+            [1, '…', 8, 9, 10, 11, 12, '…', 28]
+        )
+        self.assertEqual(
+            list(paginator.get_elided_page_range(2)),
+            [1, 2, 3, 4, '…', 28]
+        )
+
+    def test_large_count_is_approximate(self):
+        """Для больших выборок число записей не считается точно,
+        а последние страницы не выводятся
+        """
+        with mock.patch('posts.utils.EXACT_COUNT_LIMIT', 5):
+            paginator = CursorPaginator(Post.objects.all(), 1)
+            self.assertEqual(paginator.count, 28)
+            self.assertFalse(paginator.count_is_exact)
+            self.assertEqual(
+                list(paginator.get_elided_page_range(10)),
+                [1, '…', 8, 9, 10, 11, 12, '…']
+            )
+            response = self.guest_client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'Последняя')
+        self.assertContains(response, 'Следующая')
+
+    def test_overestimated_count_falls_back_to_last_page(self):
+        """Если планировщик переоценил выборку, страница за концом
+        записей заменяется последней, а ссылки дальше нее не ведут
+        """
+        with mock.patch('posts.utils.EXACT_COUNT_LIMIT', 5), \
+                mock.patch('posts.utils.estimate_count', return_value=100):
+            paginator = CursorPaginator(Post.objects.all(), 10)
+            page = paginator.get_page(8)
+            self.assertEqual(page.number, 3)
+            self.assertEqual(len(page), 8)
+            self.assertEqual(page.elided_page_range, [1, 2, 3])
+            self.assertFalse(page.has_next())
+            paginator = CursorPaginator(Post.objects.all(), 10)
+            page = paginator.get_page(3)
+            self.assertEqual(paginator.count, 28)
+            self.assertEqual(page.elided_page_range, [1, 2, 3])
+            self.assertIsNone(page.next_cursor)
+
+    def test_fragments_render_cards_without_page_chrome(self):
+        """Фрагменты лент отдают только карточки постов
+        и ссылку на следующий фрагмент
+        """
+        fragments = {
+            reverse('posts:index_fragment'): 10,
+            reverse(
+                'posts:group_posts_fragment', kwargs={'slug': 'test-slug-1'}
+            ): 10,
+            reverse(
+                'posts:profile_fragment', kwargs={'username': 'testuser1'}
+            ): 10,
+        }
+        for url, number_of_posts in fragments.items():
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertTemplateUsed(
+                    response, 'posts/includes/post_cards.html'
+                )
+                self.assertTemplateNotUsed(response, 'base.html')
+                page_obj = response.context['page_obj']
+                self.assertEqual(len(page_obj), number_of_posts)
+                self.assertContains(
+                    response, f'{url}?cursor={page_obj.next_cursor}'
+                )
+
+    def test_fragment_is_addressed_by_cursor(self):
+        """Фрагмент по курсору содержит те же посты, что и страница"""
+        url = reverse('posts:index')
+        next_cursor = self.guest_client.get(url).context[
+            'page_obj'
+        ].next_cursor
+        page = self.guest_client.get(url, {'cursor': next_cursor})
+        fragment = self.guest_client.get(
+            reverse('posts:index_fragment'), {'cursor': next_cursor}
+        )
+        self.assertEqual(
+            list(fragment.context['page_obj']), list(page.context['page_obj'])
+        )
+        self.assertIn('max-age', fragment['Cache-Control'])
+
+
+class QueryCountTest(TestCase):
+    """Число запросов на страницах не зависит от числа постов,
+    авторов и комментариев.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        number_of_posts = 25
+        for post_id in range(1, number_of_posts + 1):
+            author = User.objects.create_user(
+                username=f'author{post_id}',
+                first_name='Имя',
+                last_name=f'Фамилия {post_id}',
+            )
+            group = Group.objects.create(
+                title=f'Тестовая группа {post_id}',
+                slug=f'test-slug-{post_id}',
+                description='Тестовое описание',
+            )
+            Follow.objects.create(user=cls.reader, author=author)
+            cls.post = Post.objects.create(
+                author=author,
+                text=f'Тестовый пост {post_id}',
+                group=group,
+            )
+        fan_out_pending()
+        for comment_id in range(1, number_of_posts + 1):
+            Comment.objects.create(
+                post=cls.post,
+                author=User.objects.get(username=f'author{comment_id}'),
+                text=f'Тестовый комментарий {comment_id}',
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.reader_client = Client()
+        self.reader_client.force_login(QueryCountTest.reader)
+
+    def test_listing_and_detail_query_counts(self):
+        """Страницы выполняют фиксированное число запросов"""
+        post = QueryCountTest.post
+        pages = (
+            (self.guest_client, reverse('posts:index'), 2),
+            (self.guest_client, reverse(
+                'posts:group_posts', kwargs={'slug': post.group.slug}
+            ), 3),
+            (self.guest_client, reverse(
+                'posts:profile', kwargs={'username': post.author.username}
+            ), 3),
+            (self.guest_client, reverse(
+                'posts:post_detail', kwargs={'post_id': post.pk}
+            ), 2),
+            (self.reader_client, reverse('posts:follow_index'), 7),
+        )
+        for client, url, number_of_queries in pages:
+            with self.subTest(url=url):
+                with self.assertNumQueries(number_of_queries):
+                    response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_listing_does_not_load_password_hashes(self):
+        """В карточки постов не загружаются лишние поля автора"""
+        response = self.guest_client.get(reverse('posts:index'))
+        author = response.context['page_obj'][0].author
+        self.assertIn('password', author.get_deferred_fields())
+
+    def test_follow_buttons_resolved_in_one_query(self):
+        """Состояние подписки на всех авторов страницы определяется
+        одним запросом, повторный запрос берет его из кеша
+        """
+        followed = QueryCountTest.post.author
+        Follow.objects.filter(user=QueryCountTest.reader).exclude(
+            author=followed
+        ).delete()
+        url = reverse('posts:index')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.reader_client.get(url)
+        follow_queries = [
+            query for query in queries.captured_queries
+            if 'posts_follow' in query['sql']
+        ]
+        self.assertEqual(len(follow_queries), 1)
+        unfollow_url = reverse(
+            'posts:profile_unfollow', kwargs={'username': followed.username}
+        )
+        self.assertContains(response, unfollow_url, count=1)
+        self.assertContains(response, 'Подписаться', count=9)
+        profile = self.reader_client.get(
+            reverse('posts:profile', kwargs={'username': followed.username})
+        )
+        self.assertContains(profile, unfollow_url)
+
 
 class CacheViewTest(TestCase):
     @classmethod
@@ -415,16 +655,174 @@ class CacheViewTest(TestCase):
         Post.objects.bulk_create(posts)
 
     def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
         self.authorized_client = Client()
         self.authorized_client.force_login(CacheViewTest.user)
 
     def test_cache_index(self):
-        """Кеш на главной странице работает корректно"""
+        """Главная страница отдается из кеша, пока посты не изменились"""
         first_response = self.authorized_client.get(reverse('posts:index'))
-        post = Post.objects.get(id=1)
-        post.delete()
+        # update() не отправляет сигналов, поэтому кеш не сбрасывается
+        Post.objects.filter(id=1).update(text='Тихо измененный пост')
         cached_response = self.authorized_client.get(reverse('posts:index'))
         self.assertEqual(first_response.content, cached_response.content)
         cache.clear()
         clean_response = self.authorized_client.get(reverse('posts:index'))
         self.assertNotEqual(first_response.content, clean_response.content)
+
+    def test_cache_invalidated_by_tags(self):
+        """Изменения постов, групп и подписок сразу видны на страницах"""
+        index_url = reverse('posts:index')
+        group_url = reverse(
+            'posts:group_posts', kwargs={'slug': CacheViewTest.group.slug}
+        )
+        self.authorized_client.get(index_url)
+        self.authorized_client.get(group_url)
+        Post.objects.get(id=1).delete()
+        for url in (index_url, group_url):
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertNotIn(
+                    'Тестовый пост 1',
+                    [post.text for post in response.context['page_obj']]
+                )
+        group = Group.objects.get(pk=CacheViewTest.group.pk)
+        group.title = 'Новое название'
+        group.save()
+        self.assertContains(
+            self.authorized_client.get(group_url), 'Новое название'
+        )
+
+    def test_post_cards_are_cached(self):
+        """Карточки постов берутся из кеша на всех лентах и
+        обновляются при изменении поста или автора
+        """
+        index_url = reverse('posts:index')
+        group_url = reverse(
+            'posts:group_posts', kwargs={'slug': CacheViewTest.group.slug}
+        )
+        self.authorized_client.get(index_url)
+        with mock.patch(
+            'posts.cards.render_to_string', wraps=render_to_string
+        ) as render:
+            self.authorized_client.get(group_url)
+            self.assertEqual(render.call_count, 0)
+            post = Post.objects.get(id=1)
+            post.text = 'Отредактированный пост'
+            post.save()
+            user = CacheViewTest.user
+            user.first_name = 'Новое имя'
+            user.save()
+            response = self.authorized_client.get(group_url)
+            self.assertEqual(render.call_count, 2)
+        self.assertContains(response, 'Отредактированный пост')
+        self.assertContains(response, 'Новое имя')
+
+    def test_listings_depend_on_card_tags(self):
+        """Новое имя автора сразу видно на всех лентах с его постами"""
+        urls = (
+            reverse('posts:index'),
+            reverse(
+                'posts:group_posts', kwargs={'slug': CacheViewTest.group.slug}
+            ),
+            reverse(
+                'posts:profile',
+                kwargs={'username': CacheViewTest.user.username}
+            ),
+        )
+        for url in urls:
+            self.guest_client.get(url)
+        user = CacheViewTest.user
+        user.first_name = 'Переименованный'
+        user.save()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(
+                    self.guest_client.get(url), 'Переименованный'
+                )
+
+    def test_one_cached_page_is_shared_by_users(self):
+        """Одна копия страницы в кеше служит всем пользователям,
+        а шапка, кнопки и CSRF-токен заполняются для каждого
+        """
+        url = reverse('posts:post_detail', kwargs={'post_id': 1})
+        reader = User.objects.create_user(username='reader')
+        reader_client = Client()
+        reader_client.force_login(reader)
+        author_response = self.authorized_client.get(url)
+        self.assertContains(author_response, 'Редактировать запись')
+        with mock.patch(
+            'posts.views.get_object_or_404', side_effect=AssertionError
+        ):
+            reader_response = reader_client.get(url)
+            guest_response = self.guest_client.get(url)
+        self.assertContains(reader_response, 'Пользователь: reader')
+        self.assertContains(reader_response, 'csrfmiddlewaretoken')
+        self.assertNotContains(reader_response, 'Редактировать запись')
+        self.assertNotContains(reader_response, '<!--hole:')
+        self.assertContains(guest_response, 'Войти')
+        self.assertNotContains(guest_response, 'Добавить комментарий')
+
+    def test_switcher_is_filled_for_each_user(self):
+        """Переключатель лент на общей копии главной страницы
+        выводится только вошедшим пользователям
+        """
+        url = reverse('posts:index')
+        for first, second, expected in (
+            (self.guest_client, self.authorized_client, True),
+            (self.authorized_client, self.guest_client, False),
+        ):
+            with self.subTest(expected=expected):
+                cache.clear()
+                first.get(url)
+                response = second.get(url)
+                if expected:
+                    self.assertContains(response, 'Избранные авторы')
+                else:
+                    self.assertNotContains(response, 'Избранные авторы')
+
+    def test_warm_caches_renders_pages(self):
+        """После warm_caches страницы отдаются из кеша без запросов
+        к базе
+        """
+        Post.objects.create(
+            author=CacheViewTest.user,
+            group=CacheViewTest.group,
+            text='Новый пост',
+        )
+        call_command('warm_caches', '--workers', '1', stdout=StringIO())
+        for url in (
+            reverse('posts:index'),
+            reverse(
+                'posts:group_posts', kwargs={'slug': CacheViewTest.group.slug}
+            ),
+            reverse(
+                'posts:profile',
+                kwargs={'username': CacheViewTest.user.username}
+            ),
+        ):
+            with self.subTest(url=url):
+                with self.assertNumQueries(0):
+                    response = self.guest_client.get(url)
+                self.assertContains(response, 'Новый пост')
+
+    def test_warm_caches_follows_cursors(self):
+        """warm_caches прогревает следующие страницы и фрагменты по тем же
+        курсорам, по которым переходят посетители
+        """
+        Post.objects.bulk_create(
+            Post(author=CacheViewTest.user, text=f'Пост {number}')
+            for number in range(15)
+        )
+        call_command(
+            'warm_caches', '--workers', '1', '--pages', '2', stdout=StringIO()
+        )
+        cursor = CursorPaginator(Post.objects.all(), 10).page(1).next_cursor
+        for url in (reverse('posts:index'), reverse('posts:index_fragment')):
+            with self.subTest(url=url):
+                with self.assertNumQueries(0):
+                    response = self.guest_client.get(
+                        url, {'cursor': cursor}
+                    )
+                self.assertEqual(response.status_code, 200)
@@ -0,0 +1,304 @@
+"""Миниатюры картинок постов, которые создаются вне запросов.
+
+Миниатюра картинки - это набор вариантов одних пропорций
+(THUMBNAIL_SIZE) нескольких ширин в WebP и в JPEG для браузеров без
+WebP; шаблон выводит их в srcset, и телефон загружает узкий вариант.
+Ширины больше самой картинки не создаются.
+
+Сохраненный пост с картинкой отправляет задачу в пул процессов
+(settings.THUMBNAIL_WORKERS), и запрос не тратит время на декодирование
+и масштабирование. Страницы только читают готовые миниатюры
+(post_thumbnails), а пока миниатюры нет, показывают исходную картинку в
+тех же пропорциях и отправляют ее в пул. Когда миниатюра готова,
+вызывается on_ready(post_id) для каждого ждавшего ее поста (одна
+картинка может быть у многих постов, см. posts.storage), чтобы страницы
+пересобрались уже с ней. При отрисовке страницы on_ready не вызывается:
+сброс тегов посреди отрисовки сделал бы ее устаревшей сразу.
+
+Адреса вариантов всех постов страницы ищутся одним get_many к кешу
+sorl-thumbnail и одним запросом к его таблице, а найденные запоминаются
+в LRU процесса: имя файла варианта зависит только от картинки и
+параметров, поэтому адрес не меняется.
+
+По умолчанию в пуле один процесс. THUMBNAIL_WORKERS = 0 - явный отказ
+от пула для разработки и тестов: миниатюра создается в запросе, который
+сохранил пост, после фиксации транзакции, а страницы ее по-прежнему не
+создают. Миниатюры старых постов тогда создает warm_caches.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import django
+from django.conf import settings
+from django.db import connections, transaction
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore as CachedDBStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.cache_backends import LocalStore
+
+# Миниатюра в карточках постов и на странице поста
+THUMBNAIL_SIZE = (960, 339)
+THUMBNAIL_WIDTHS = (320, 640, 960)
+# Последний формат - запасной: его наибольший вариант идет в src
+THUMBNAIL_FORMATS = ('WEBP', 'JPEG')
+THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+URL_CACHE_SIZE = 10000
+URL_CACHE_TIMEOUT = 60 * 60
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+# {имя картинки: id постов, которые ждут ее миниатюру}
+_pending = {}
+_lock = threading.Lock()
+_urls = LocalStore(URL_CACHE_SIZE)
+
+# Варианты для <source type="image/webp"> и для <img>
+Thumbnail = namedtuple('Thumbnail', 'src webp jpeg')
+
+
+def thumbnail_widths(image_width):
+    """Ширины вариантов картинки: не больше ее самой, но хотя бы одна."""
+    widths = tuple(
+        width for width in THUMBNAIL_WIDTHS
+        if image_width is None or width <= image_width
+    )
+    return widths or THUMBNAIL_WIDTHS[:1]
+
+
+def thumbnail_variants(image_width):
+    return [
+        (width, image_format)
+        for image_format in THUMBNAIL_FORMATS
+        for width in thumbnail_widths(image_width)
+    ]
+
+
+def thumbnail_geometry(width):
+    height = round(width * THUMBNAIL_SIZE[1] / THUMBNAIL_SIZE[0])
+    return f'{width}x{height}'
+
+
+def thumbnail_options(image_format):
+    """Параметры варианта с умолчаниями, как в
+    ThumbnailBackend.get_thumbnail: от них зависит имя его файла.
+    """
+    backend = default.backend
+    options = dict(THUMBNAIL_OPTIONS, format=image_format)
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def thumbnail_key(name, width, image_format):
+    """Ключ варианта миниатюры в хранилище sorl-thumbnail."""
+    thumbnail = default.backend._get_thumbnail_filename(
+        ImageFile(name),
+        thumbnail_geometry(width),
+        thumbnail_options(image_format),
+    )
+    return add_prefix(ImageFile(thumbnail, default.storage).key)
+
+
+def _thumbnail(name, image_width, urls):
+    """Собирает миниатюру из адресов вариантов {(имя, ширина, формат):
+    адрес}; None, если готовы не все варианты.
+    """
+    widths = thumbnail_widths(image_width)
+    try:
+        srcsets = {
+            image_format: ', '.join(
+                f'{urls[name, width, image_format]} {width}w'
+                for width in widths
+            )
+            for image_format in THUMBNAIL_FORMATS
+        }
+        src = urls[name, widths[-1], THUMBNAIL_FORMATS[-1]]
+    except KeyError:
+        return None
+    return Thumbnail(src, srcsets['WEBP'], srcsets['JPEG'])
+
+
+def _get_raw_many(keys):
+    """Читает записи хранилища sorl-thumbnail: сначала из кеша, затем
+    недостающие одним запросом к базе.
+
+    В отличие от KVStore._get_raw, отсутствие записи не кешируется:
+    миниатюру создает другой процесс, и его запись должна стать видна.
+    """
+    kvstore = default.kvstore
+    if not isinstance(kvstore, CachedDBStore):
+        return {key: kvstore._get_raw(key) for key in keys}
+    values = {
+        key: value for key, value in kvstore.cache.get_many(keys).items()
+        if value != EMPTY_VALUE
+    }
+    missing = [key for key in keys if key not in values]
+    if missing:
+        found = dict(KVStoreModel.objects.filter(
+            key__in=missing
+        ).values_list('key', 'value'))
+        kvstore.cache.set_many(found, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(found)
+    return values
+
+
+def find_thumbnails(images):
+    """Принимает пары (имя картинки, ширина) и возвращает {имя картинки:
+    Thumbnail} для картинок со всеми готовыми вариантами, не создавая
+    недостающих.
+    """
+    images = dict(images)
+    now = time.time()
+    urls = {}
+    keys = {}
+    for name, image_width in images.items():
+        for width, image_format in thumbnail_variants(image_width):
+            variant = (name, width, image_format)
+            url = _urls.get(variant, now)
+            if url is None:
+                keys[thumbnail_key(*variant)] = variant
+            else:
+                urls[variant] = url
+    expires = now + URL_CACHE_TIMEOUT
+    for key, value in _get_raw_many(list(keys)).items():
+        variant = keys[key]
+        urls[variant] = deserialize_image_file(value).url
+        _urls.set(variant, urls[variant], expires)
+    thumbnails = {}
+    for name, image_width in images.items():
+        thumbnail = _thumbnail(name, image_width, urls)
+        if thumbnail is not None:
+            thumbnails[name] = thumbnail
+    return thumbnails
+
+
+def post_thumbnails(posts, on_ready):
+    """Возвращает {post.pk: Thumbnail} для постов с готовыми
+    миниатюрами; недостающие отправляются в пул, если он есть.
+    Вызывается при отрисовке страниц и сам миниатюр не создает.
+    """
+    posts = [post for post in posts if post.image]
+    found = find_thumbnails(
+        (post.image.name, post.image_width) for post in posts
+    )
+    thumbnails = {}
+    for post in posts:
+        thumbnail = found.get(post.image.name)
+        if thumbnail is not None:
+            thumbnails[post.pk] = thumbnail
+        elif settings.THUMBNAIL_WORKERS:
+            submit_thumbnail(
+                post.pk, post.image.name, post.image_width, on_ready
+            )
+    return thumbnails
+
+
+def make_thumbnail(name, image_width):
+    """Создает все варианты миниатюры и возвращает ее; выполняется в
+    процессе пула.
+    """
+    urls = {
+        (name, width, image_format): get_thumbnail(
+            name,
+            thumbnail_geometry(width),
+            format=image_format,
+            **THUMBNAIL_OPTIONS
+        ).url
+        for width, image_format in thumbnail_variants(image_width)
+    }
+    return _thumbnail(name, image_width, urls)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn, а не fork: дочерний процесс не наследует соединения
+        # с базой и потоки воркера
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+    return _executor
+
+
+def _thumbnail_ready(name, on_ready, future):
+    with _lock:
+        post_ids = _pending.pop(name, set())
+    error = future.exception()
+    if error is not None:
+        logger.error('Миниатюра %s не создана: %r', name, error)
+        return
+    # Обратный вызов выполняется в служебном потоке пула
+    try:
+        for post_id in post_ids:
+            on_ready(post_id)
+    finally:
+        connections.close_all()
+
+
+def submit_thumbnail(post_id, name, image_width, on_ready):
+    """Отправляет картинку в пул, если она еще не создается; пост
+    в любом случае получит on_ready, когда миниатюра будет готова.
+    """
+    global _executor
+    with _lock:
+        if name in _pending:
+            _pending[name].add(post_id)
+            return
+        _pending[name] = {post_id}
+        try:
+            future = _get_executor().submit(
+                make_thumbnail, name, image_width
+            )
+        except BrokenProcessPool:
+            # Процесс пула упал; следующая картинка запустит новый пул,
+            # а эту отправит в пул следующий показ поста
+            logger.error('Пул миниатюр остановлен, %s пропущена', name)
+            _executor = None
+            del _pending[name]
+            return
+    future.add_done_callback(partial(_thumbnail_ready, name, on_ready))
+
+
+def create_thumbnail(post_id, name, image_width, on_ready):
+    """Создает миниатюру, если ее еще нет: в пуле, а если от него
+    отказались (THUMBNAIL_WORKERS = 0), в текущем процессе. Вызывается после
+    сохранения поста, а не при отрисовке страниц.
+    """
+    if find_thumbnails([(name, image_width)]):
+        return
+    if settings.THUMBNAIL_WORKERS:
+        submit_thumbnail(post_id, name, image_width, on_ready)
+        return
+    # Как и тег {% thumbnail %}, ошибка картинки не ломает сохранение
+    try:
+        make_thumbnail(name, image_width)
+    except Exception:
+        logger.exception('Миниатюра %s не создана', name)
+        return
+    on_ready(post_id)
+
+
+def schedule_thumbnail(post_id, name, image_width, on_ready):
+    """Создает миниатюру после фиксации транзакции с картинкой."""
+    transaction.on_commit(
+        partial(create_thumbnail, post_id, name, image_width, on_ready)
+    )
@@ -0,0 +1,269 @@
+"""Материализованная лента подписок (fan-out on write).
+
+При публикации поста он ставится в очередь PendingFanOut, а команда
+fan_out_timelines вне запросов добавляет запись о нем в ленту каждого
+подписчика автора и обрезает до settings.TIMELINE_LENGTH записей ленты,
+которые стали длиннее. Посты
+авторов, у которых больше settings.TIMELINE_FANOUT_LIMIT подписчиков
+(Profile.timeline_pull), по лентам не раскладываются и подмешиваются
+в ленту при чтении.
+"""
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, Q
+
+from .models import Follow, PendingFanOut, Post, Profile, TimelineEntry
+from .pull_feed import FeedPaginator, MergedFeed
+from .utils import CURSOR_NEXT
+
+# Ограничение на число параметров в одном запросе
+BATCH_SIZE = 500
+
+TRIM_SQL = '''
+    DELETE FROM {table} WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY user_id ORDER BY pub_date DESC, post_id DESC
+            ) AS position
+            FROM {table} WHERE user_id IN ({placeholders})
+        ) ranked WHERE position > %s
+    )
+'''
+
+
+def is_pulled(author_id):
+    """Подмешиваются ли посты автора в ленты при чтении."""
+    return Profile.objects.filter(
+        user_id=author_id, timeline_pull=True
+    ).exists()
+
+
+def trim_timelines(user_ids):
+    """Оставляет в лентах пользователей только последние записи.
+
+    Обрезаются только ленты длиннее TIMELINE_LENGTH: их находит подсчет
+    по индексу, а нумерация записей идет лишь по ним.
+    """
+    table = TimelineEntry._meta.db_table
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        batch = list(
+            TimelineEntry.objects.filter(
+                user_id__in=user_ids[start:start + BATCH_SIZE]
+            ).order_by().values('user').annotate(
+                entries=Count('pk')
+            ).filter(
+                entries__gt=settings.TIMELINE_LENGTH
+            ).values_list('user', flat=True)
+        )
+        if not batch:
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(
+                TRIM_SQL.format(
+                    table=table,
+                    placeholders=', '.join(['%s'] * len(batch)),
+                ),
+                batch + [settings.TIMELINE_LENGTH],
+            )
+
+
+def fan_out_post(post):
+    """Добавляет пост в ленты подписчиков его автора.
+
+    Когда автор переходит порог TIMELINE_FANOUT_LIMIT, флаг
+    Profile.timeline_pull меняется так, чтобы посты не пропадали из лент:
+    при переходе вверх флаг ставится до отказа от раскладки, при переходе
+    вниз - снимается только после того, как посты разложены по лентам.
+    """
+    followers = Follow.objects.filter(author_id=post.author_id)
+    is_celebrity = followers.count() > settings.TIMELINE_FANOUT_LIMIT
+    was_celebrity = is_pulled(post.author_id)
+    if is_celebrity:
+        if not was_celebrity:
+            set_pulled(post.author_id, True)
+        return
+    user_ids = list(followers.values_list('user', flat=True))
+    if was_celebrity:
+        add_recent_posts(user_ids, post.author_id)
+        set_pulled(post.author_id, False)
+        return
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(
+                user_id=user_id,
+                post=post,
+                author_id=post.author_id,
+                pub_date=post.pub_date,
+            )
+            for user_id in user_ids
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim_timelines(user_ids)
+
+
+def schedule_fan_out(post):
+    """Ставит пост в очередь раскладки по лентам: в запросе остается
+    одна вставка, а саму раскладку выполняет fan_out_pending.
+    """
+    PendingFanOut.objects.get_or_create(post=post)
+
+
+def fan_out_pending(limit=None):
+    """Раскладывает по лентам посты из очереди; возвращает их число.
+
+    Каждый пост берется с блокировкой строки очереди (SKIP LOCKED),
+    поэтому несколько обработчиков не раскладывают его дважды.
+    """
+    done = 0
+    while limit is None or done < limit:
+        with transaction.atomic():
+            pending = PendingFanOut.objects.select_for_update(
+                skip_locked=True, of=('self',)
+            ).select_related('post').order_by('post').first()
+            if pending is None:
+                break
+            fan_out_post(pending.post)
+            pending.delete()
+        done += 1
+    return done
+
+
+def set_pulled(author_id, pulled):
+    Profile.objects.filter(user_id=author_id).update(timeline_pull=pulled)
+
+
+def add_recent_posts(user_ids, author_id):
+    """Добавляет в ленты пользователей последние посты автора."""
+    posts = list(
+        Post.objects.filter(author_id=author_id).order_by(
+            '-pub_date', '-pk'
+        ).values_list('pk', 'pub_date')[:settings.TIMELINE_LENGTH]
+    )
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(
+                user_id=user_id,
+                post_id=post_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for user_id in user_ids
+            for post_id, pub_date in posts
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim_timelines(user_ids)
+
+
+def backfill_timeline(user_id, author_id):
+    """Добавляет в ленту подписчика последние посты нового автора."""
+    if not is_pulled(author_id):
+        add_recent_posts([user_id], author_id)
+
+
+def remove_from_timeline(user_id, author_id):
+    """Убирает из ленты подписчика посты автора, от которого он отписался."""
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild_timeline(user_id):
+    """Собирает ленту пользователя заново по его подпискам."""
+    TimelineEntry.objects.filter(user_id=user_id).delete()
+    for author_id in Follow.objects.filter(user_id=user_id).values_list(
+        'author', flat=True
+    ):
+        backfill_timeline(user_id, author_id)
+
+
+class TimelineFeed(MergedFeed):
+    """Лента из записей TimelineEntry пользователя, слитых с постами
+    подмешиваемых авторов.
+
+    Каждый источник - запрос (pub_date, id поста) по убыванию, окна
+    выбираются из базы с ограничением, а посты - одним запросом id__in.
+    """
+
+    def __init__(self, sources, queryset):
+        self.sources = sources
+        self.queryset = queryset
+
+    def count(self):
+        return sum(source.count() for source, _ in self.sources)
+
+    def window(self, direction, position, limit, offset=0):
+        """Возвращает до limit записей (pub_date, id) после позиции
+        в порядке удаления от нее; без позиции - с начала ленты.
+        """
+        windows = []
+        for source, key in self.sources:
+            ordering = ('-pub_date', '-' + key)
+            if position is not None:
+                pub_date, pk = position
+                lookup = 'lt' if direction == CURSOR_NEXT else 'gt'
+                source = source.filter(
+                    Q(**{'pub_date__' + lookup: pub_date})
+                    | Q(**{'pub_date': pub_date, f'{key}__{lookup}': pk})
+                )
+                if direction != CURSOR_NEXT:
+                    ordering = ('pub_date', key)
+            windows.append(
+                list(source.order_by(*ordering)[:offset + limit])
+            )
+        return list(islice(
+            heapq.merge(*windows, reverse=direction == CURSOR_NEXT),
+            offset, offset + limit
+        ))
+
+    def __getitem__(self, item):
+        return self.fetch(self.window(
+            CURSOR_NEXT, None, item.stop - item.start, item.start
+        ))
+
+
+class TimelinePaginator(FeedPaginator):
+    def _cursor_window(self, direction, pub_date, pk, limit):
+        return self.object_list.fetch(
+            self.object_list.window(direction, (pub_date, pk), limit)
+        )
+
+
+def timeline_posts(user):
+    """Возвращает ленту подписок пользователя: записи его ленты,
+    посты подмешиваемых авторов, на которых он подписан, и их посты,
+    еще ждущие раскладки в очереди.
+    """
+    pending = PendingFanOut.objects.values('post')
+    follows = Follow.objects.filter(user=user).annotate(
+        has_pending=Exists(
+            pending.filter(post__author=OuterRef('author'))
+        )
+    ).filter(
+        Q(author__profile__timeline_pull=True) | Q(has_pending=True)
+    ).values_list('author', 'author__profile__timeline_pull')
+    pulled, waiting = [], []
+    for author_id, is_pulled in follows:
+        (pulled if is_pulled else waiting).append(author_id)
+    # Записи, разложенные до того, как автор перешел порог, и записи
+    # постов из очереди, добавленные подпиской, не дублируются
+    entries = TimelineEntry.objects.filter(user=user).exclude(
+        author__in=pulled
+    )
+    if waiting:
+        entries = entries.exclude(author__in=waiting, post__in=pending)
+    sources = [(entries.values_list('pub_date', 'post_id'), 'post_id')]
+    if pulled or waiting:
+        sources.append((
+            Post.objects.filter(
+                Q(author__in=pulled)
+                | Q(author__in=waiting, pk__in=pending)
+            ).values_list('pub_date', 'pk'),
+            'pk'
+        ))
+    return TimelineFeed(sources, Post.objects.for_cards())
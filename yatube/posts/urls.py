@@ -7,10 +7,21 @@ app_name = 'posts'
 urlpatterns = [
     # Главная страница
     path('', views.index, name='index'),
+    path('fragment/', views.index_fragment, name='index_fragment'),
     # Страница сообщества
     path('group/<slug:slug>/', views.group_posts, name='group_posts'),
+    path(
+        'group/<slug:slug>/fragment/',
+        views.group_posts_fragment,
+        name='group_posts_fragment'
+    ),
     # Профайл пользователя
     path('profile/<str:username>/', views.profile, name='profile'),
+    path(
+        'profile/<str:username>/fragment/',
+        views.profile_fragment,
+        name='profile_fragment'
+    ),
     # Просмотр записи
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     # Создание новой записи
@@ -23,7 +34,13 @@ urlpatterns = [
         views.add_comment,
         name='add_comment'
     ),
+    # Лента подписок
     path('follow/', views.follow_index, name='follow_index'),
+    path(
+        'follow/fragment/',
+        views.follow_index_fragment,
+        name='follow_index_fragment'
+    ),
     path(
         'profile/<str:username>/follow/',
         views.profile_follow,
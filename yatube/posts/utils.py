@@ -1,9 +1,234 @@
+import hashlib
+
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+from django.utils.functional import cached_property
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 
 POST_LIMIT = 10
 
+# До этого числа записей страницы считаются точно, дальше - приближенно
+EXACT_COUNT_LIMIT = 1000
+COUNT_CACHE_TIMEOUT = 60 * 5
+
+CURSOR_NEXT = 'n'
+CURSOR_PREVIOUS = 'p'
+
+
+def encode_cursor(obj, direction):
+    """Кодирует позицию (pub_date, id) записи в непрозрачный курсор."""
+    raw = f'{direction}{obj.pub_date.isoformat()}|{obj.pk}'
+    return urlsafe_base64_encode(force_bytes(raw))
+
+
+def count_cache_key(queryset):
+    sql, params = queryset.order_by().query.sql_with_params()
+    return 'paginator_count:' + hashlib.md5(
+        force_bytes(sql + repr(params))
+    ).hexdigest()
+
+
+def estimate_count(queryset):
+    """Возвращает приближенное число записей в выборке.
+
+    На PostgreSQL берется оценка планировщика из EXPLAIN, на остальных
+    базах - точный COUNT(*). Результат кешируется на COUNT_CACHE_TIMEOUT.
+    """
+    key = count_cache_key(queryset)
+    count = cache.get(key)
+    if count is None:
+        queryset = queryset.order_by()
+        sql, params = queryset.query.sql_with_params()
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                plan = cursor.fetchone()[0]
+            count = int(plan[0]['Plan']['Plan Rows'])
+        else:
+            count = queryset.count()
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def decode_cursor(cursor):
+    """Раскодирует курсор в кортеж (направление, pub_date, id).
+
+    Для испорченного курсора возвращает None.
+    """
+    try:
+        raw = force_text(urlsafe_base64_decode(cursor))
+        direction, position = raw[0], raw[1:]
+        pub_date, pk = position.rsplit('|', 1)
+        pub_date, pk = parse_datetime(pub_date), int(pk)
+    except (ValueError, IndexError, TypeError):
+        return None
+    if direction not in (CURSOR_NEXT, CURSOR_PREVIOUS) or pub_date is None:
+        return None
+    return direction, pub_date, pk
+
+
+class CursorPaginator(Paginator):
+    """Пагинатор с курсорами по ключу (pub_date, id).
+
+    Страницы по номеру (?page=N) работают как в обычном Paginator,
+    а переходы по курсору (?cursor=...) выполняются без COUNT(*) и OFFSET:
+    стоимость запроса не зависит от глубины страницы, а порядок записей
+    не сдвигается при появлении новых постов.
+
+    Для больших выборок число записей берется приближенным (см.
+    estimate_count), а ссылки на страницы выводятся усеченным окном.
+    Если оценка оказалась больше настоящего числа, вместо пустой страницы
+    отдается последняя, а число записей исправляется (settle_count).
+    """
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page, **kwargs):
+        super().__init__(
+            object_list.order_by('-pub_date', '-pk'), per_page, **kwargs
+        )
+        self.count_is_exact = True
+
+    @cached_property
+    def count(self):
+        # Точный подсчет ограничен EXACT_COUNT_LIMIT + 1 строками
+        count = self.object_list[:EXACT_COUNT_LIMIT + 1].count()
+        if count <= EXACT_COUNT_LIMIT:
+            return count
+        self.count_is_exact = False
+        return max(estimate_count(self.object_list), count)
+
+    def get_elided_page_range(self, number=1, on_each_side=2, on_ends=1):
+        """Возвращает номера страниц вокруг текущей с многоточиями
+        на месте пропусков.
+
+        Если число записей приближенное, последние страницы не выводятся.
+        """
+        number = self.validate_number(number)
+        num_pages = self.num_pages
+        if num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > on_each_side + on_ends + 2:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if not self.count_is_exact:
+            yield from range(
+                number + 1, min(number + on_each_side, num_pages) + 1
+            )
+            if number + on_each_side < num_pages:
+                yield self.ELLIPSIS
+        elif number < num_pages - on_each_side - on_ends - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(num_pages - on_ends + 1, num_pages + 1)
+        else:
+            yield from range(number + 1, num_pages + 1)
+
+    def _get_page(self, *args, **kwargs):
+        page = super()._get_page(*args, **kwargs)
+        page.cursor = None
+        page.previous_cursor = page.next_cursor = None
+        return page
+
+    def settle_count(self, count):
+        """Заменяет переоцененное число записей настоящим, в том числе
+        в кеше estimate_count, чтобы ссылки вели только на страницы с
+        записями.
+        """
+        cache.set(
+            count_cache_key(self.object_list), count, COUNT_CACHE_TIMEOUT
+        )
+        self.__dict__['count'] = count
+        self.__dict__.pop('num_pages', None)
+        self.count_is_exact = True
+
+    def page(self, number):
+        page = super().page(number)
+        page.object_list = list(page.object_list)
+        if not self.count_is_exact and len(page.object_list) < self.per_page:
+            # Планировщик переоценил выборку: неполная страница последняя,
+            # а за пустой записи кончились раньше
+            if page.object_list:
+                self.settle_count(
+                    page.start_index() - 1 + len(page.object_list)
+                )
+            else:
+                self.settle_count(self.object_list.count())
+                return self.page(self.num_pages)
+        page.elided_page_range = list(
+            self.get_elided_page_range(page.number)
+        )
+        # При приближенном подсчете полная страница может быть не последней
+        has_next = page.has_next() or (
+            not self.count_is_exact
+            and len(page.object_list) == self.per_page
+        )
+        if page.object_list:
+            if page.has_previous():
+                page.previous_cursor = encode_cursor(
+                    page.object_list[0], CURSOR_PREVIOUS
+                )
+            if has_next:
+                page.next_cursor = encode_cursor(
+                    page.object_list[-1], CURSOR_NEXT
+                )
+        return page
+
+    def _cursor_window(self, direction, pub_date, pk, limit):
+        """Возвращает до limit записей после позиции (pub_date, pk)
+        в порядке удаления от нее.
+        """
+        if direction == CURSOR_NEXT:
+            object_list = self.object_list.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+            )
+        else:
+            object_list = self.object_list.filter(
+                Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk)
+            ).reverse()
+        return list(object_list[:limit])
+
+    def cursor_page(self, cursor):
+        """Возвращает страницу, соседнюю с позицией из курсора.
+
+        Номер такой страницы неизвестен, поэтому page.number равен None,
+        а навигация строится по page.previous_cursor и page.next_cursor.
+        """
+        direction, pub_date, pk = decode_cursor(cursor)
+        # Лишняя запись показывает, есть ли что-то дальше по направлению
+        object_list = self._cursor_window(
+            direction, pub_date, pk, self.per_page + 1
+        )
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if direction == CURSOR_PREVIOUS:
+            object_list.reverse()
+        page = self._get_page(object_list, None, self)
+        page.cursor = cursor
+        if object_list:
+            if direction == CURSOR_NEXT or has_more:
+                page.previous_cursor = encode_cursor(
+                    object_list[0], CURSOR_PREVIOUS
+                )
+            if direction == CURSOR_PREVIOUS or has_more:
+                page.next_cursor = encode_cursor(
+                    object_list[-1], CURSOR_NEXT
+                )
+        return page
+
 
-def pagination(request, objects):
-    paginator = Paginator(objects, POST_LIMIT)
+def pagination(request, objects, paginator_class=CursorPaginator):
+    paginator = paginator_class(objects, POST_LIMIT)
+    cursor = request.GET.get('cursor')
+    if cursor and decode_cursor(cursor):
+        return paginator.cursor_page(cursor)
     page_number = request.GET.get('page')
     return paginator.get_page(page_number)
@@ -1,57 +1,134 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
 
+from core.cache import add_cache_tags, cache_tagged_page
+from core.static_pages import publish_for_anonymous
+
+from .counters import counter_value, pending_value
+from .entities import get_author_or_404, get_group_or_404
+from .feeds import follow_page
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Follow, Post
+from .signals import refresh_post_pages
+from .tags import (author_tag, group_tag, group_tags, index_tags,
+                   post_detail_tags, profile_tags)
+from .thumbnails import post_thumbnails
 from .utils import pagination
 
+# Фрагменты лент адресуются курсором, поэтому браузер может хранить их дольше
+FRAGMENT_CACHE_TIMEOUT = 60 * 5
+# Страницы сбрасываются по тегам при изменении данных (см. posts.signals)
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def render_fragment(request, page_obj):
+    """Отдает только карточки постов страницы, без шаблона base.html."""
+    context = {
+        'page_obj': page_obj,
+        'fragment': True,
+        'fragment_url': request.path,
+    }
+    return render(request, 'posts/includes/post_cards.html', context)
+
 
-@cache_page(20, key_prefix='index_page')
+@publish_for_anonymous
+@cache_tagged_page(PAGE_CACHE_TIMEOUT, 'index_page', index_tags)
 def index(request):
-    post_list = Post.objects.all()
+    post_list = Post.objects.for_cards()
     page_obj = pagination(request, post_list)
     context = {
         'page_obj': page_obj,
+        'fragment_url': reverse('posts:index_fragment'),
     }
     return render(request, 'posts/index.html', context)
 
 
+@cache_control(private=True, max_age=FRAGMENT_CACHE_TIMEOUT)
+@cache_tagged_page(PAGE_CACHE_TIMEOUT, 'index_fragment', index_tags)
+def index_fragment(request):
+    return render_fragment(
+        request, pagination(request, Post.objects.for_cards())
+    )
+
+
+@publish_for_anonymous
+@cache_tagged_page(PAGE_CACHE_TIMEOUT, 'group_page', group_tags)
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
+    group = get_group_or_404(slug)
+    post_list = group.posts.for_cards()
     page_obj = pagination(request, post_list)
     context = {
         'group': group,
         'page_obj': page_obj,
+        'fragment_url': reverse('posts:group_posts_fragment', args=[slug]),
     }
     return render(request, 'posts/group_list.html', context)
 
 
-def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    page_obj = pagination(request, posts)
-    following = request.user.is_authenticated and User.objects.filter(
-        following__user=request.user
+@cache_control(private=True, max_age=FRAGMENT_CACHE_TIMEOUT)
+@cache_tagged_page(PAGE_CACHE_TIMEOUT, 'group_fragment', group_tags)
+def group_posts_fragment(request, slug):
+    group = get_group_or_404(slug)
+    return render_fragment(
+        request, pagination(request, group.posts.for_cards())
     )
+
+
+@publish_for_anonymous
+@cache_tagged_page(PAGE_CACHE_TIMEOUT, 'profile_page', profile_tags)
+def profile(request, username):
+    author = get_author_or_404(username)
+    add_cache_tags(request, author_tag(author.pk))
+    page_obj = pagination(request, author.posts.for_cards())
     context = {
         'author': author,
-        'posts': posts,
+        'followers_count': counter_value(
+            author.profile, 'followers_count', author.followers_pending
+        ),
         'page_obj': page_obj,
-        'following': following
+        'fragment_url': reverse('posts:profile_fragment', args=[username]),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@cache_control(private=True, max_age=FRAGMENT_CACHE_TIMEOUT)
+@cache_tagged_page(PAGE_CACHE_TIMEOUT, 'profile_fragment', profile_tags)
+def profile_fragment(request, username):
+    author = get_author_or_404(username)
+    add_cache_tags(request, author_tag(author.pk))
+    return render_fragment(
+        request, pagination(request, author.posts.for_cards())
+    )
+
+
+@publish_for_anonymous
+@cache_tagged_page(PAGE_CACHE_TIMEOUT, 'post_detail', post_detail_tags)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.for_detail().annotate(
+            comments_pending=pending_value(Post, 'comments_count')
+        ),
+        pk=post_id
+    )
+    add_cache_tags(request, author_tag(post.author_id))
+    if post.group_id:
+        add_cache_tags(request, group_tag(post.group.slug))
     form = CommentForm(request.POST or None)
-    comments = post.comments.all()
+    comments = post.comments.select_related('author').only(
+        'text', 'post', 'author', 'author__username'
+    ).order_by('created')
     context = {
         'post': post,
         'form': form,
-        'comments': comments
+        'comments': comments,
+        'comments_count': counter_value(
+            post, 'comments_count', post.comments_pending
+        ),
+        'thumbnail': post_thumbnails(
+            [post], refresh_post_pages
+        ).get(post.pk),
     }
     return render(request, 'posts/post_detail.html', context)
 
@@ -105,17 +182,23 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = pagination(request, post_list)
+    page_obj = follow_page(request)
     context = {
         'page_obj': page_obj,
+        'fragment_url': reverse('posts:follow_index_fragment'),
     }
     return render(request, 'posts/follow.html', context)
 
 
+@login_required
+@cache_control(private=True, max_age=FRAGMENT_CACHE_TIMEOUT)
+def follow_index_fragment(request):
+    return render_fragment(request, follow_page(request))
+
+
 @login_required
 def profile_follow(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_author_or_404(username)
     already_following = Follow.objects.filter(
         user=request.user,
         author=author
@@ -128,7 +211,7 @@ def profile_follow(request, username):
 
 @login_required
 def profile_follow_success(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_author_or_404(username)
     context = {
         'author': author,
     }
@@ -137,14 +220,14 @@ def profile_follow_success(request, username):
 
 @login_required
 def profile_unfollow(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_author_or_404(username)
     Follow.objects.filter(user=request.user, author=author).delete()
     return redirect('posts:profile_unfollow_success', username=username)
 
 
 @login_required
 def profile_unfollow_success(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_author_or_404(username)
     context = {
         'author': author,
     }
@@ -56,6 +56,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'core.context_processors.year.year',
+                'core.context_processors.follows.follows',
             ],
         },
     },
@@ -109,6 +110,11 @@ STATIC_ROOT = '/var/www/static/yatube/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/var/www/media/yatube/'
 
+# Сколько процессов создают миниатюры картинок постов (см.
+# posts.thumbnails); 0 - отказ от пула: миниатюра создается в запросе,
+# сохранившем пост, это годится только для разработки
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', default=1))
+
 
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -128,12 +134,53 @@ SERVER_EMAIL = os.getenv('SERVER_EMAIL')
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# Для нескольких воркеров на одном сервере - общий для процессов кеш:
+# CACHE_BACKEND=core.cache_backends.SQLiteCache или, с LRU в памяти
+# каждого процесса перед ним, core.cache_backends.TieredCache и путь
+# к файлу в CACHE_LOCATION (см. bench_cache)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
+        # Ленте 'pull' нужен список последних постов каждого автора
+        'OPTIONS': {'MAX_ENTRIES': 20000},
     }
 }
 
+# Статистика кеша по группам ключей: manage.py cache_stats
+# и /admin/cache-stats/ (см. core.cache_backends.InstrumentedCache)
+if os.getenv('CACHE_STATS', 'False') == 'True':
+    CACHES['default'] = {
+        'BACKEND': 'core.cache_backends.InstrumentedCache',
+        'LOCATION': CACHES['default']['LOCATION'],
+        'OPTIONS': {
+            'BACKEND': CACHES['default']['BACKEND'],
+            **CACHES['default']['OPTIONS'],
+        },
+    }
+
+# Лента подписок: 'timeline' - материализованная лента (fan-out on write),
+# 'pull' - слияние закешированных списков последних постов авторов,
+# 'join' - выборка постов через JOIN по подпискам.
+# При переключении на 'timeline' ленты пересобираются rebuild_timelines
+# Новые посты раскладывает по лентам команда fan_out_timelines
+FOLLOW_FEED_ENGINE = os.getenv('FOLLOW_FEED_ENGINE', default='timeline')
+# Сколько последних постов хранится в ленте каждого пользователя
+TIMELINE_LENGTH = 800
+# Посты авторов с большим числом подписчиков не раскладываются по лентам,
+# а подмешиваются в ленту при чтении
+TIMELINE_FANOUT_LIMIT = 5000
+# Сколько последних постов автора хранится в кеше для ленты 'pull'
+RECENT_POSTS_LENGTH = 200
+# На сколько строк делятся горячие счетчики (комментарии, подписчики)
+COUNTER_SHARDS = 8
+# Каталог, в который публикуются страницы для анонимных посетителей,
+# чтобы их отдавал nginx; пустое значение выключает публикацию
+STATIC_PAGES_ROOT = os.getenv('STATIC_PAGES_ROOT', default='')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,